@@ -1,10 +1,19 @@
+import hashlib
+import heapq
 import json
+import logging
+import os
+import time
+import unicodedata
+from collections import defaultdict
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
 
 BASE_PATH = Path(__file__).resolve().parent
 AIRPORTS_FILE = f"{BASE_PATH}/airports.json"
 
+LOGGER = logging.getLogger("app.airports")
+
 
 def load_airports(filename: str = AIRPORTS_FILE) -> Dict[str, str]:
     """
@@ -15,12 +24,244 @@ def load_airports(filename: str = AIRPORTS_FILE) -> Dict[str, str]:
         with open(filename, "r") as file:
             cities = json.load(file)
         aiports = {
-            city["iata"]: f"{city['city']} | {city['name']}"
-            for city in cities
-            if city["type"] == "AIRPORT"
-            and (city["countryAlpha2"] == "BR" or city["countryAlpha2"] == "PT")
+            city["iata"]: airport_label(city) for city in cities if is_bookable(city)
         }
     except FileNotFoundError:
         return []
 
     return aiports
+
+
+def is_bookable(city: dict) -> bool:
+    """
+    Only airports in Brazil and Portugal can be searched
+    """
+    return city["type"] == "AIRPORT" and (
+        city["countryAlpha2"] == "BR" or city["countryAlpha2"] == "PT"
+    )
+
+
+def airport_label(city: dict) -> str:
+    return f"{city['city']} | {city['name']}"
+
+
+def normalize(text: str) -> str:
+    """
+    Lower case text without accents, so "São" matches "sao"
+    """
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    ).lower()
+
+
+def _trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class AirportIndex:
+    """
+    Search index over the iata code, city and airport name.
+    Every prefix of every word is precomputed (a flattened trie), so a prefix lookup
+    is a single dict access. Queries without prefix matches fall back to the
+    trigrams of the words, which tolerate typos.
+    """
+
+    # Weight of a prefix match in each field
+    _field_weights = {"iata": 3, "city": 2, "name": 1}
+    _exact_iata_bonus = 10
+    # Minimum share of the query trigrams an airport must have to be returned
+    _min_trigram_similarity = 0.5
+
+    def __init__(self, cities: List[dict]):
+        self._airports = [
+            {"iata": city["iata"], "city": city["city"], "name": city["name"]}
+            for city in cities
+        ]
+        self._prefixes = defaultdict(dict)
+        self._trigrams = defaultdict(set)
+        self._iatas = defaultdict(list)
+        for position, airport in enumerate(self._airports):
+            self._iatas[normalize(airport["iata"])].append(position)
+            for field, weight in self._field_weights.items():
+                for word in normalize(airport[field]).split():
+                    for end in range(1, len(word) + 1):
+                        matches = self._prefixes[word[:end]]
+                        matches[position] = max(matches.get(position, 0), weight)
+                    for trigram in _trigrams(word):
+                        self._trigrams[trigram].add(position)
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """
+        Every word of the query must be the prefix of a word of the airport. Airports
+        are ranked by the fields matched (iata, then city, then name).
+        :return: List of Dict: {iata, city, name, label}
+        """
+        words = normalize(query).split()
+        if not words:
+            return []
+
+        scores = dict(self._prefixes.get(words[0], {}))
+        for word in words[1:]:
+            matches = self._prefixes.get(word, {})
+            scores = {
+                position: score + matches[position]
+                for position, score in scores.items()
+                if position in matches
+            }
+        for position in self._iatas.get(words[0], ()):
+            if position in scores:
+                scores[position] += self._exact_iata_bonus
+
+        if not scores:
+            scores = self._trigram_scores(words)
+
+        best = heapq.nsmallest(
+            limit,
+            scores.items(),
+            key=lambda item: (-item[1], self._airports[item[0]]["iata"]),
+        )
+        return [
+            {
+                **self._airports[position],
+                "label": airport_label(self._airports[position]),
+            }
+            for position, _ in best
+        ]
+
+    def _trigram_scores(self, words: List[str]) -> dict:
+        query_trigrams = set().union(*(_trigrams(word) for word in words))
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for position in self._trigrams.get(trigram, ()):
+                shared[position] += 1
+        return {
+            position: count / len(query_trigrams)
+            for position, count in shared.items()
+            if count / len(query_trigrams) >= self._min_trigram_similarity
+        }
+
+
+class AirportRegistry:
+    """
+    Airports loaded once and kept in memory, indexed by iata code.
+    The file is loaded again when its modification time changes. A file that can
+    not be loaded, e.g. read while it is written, leaves the previous airports and
+    is tried again on the next check.
+    The json served by /airports is serialized only once per load.
+    """
+
+    # Minimum number of seconds between two checks of the file modification time
+    _check_interval = 1.0
+
+    def __init__(self, filename: str = AIRPORTS_FILE):
+        self._filename = filename
+        self._mtime = None
+        self._checked_at = None
+        self._airports = {}
+        self._index = AirportIndex([])
+        self._metro_areas = {}
+        self._json = b"{}"
+        self._etag = ""
+        self._reload_if_changed()
+
+    @property
+    def airports(self) -> Dict[str, str]:
+        """
+        :return: Dict -> {Iata Code:City Name | Airport Name}
+        """
+        self._reload_if_changed()
+        return self._airports
+
+    @property
+    def json(self) -> bytes:
+        self._reload_if_changed()
+        return self._json
+
+    @property
+    def etag(self) -> str:
+        self._reload_if_changed()
+        return self._etag
+
+    @property
+    def index(self) -> AirportIndex:
+        self._reload_if_changed()
+        return self._index
+
+    @property
+    def metro_areas(self) -> Dict[str, List[str]]:
+        """
+        Airports of the same city, when the city has more than one
+        :return: Dict -> {City Iata Code: [Airport Iata Code]}
+        """
+        self._reload_if_changed()
+        return self._metro_areas
+
+    def get(self, iata: str) -> Optional[str]:
+        return self.airports.get(iata)
+
+    def expand(self, code: str) -> List[str]:
+        """
+        :return: The airports of a metro area code, the airport itself for an airport
+        code or an empty list if the code is unknown
+        """
+        if code in self.airports:
+            return [code]
+        return self.metro_areas.get(code, [])
+
+    def __len__(self) -> int:
+        return len(self.airports)
+
+    def _reload_if_changed(self) -> None:
+        now = time.monotonic()
+        if (
+            self._checked_at is not None
+            and now - self._checked_at < self._check_interval
+        ):
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._filename).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            with open(self._filename, "r") as file:
+                cities = [city for city in json.load(file) if is_bookable(city)]
+            labels = {city["iata"]: airport_label(city) for city in cities}
+            index = AirportIndex(cities)
+            cities_airports = defaultdict(list)
+            for city in cities:
+                if city.get("cityIsoCode"):
+                    cities_airports[(city["city"], city["cityIsoCode"])].append(
+                        city["iata"]
+                    )
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            LOGGER.error(f"Could not load {self._filename}: {error!r}")
+            return
+        self._airports = labels
+        self._index = index
+        self._metro_areas = {
+            city_iata: sorted(airports)
+            for (_, city_iata), airports in cities_airports.items()
+            if len(airports) > 1
+        }
+        self._json = json.dumps(self._airports, ensure_ascii=False).encode()
+        self._etag = f'"{hashlib.sha1(self._json).hexdigest()}"'
+        self._mtime = mtime
+
+
+_REGISTRY = None
+
+
+def get_airport_registry() -> AirportRegistry:
+    """
+    :return: The process wide AirportRegistry
+    """
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = AirportRegistry()
+    return _REGISTRY
@@ -0,0 +1,377 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import date
+from itertools import islice
+
+from settings import (
+    ALERTS_FILE_PATH,
+    ALERTS_MAX_CELLS_PER_ROUTE,
+    ALERTS_SINK,
+    HISTORY_SQLITE_PATH,
+)
+from validators import AlertRule
+
+LOGGER = logging.getLogger("app.alerts")
+
+
+class AlertSink(ABC):
+    """
+    Where the price drop alerts are delivered
+    """
+
+    @abstractmethod
+    def deliver(self, alerts: list[dict]) -> None:
+        raise NotImplementedError
+
+
+class LogSink(AlertSink):
+    def deliver(self, alerts: list[dict]) -> None:
+        for alert in alerts:
+            LOGGER.info(f"Price alert: {json.dumps(alert)}")
+
+
+class FileSink(AlertSink):
+    """
+    Appends the alerts to a file, one json per line
+    """
+
+    def __init__(self, path: str = ALERTS_FILE_PATH):
+        self._path = path
+
+    def deliver(self, alerts: list[dict]) -> None:
+        with open(self._path, "a") as file:
+            file.writelines(json.dumps(alert) + "\n" for alert in alerts)
+
+
+class MemorySink(AlertSink):
+    """
+    Keeps the last alerts in memory, a stand-in for a webhook
+    """
+
+    def __init__(self, max_alerts: int = 1000):
+        self.alerts = deque(maxlen=max_alerts)
+
+    def deliver(self, alerts: list[dict]) -> None:
+        self.alerts.extend(alerts)
+
+
+class _RouteRules:
+    """
+    Rules of a route sorted by threshold, so the rules crossed by a price change
+    are found with a bisect instead of checking all of them
+    """
+
+    def __init__(self):
+        self.thresholds = []
+        self.rule_ids = []
+
+    def add(self, threshold: float, rule_id: int) -> None:
+        index = bisect_right(self.thresholds, threshold)
+        self.thresholds.insert(index, threshold)
+        self.rule_ids.insert(index, rule_id)
+
+    def remove(self, threshold: float, rule_id: int) -> None:
+        index = bisect_left(self.thresholds, threshold)
+        while self.rule_ids[index] != rule_id:
+            index += 1
+        del self.thresholds[index]
+        del self.rule_ids[index]
+
+    def crossed(self, price: float, previous_price: float) -> list[int]:
+        """
+        :return: Ids of the rules with price < threshold <= previous_price
+        """
+        return self.rule_ids[
+            bisect_right(self.thresholds, price) : bisect_right(
+                self.thresholds, previous_price
+            )
+        ]
+
+
+class AlertEngine:
+    """
+    Evaluates the price drop rules incrementally: each new response is compared
+    with the last prices of its route and airline, each airline tracked apart so
+    the prices of two airlines are not taken for drops, and only the cells whose
+    price dropped are
+    checked, against the rules of that route whose threshold the drop crossed.
+    A rule is notified again for a cell only after its price goes back up to the
+    threshold and drops again.
+    The rules are stored in sqlite, next to the price history, so every worker
+    sees the rules added or removed by the others: the in memory index is rebuilt
+    when the database changed since it was last read. The last prices stay in
+    memory, at most max_cells_per_route of each route and airline, the least
+    recently seen ones are forgotten first.
+    The searches evaluate their responses from the thread of the price history
+    (see PriceHistory.run_later) and the /alerts endpoints from the threadpool of
+    the server, so every method holds a lock.
+    """
+
+    def __init__(
+        self,
+        sink: AlertSink | None = None,
+        path: str = HISTORY_SQLITE_PATH,
+        max_cells_per_route: int = ALERTS_MAX_CELLS_PER_ROUTE,
+    ):
+        self._sink = sink or LogSink()
+        self._max_cells_per_route = max_cells_per_route
+        self._lock = threading.Lock()
+        # rule_id -> (rule, (departure_from, departure_to, return_from, return_to))
+        self._rules = {}
+        self._routes = {}
+        # (origin, destination) -> {airline: {(departure_date, return_date): price}}
+        self._last_prices = {}
+        self._evaluated_cells = 0
+        self._checked_rules = 0
+        self._matches = 0
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS alert_rules ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "origin TEXT NOT NULL, destination TEXT NOT NULL, "
+                "departure_from TEXT NOT NULL, departure_to TEXT NOT NULL, "
+                "return_from TEXT, return_to TEXT, threshold REAL NOT NULL)"
+            )
+        self._data_version = None
+        self._sync()
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {rules:int, evaluated_cells:int, checked_rules:int, matches:int}
+        """
+        return {
+            "rules": len(self._rules),
+            "evaluated_cells": self._evaluated_cells,
+            "checked_rules": self._checked_rules,
+            "matches": self._matches,
+        }
+
+    def add(self, rule: AlertRule) -> tuple[int, list[dict]]:
+        """
+        Registers the rule and checks it against the last known prices of the route
+        :return: Tuple (rule_id, alerts delivered for the known prices)
+        """
+        with self._lock:
+            self._sync()
+            with self._connection:
+                rule_id = self._connection.execute(
+                    "INSERT INTO alert_rules (origin, destination, departure_from, "
+                    "departure_to, return_from, return_to, threshold) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        rule.origin,
+                        rule.destination,
+                        rule.departure_from.isoformat(),
+                        rule.departure_to.isoformat(),
+                        rule.return_from.isoformat() if rule.return_from else None,
+                        rule.return_to.isoformat() if rule.return_to else None,
+                        rule.threshold,
+                    ),
+                ).lastrowid
+            dates = self._index(rule_id, rule)
+            route = (rule.origin, rule.destination)
+
+            alerts = [
+                self._alert(rule_id, airline, departure_date, return_date, price, None)
+                for airline, last_prices in self._last_prices.get(route, {}).items()
+                for (departure_date, return_date), price in last_prices.items()
+                if 0 < price < rule.threshold
+                and self._in_range(dates, departure_date, return_date)
+            ]
+            self._deliver(alerts)
+            return rule_id, alerts
+
+    def get(self, rule_id: int) -> AlertRule | None:
+        with self._lock:
+            self._sync()
+            rule = self._rules.get(rule_id)
+            return rule[0] if rule else None
+
+    def remove(self, rule_id: int) -> bool:
+        """
+        :return: False if there was no rule with the id
+        """
+        with self._lock:
+            self._sync()
+            with self._connection:
+                deleted = self._connection.execute(
+                    "DELETE FROM alert_rules WHERE id = ?", (rule_id,)
+                ).rowcount
+            if rule_id in self._rules:
+                self._unindex(rule_id)
+            return bool(deleted)
+
+    def evaluate(
+        self, airline: str, origin: str, destination: str, flights: dict
+    ) -> list[dict]:
+        """
+        Checks a new response of the airline in the format
+        {departure_date: {return_date: price}}
+        :return: Alerts delivered
+        """
+        with self._lock:
+            self._sync()
+            route_rules = self._routes.get((origin, destination))
+            if route_rules is None:
+                return []
+
+            last_prices = self._last_prices.setdefault(
+                (origin, destination), {}
+            ).setdefault(airline, {})
+            alerts = []
+            for departure_date, return_dates in flights.items():
+                for return_date, price in return_dates.items():
+                    if price is None:
+                        continue
+                    cell = (departure_date, return_date)
+                    # Moved to the end, the least recently seen cells are the first ones
+                    previous_price = last_prices.pop(cell, None)
+                    last_prices[cell] = price
+                    self._evaluated_cells += 1
+                    if not price or price == previous_price:
+                        continue
+                    rule_ids = route_rules.crossed(price, previous_price or math.inf)
+                    self._checked_rules += len(rule_ids)
+                    for rule_id in rule_ids:
+                        if self._in_range(
+                            self._rules[rule_id][1], departure_date, return_date
+                        ):
+                            alerts.append(
+                                self._alert(
+                                    rule_id,
+                                    airline,
+                                    departure_date,
+                                    return_date,
+                                    price,
+                                    previous_price,
+                                )
+                            )
+            excess = len(last_prices) - self._max_cells_per_route
+            if excess > 0:
+                for cell in list(islice(last_prices, excess)):
+                    del last_prices[cell]
+            self._deliver(alerts)
+            return alerts
+
+    def _sync(self) -> None:
+        """
+        Rebuilds the rules from the database when another connection changed it
+        """
+        data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        rows = self._connection.execute(
+            "SELECT id, origin, destination, departure_from, departure_to, "
+            "return_from, return_to, threshold FROM alert_rules"
+        ).fetchall()
+        stored = {row[0]: row for row in rows}
+        for rule_id in [rule_id for rule_id in self._rules if rule_id not in stored]:
+            self._unindex(rule_id)
+        for rule_id, row in stored.items():
+            if rule_id in self._rules:
+                continue
+            _, origin, destination, *dates, threshold = row
+            # Not validated again, departure_from may be in the past by now
+            rule = AlertRule.construct(
+                origin=origin,
+                destination=destination,
+                departure_from=date.fromisoformat(dates[0]),
+                departure_to=date.fromisoformat(dates[1]),
+                return_from=date.fromisoformat(dates[2]) if dates[2] else None,
+                return_to=date.fromisoformat(dates[3]) if dates[3] else None,
+                threshold=threshold,
+            )
+            self._index(rule_id, rule)
+
+    def _index(self, rule_id: int, rule: AlertRule) -> tuple:
+        """
+        :return: The dates of the rule, compared with the ones of the cells
+        """
+        dates = (
+            rule.departure_from.isoformat(),
+            rule.departure_to.isoformat(),
+            rule.return_from.isoformat() if rule.return_from else "",
+            rule.return_to.isoformat() if rule.return_to else "9999-12-31",
+        )
+        self._rules[rule_id] = (rule, dates)
+        route = (rule.origin, rule.destination)
+        self._routes.setdefault(route, _RouteRules()).add(rule.threshold, rule_id)
+        return dates
+
+    def _unindex(self, rule_id: int) -> None:
+        rule, _ = self._rules.pop(rule_id)
+        route = (rule.origin, rule.destination)
+        self._routes[route].remove(rule.threshold, rule_id)
+        if not self._routes[route].rule_ids:
+            del self._routes[route]
+            self._last_prices.pop(route, None)
+
+    @staticmethod
+    def _in_range(dates: tuple, departure_date: str, return_date: str) -> bool:
+        departure_from, departure_to, return_from, return_to = dates
+        return (
+            departure_from <= departure_date <= departure_to
+            and return_from <= return_date <= return_to
+        )
+
+    def _alert(
+        self,
+        rule_id: int,
+        airline: str,
+        departure_date: str,
+        return_date: str,
+        price: float,
+        previous_price: float | None,
+    ) -> dict:
+        rule = self._rules[rule_id][0]
+        return {
+            "rule_id": rule_id,
+            "airline": airline,
+            "origin": rule.origin,
+            "destination": rule.destination,
+            "departure_date": departure_date,
+            "return_date": return_date,
+            "price": price,
+            "previous_price": previous_price,
+            "threshold": rule.threshold,
+        }
+
+    def _deliver(self, alerts: list[dict]) -> None:
+        if not alerts:
+            return
+        self._matches += len(alerts)
+        try:
+            self._sink.deliver(alerts)
+        except Exception as error:
+            LOGGER.error(f"Could not deliver {len(alerts)} alerts: {error}")
+
+
+_ALERT_ENGINE = None
+
+
+def get_alert_engine() -> AlertEngine:
+    """
+    :return: The process wide AlertEngine, delivering to the ALERTS_SINK setting
+    """
+    global _ALERT_ENGINE
+    if _ALERT_ENGINE is None:
+        if ALERTS_SINK == "file":
+            sink = FileSink()
+        elif ALERTS_SINK == "memory":
+            sink = MemorySink()
+        else:
+            sink = LogSink()
+        _ALERT_ENGINE = AlertEngine(sink)
+    return _ALERT_ENGINE
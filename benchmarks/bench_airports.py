@@ -0,0 +1,58 @@
+"""
+Measures the AirportIndex over every airport of airports.json, not only the ones
+that can be booked (Brazil and Portugal).
+
+Usage: python -m benchmarks.bench_airports [--repeat 1000]
+Prints one json line with the build time and one per query.
+"""
+import argparse
+import json
+import time
+
+from airports import AIRPORTS_FILE, AirportIndex
+
+QUERIES = [
+    "s",
+    "sao",
+    "são paulo",
+    "gru",
+    "rio de",
+    "lisb",
+    "new york",
+    "frnkfurt",
+    "xyz",
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    with open(AIRPORTS_FILE, "r") as file:
+        cities = [city for city in json.load(file) if city["type"] == "AIRPORT"]
+
+    start = time.perf_counter()
+    index = AirportIndex(cities)
+    build_time = time.perf_counter() - start
+    print(json.dumps({"airports": len(cities), "build_ms": round(build_time * 1e3, 1)}))
+
+    for query in QUERIES:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            results = index.search(query)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(
+            json.dumps(
+                {
+                    "query": query,
+                    "us_per_query": round(elapsed * 1e6, 1),
+                    "top": [airport["iata"] for airport in results[:3]],
+                },
+                ensure_ascii=False,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark of the price drop alerts: incremental AlertEngine against checking every
+rule on every cell of each new response.
+
+Usage: python -m benchmarks.bench_alerts [--rules 100000] [--routes 50] [--windows 300]
+Registers --rules random rules over --routes routes, then evaluates --windows
+generated 7x7 responses whose prices drift down over time.
+Prints one json line per evaluator.
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+from unittest import mock
+
+from alerts import AlertEngine, MemorySink
+from benchmarks.mock_latam import build_bestprices
+from scrapers import LatamFinder
+from validators import AlertRule
+
+
+def full_scan(rules: list, origin: str, destination: str, flights: dict) -> int:
+    """Checks every rule against every cell, without remembering the last prices"""
+    matches = 0
+    for rule in rules:
+        if (rule.origin, rule.destination) != (origin, destination):
+            continue
+        departure_from = rule.departure_from.isoformat()
+        departure_to = rule.departure_to.isoformat()
+        for departure_date, return_dates in flights.items():
+            if not departure_from <= departure_date <= departure_to:
+                continue
+            for price in return_dates.values():
+                if price and price < rule.threshold:
+                    matches += 1
+    return matches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rules", type=int, default=100_000)
+    parser.add_argument("--routes", type=int, default=50)
+    parser.add_argument("--windows", type=int, default=300)
+    args = parser.parse_args()
+
+    random.seed(1)
+    first_date = date.today() + timedelta(days=1)
+    routes = [(f"A{number:02d}", f"B{number:02d}") for number in range(args.routes)]
+
+    # The registry only knows the real airports
+    with mock.patch("validators.get_airport_registry") as registry:
+        registry.return_value.get.return_value = "airport"
+        rules = []
+        for _ in range(args.rules):
+            origin, destination = random.choice(routes)
+            departure_from = first_date + timedelta(days=random.randrange(60))
+            rules.append(
+                AlertRule(
+                    origin=origin,
+                    destination=destination,
+                    departure_from=departure_from,
+                    departure_to=departure_from
+                    + timedelta(days=random.randrange(1, 30)),
+                    threshold=random.uniform(300, 600),
+                )
+            )
+
+    engine = AlertEngine(MemorySink(max_alerts=10), ":memory:")
+    start = time.perf_counter()
+    for rule in rules:
+        engine.add(rule)
+    print(
+        json.dumps(
+            {
+                "step": "register",
+                "rules": len(rules),
+                "seconds": round(time.perf_counter() - start, 2),
+            }
+        )
+    )
+
+    windows = []
+    for number in range(args.windows):
+        origin, destination = routes[number % len(routes)]
+        window_date = first_date + timedelta(days=7 * random.randrange(9))
+        flights = LatamFinder._reformat_latam_response(
+            build_bestprices(window_date, window_date)
+        )["flights"]
+        drift = number / args.windows * 300
+        windows.append(
+            (
+                origin,
+                destination,
+                {
+                    departure_date: {
+                        return_date: price and round(price - drift, 2)
+                        for return_date, price in return_dates.items()
+                    }
+                    for departure_date, return_dates in flights.items()
+                },
+            )
+        )
+
+    evaluators = {
+        "incremental": lambda window: len(engine.evaluate("latam", *window)),
+        "full_scan": lambda window: full_scan(rules, *window),
+    }
+    for name, evaluate in evaluators.items():
+        matches = 0
+        start = time.perf_counter()
+        for window in windows:
+            matches += evaluate(window)
+        elapsed = time.perf_counter() - start
+        print(
+            json.dumps(
+                {
+                    "evaluator": name,
+                    "windows": len(windows),
+                    "matches": matches,
+                    "ms_per_window": round(elapsed / len(windows) * 1e3, 3),
+                }
+            )
+        )
+    print(json.dumps({"step": "incremental_stats", **engine.stats}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Throughput of a batch of routes searched one after the other (separate calls)
+against the same routes searched together through the shared scheduler.
+
+Usage: python -m benchmarks.bench_batch [--routes 20] [--latency 0.2]
+Prints one json line per mode.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from datetime import date, timedelta
+
+from benchmarks.mock_latam import URL, MockLatamServer
+
+os.environ.setdefault("LATAM_BESTPRICES_URL", URL)
+
+from airports import get_airport_registry  # noqa: E402
+from cache import get_cache  # noqa: E402
+from main import search_batch  # noqa: E402
+from scheduler import get_scheduler  # noqa: E402
+from scrapers import LatamFinder  # noqa: E402
+from validators import FlightData  # noqa: E402
+
+
+async def sequential(flights: list) -> None:
+    for flight in flights:
+        await LatamFinder(flight).get_all_flights()
+
+
+async def batch(departure_date: str, destinations: list) -> None:
+    await search_batch(
+        {
+            "departure_date": departure_date,
+            "origin": "CGH",
+            "destinations": destinations,
+        }
+    )
+
+
+def measure(mode: str, coroutine, routes: int) -> dict:
+    get_cache().clear()
+    start = time.perf_counter()
+    asyncio.run(coroutine)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "routes": routes,
+        "time_s": round(elapsed, 3),
+        "routes_per_s": round(routes / elapsed, 2),
+        "scheduler": get_scheduler().stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    departure_date = (date.today() + timedelta(days=10)).isoformat()
+    destinations = [iata for iata in get_airport_registry().airports if iata != "CGH"][
+        : args.routes
+    ]
+    flights = [
+        FlightData(departure_date=departure_date, origin="CGH", destination=destination)
+        for destination in destinations
+    ]
+
+    with MockLatamServer(latency=args.latency):
+        print(json.dumps(measure("sequential", sequential(flights), len(flights))))
+        print(
+            json.dumps(
+                measure("batch", batch(departure_date, destinations), len(flights))
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Size and encoding time of the flights grid in the response formats.
+
+Usage: python -m benchmarks.bench_formats [--days 21 90] [--repeat 20]
+Builds a --days x --days grid of generated prices and encodes it as the default
+json, the compact json and MessagePack (when installed), each raw, gzip and brotli
+(when installed) compressed.
+Prints one json line per grid size and format.
+"""
+import argparse
+import gzip
+import json
+import time
+from datetime import date, timedelta
+
+from benchmarks.mock_latam import WINDOW_DAYS, build_bestprices
+from matrix import PriceMatrix
+from scrapers import LatamFinder
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def build_flights(first_date: date, days: int) -> dict:
+    """
+    Merges the generated 7x7 windows of a search of days, as get_all_flights does
+    :return: Grid in the format {departure_date: {return_date: price}}
+    """
+    matrix = PriceMatrix(first_date, days)
+    for dep in range(0, days, WINDOW_DAYS):
+        for ret in range(dep, days, WINDOW_DAYS):
+            api_response = build_bestprices(
+                first_date + timedelta(days=dep), first_date + timedelta(days=ret)
+            )
+            matrix.merge(LatamFinder._reformat_latam_response(api_response)["flights"])
+    return matrix.to_dict()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, nargs="+", default=[21, 90])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    encoders = {
+        "json": lambda flights: json.dumps(flights).encode(),
+        "compact_json": lambda flights: json.dumps(
+            PriceMatrix.from_dict(flights).to_compact()
+        ).encode(),
+    }
+    if msgpack is not None:
+        encoders["compact_msgpack"] = lambda flights: msgpack.packb(
+            PriceMatrix.from_dict(flights).to_compact()
+        )
+    compressors = {
+        "raw": lambda body: body,
+        "gzip": lambda body: gzip.compress(body, 6),
+    }
+    if brotli is not None:
+        compressors["br"] = lambda body: brotli.compress(body, quality=4)
+
+    for days in args.days:
+        flights = build_flights(date(2022, 10, 12), days)
+        for name, encode in encoders.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                body = encode(flights)
+            encode_ms = (time.perf_counter() - start) / args.repeat * 1e3
+            for compression, compress in compressors.items():
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    compressed = compress(body)
+                compress_ms = (time.perf_counter() - start) / args.repeat * 1e3
+                print(
+                    json.dumps(
+                        {
+                            "days": days,
+                            "format": name,
+                            "compression": compression,
+                            "bytes": len(compressed),
+                            "encode_ms": round(encode_ms, 3),
+                            "compress_ms": round(compress_ms, 3),
+                        }
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
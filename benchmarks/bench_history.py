@@ -0,0 +1,116 @@
+"""
+Ingestion and query benchmark of the price history store.
+
+Usage: python -m benchmarks.bench_history [--rows 2000000] [--routes 50]
+Appends generated 7x7 windows (as returned by _reformat_latam_response) to a
+temporary sqlite file until --rows rows are written, then times the cell history
+and the route minimum over time queries.
+Prints one json line per step.
+"""
+import argparse
+import json
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+from benchmarks.mock_latam import WINDOW_DAYS, build_bestprices
+from history import PriceHistory
+from scrapers import LatamFinder
+
+
+def generate_windows(routes: int, first_date: date):
+    """
+    Yields (origin, destination, flights) forever, walking the routes and a 90 day
+    grid of windows, with prices changing on every pass
+    """
+    airports = [f"A{number:02d}" for number in range(routes + 1)]
+    route_pairs = list(zip(airports, airports[1:]))
+    flights_by_offset = {}
+    for dep in range(0, 90, WINDOW_DAYS):
+        for ret in range(dep, 90, WINDOW_DAYS):
+            api_response = build_bestprices(
+                first_date + timedelta(days=dep), first_date + timedelta(days=ret)
+            )
+            flights_by_offset[(dep, ret)] = LatamFinder._reformat_latam_response(
+                api_response
+            )["flights"]
+    passes = 0
+    while True:
+        passes += 1
+        for origin, destination in route_pairs:
+            for flights in flights_by_offset.values():
+                yield origin, destination, {
+                    departure_date: {
+                        return_date: price and round(price + passes, 2)
+                        for return_date, price in return_dates.items()
+                    }
+                    for departure_date, return_dates in flights.items()
+                }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--routes", type=int, default=50)
+    args = parser.parse_args()
+
+    first_date = date(2022, 10, 12)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "history.sqlite3"
+        history = PriceHistory(str(path))
+        windows = generate_windows(args.routes, first_date)
+        observed_at = time.time() - 86400 * 30
+
+        rows = 0
+        start = time.perf_counter()
+        while rows < args.rows:
+            origin, destination, flights = next(windows)
+            rows += history.record("latam", origin, destination, flights, observed_at)
+            observed_at += 1
+        elapsed = time.perf_counter() - start
+        print(
+            json.dumps(
+                {
+                    "step": "ingest",
+                    "rows": rows,
+                    "seconds": round(elapsed, 2),
+                    "rows_per_second": round(rows / elapsed),
+                    "file_mb": round(path.stat().st_size / 2**20, 1),
+                }
+            )
+        )
+
+        queries = {
+            "cell_history": lambda: history.cell_history(
+                "A00",
+                "A01",
+                first_date.isoformat(),
+                (first_date + timedelta(days=3)).isoformat(),
+            ),
+            "route_min_over_time_hour": lambda: history.route_min_over_time(
+                "A00", "A01", 3600
+            ),
+            "route_min_over_time_day": lambda: history.route_min_over_time(
+                "A00", "A01", 86400
+            ),
+        }
+        for name, query in queries.items():
+            repeat = 20
+            start = time.perf_counter()
+            for _ in range(repeat):
+                result = query()
+            elapsed = (time.perf_counter() - start) / repeat
+            print(
+                json.dumps(
+                    {
+                        "step": name,
+                        "results": len(result),
+                        "ms": round(elapsed * 1e3, 2),
+                    }
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
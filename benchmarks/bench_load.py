@@ -0,0 +1,163 @@
+"""
+Load test of one uvicorn worker serving many searches at the same time.
+
+Usage: python -m benchmarks.bench_load [--searches 300] [--latency 0.2]
+    [--port 8100] [--days 21]
+Starts the local mock LATAM server and `uvicorn main:app` with a single worker,
+then sends --searches GET /{departure_date}/{origin}/{destination} at once, each
+one a different route or date so none is answered by the cache or shares another
+search. While they run, /stats is requested every 100ms to check that the event
+loop stays responsive.
+Prints one json line with the status codes, the search times and the /stats ones.
+The rate limit is lifted, which also lifts the default SEARCH_MAX_CONCURRENT and
+SEARCH_MAX_WAITING derived from it. Set them, and SEARCH_QUEUE_TIMEOUT, to see the
+worker turn searches away with 503 instead of falling behind.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+from pathlib import Path
+
+import httpx
+
+from benchmarks.mock_latam import ROUTES, URL, MockLatamServer
+
+
+def percentiles(seconds: list) -> dict:
+    """
+    :return: Dict: {p50_ms, p95_ms, max_ms}
+    """
+    seconds = sorted(seconds)
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None, "max_ms": None}
+    return {
+        "p50_ms": round(statistics.median(seconds) * 1e3, 2),
+        "p95_ms": round(seconds[math.ceil(0.95 * len(seconds)) - 1] * 1e3, 2),
+        "max_ms": round(seconds[-1] * 1e3, 2),
+    }
+
+
+def start_worker(port: int, tmp_dir: str) -> subprocess.Popen:
+    env = {
+        "LATAM_BESTPRICES_URL": URL,
+        "RATE_LIMIT_PER_SECOND": "1000000",
+        "RATE_LIMIT_BURST": "1000000",
+        "RATE_LIMIT_STATE_PATH": "",
+        "HISTORY_SQLITE_PATH": str(Path(tmp_dir) / "history.sqlite3"),
+        "CACHE_BACKEND": "memory",
+        "SCHEDULER_MAX_CONCURRENT_REQUESTS": "256",
+        "HTTP_MAX_CONNECTIONS_PER_HOST": "256",
+        "HTTP_MAX_CONNECTIONS": "256",
+        "HTTP_MAX_KEEPALIVE_CONNECTIONS": "256",
+    }
+    worker = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--workers",
+            "1",
+            "--log-level",
+            "error",
+        ],
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return worker
+        except OSError:
+            time.sleep(0.1)
+    worker.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+async def load(args) -> dict:
+    searches = [
+        (date.today() + timedelta(days=10 + offset), origin, destination)
+        for offset in range(math.ceil(args.searches / len(ROUTES)))
+        for origin, destination in ROUTES
+    ][: args.searches]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=120
+    ) as client:
+
+        async def search(departure_date, origin, destination) -> tuple:
+            start = time.perf_counter()
+            response = await client.get(
+                f"/{departure_date}/{origin}/{destination}?days={args.days}"
+            )
+            return response.status_code, time.perf_counter() - start
+
+        async def probe_stats(done: asyncio.Event) -> list:
+            seconds = []
+            while not done.is_set():
+                start = time.perf_counter()
+                (await client.get("/stats")).raise_for_status()
+                seconds.append(time.perf_counter() - start)
+                await asyncio.sleep(0.1)
+            return seconds
+
+        done = asyncio.Event()
+        probe = asyncio.ensure_future(probe_stats(done))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(search(*search_) for search_ in searches))
+        wall = time.perf_counter() - start
+        done.set()
+        stats_seconds = await probe
+        stats = (await client.get("/stats")).json()
+
+    codes = Counter(code for code, _ in results)
+    return {
+        "searches": len(searches),
+        "days": args.days,
+        "status_codes": {str(code): count for code, count in sorted(codes.items())},
+        **percentiles([elapsed for code, elapsed in results if code == 200]),
+        "wall_ms": round(wall * 1e3, 2),
+        "searches_per_s": round(len(searches) / wall, 2),
+        "stats": percentiles(stats_seconds),
+        "upstream_requests": stats["http"]["requests"],
+        "rejected": stats["searches"]["rejected"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--searches", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--days", type=int, default=21)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="latam-bench-") as tmp_dir, MockLatamServer(
+        latency=args.latency
+    ):
+        worker = start_worker(args.port, tmp_dir)
+        try:
+            print(json.dumps(asyncio.run(load(args))))
+        finally:
+            worker.terminate()
+            worker.wait()
+
+
+if __name__ == "__main__":
+    main()
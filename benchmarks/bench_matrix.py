@@ -0,0 +1,92 @@
+"""
+Compares the PriceMatrix merge with the previous nested dict merge.
+
+Usage: python -m benchmarks.bench_matrix [--days 365]
+Prints one json line per implementation.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import date
+
+from benchmarks.mock_latam import build_bestprices
+from matrix import PriceMatrix
+from planner import plan_windows
+from scrapers import LatamFinder
+
+
+def dict_merge(responses: list) -> dict:
+    """Merge used by LatamFinder.get_all_flights before the PriceMatrix"""
+    all_flights = {}
+    list_of_all_return_dates = set()
+    for response in responses:
+        for departure_date in response["flights"].keys():
+            list_of_all_return_dates.add(departure_date)
+            if all_flights.get(departure_date):
+                all_flights[departure_date].update(response["flights"][departure_date])
+            else:
+                all_flights[departure_date] = {
+                    arrival_date: 0 for arrival_date in list_of_all_return_dates
+                }
+                all_flights[departure_date].update(response["flights"][departure_date])
+    return all_flights
+
+
+def matrix_merge(responses: list, first_date: date, days: int) -> PriceMatrix:
+    matrix = PriceMatrix(first_date, days)
+    matrix.merge(*(response["flights"] for response in responses))
+    return matrix
+
+
+def measure(name: str, merge, serialize) -> dict:
+    """
+    Measures the merge time, the memory kept by the merged result and the time to
+    serialize it in the api json format
+    """
+    start = time.perf_counter()
+    merged = merge()
+    merge_time = time.perf_counter() - start
+    start = time.perf_counter()
+    payload = serialize(merged)
+    serialize_time = time.perf_counter() - start
+    del merged
+
+    # Measured on a second run, tracemalloc slows down the merge
+    tracemalloc.start()
+    merged = merge()
+    stored, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "merge": name,
+        "merge_s": round(merge_time, 4),
+        "serialize_s": round(serialize_time, 4),
+        "stored_mb": round(stored / 2**20, 2),
+        "payload_bytes": len(payload),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    first_date = date(2022, 10, 12)
+    responses = [
+        LatamFinder._reformat_latam_response(build_bestprices(departure, return_))
+        for departure, return_ in plan_windows(first_date, args.days)
+    ]
+    print(json.dumps(measure("dict", lambda: dict_merge(responses), json.dumps)))
+    print(
+        json.dumps(
+            measure(
+                "matrix",
+                lambda: matrix_merge(responses, first_date, args.days),
+                lambda matrix: json.dumps(matrix.to_dict()),
+            )
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
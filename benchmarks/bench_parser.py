@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the bestprices parsing: previous path (decode to str, json.loads and
+dict updates) against the current one (bytes, orjson when installed, single pass).
+
+Usage: python -m benchmarks.bench_parser [--repeat 2000]
+Runs over the recorded responses in benchmarks/fixtures and a generated 7x7 window.
+Prints one json line per payload.
+"""
+import argparse
+import json
+import time
+from datetime import date
+from pathlib import Path
+
+from benchmarks.mock_latam import build_bestprices
+from scrapers import LatamFinder
+
+FIXTURES_PATH = Path(__file__).resolve().parent / "fixtures"
+
+
+def legacy_parse(body: bytes) -> dict:
+    """Parsing used by the scraper before the fast path"""
+    api_response = json.loads(body.decode("utf-8"))
+    response = {"flights": {}}
+    for dt_departure in api_response["bestPrices"]:
+        response["flights"][dt_departure["departureDate"]] = {}
+        for dt_return in dt_departure["returnDates"]:
+            if dt_return["available"]:
+                response["flights"][dt_departure["departureDate"]].update(
+                    {dt_return["date"]: dt_return["price"]["amount"]}
+                )
+            else:
+                response["flights"][dt_departure["departureDate"]].update(
+                    {dt_return["date"]: 0}
+                )
+    response["best_price"] = api_response.get("cheapestPrice")
+    return response
+
+
+class FakeResponse:
+    headers = {"content-type": "application/json"}
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+def current_parse(body: bytes) -> dict:
+    api_response = LatamFinder._convert_request_response_to_dict(FakeResponse(body))
+    return LatamFinder._reformat_latam_response(api_response)
+
+
+def time_per_call(function, body: bytes, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(body)
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = {
+        path.name: path.read_bytes() for path in sorted(FIXTURES_PATH.glob("*.json"))
+    }
+    payloads["generated_7x7"] = json.dumps(
+        build_bestprices(date(2022, 10, 12), date(2022, 10, 19))
+    ).encode()
+
+    for name, body in payloads.items():
+        assert legacy_parse(body) == current_parse(body)
+        legacy = time_per_call(legacy_parse, body, args.repeat)
+        current = time_per_call(current_parse, body, args.repeat)
+        print(
+            json.dumps(
+                {
+                    "payload": name,
+                    "bytes": len(body),
+                    "legacy_us": round(legacy * 1e6, 1),
+                    "current_us": round(current * 1e6, 1),
+                    "speedup": round(legacy / current, 2),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark of the searches of several providers at the same time (see providers.py).
+
+Usage: python -m benchmarks.bench_providers [--providers 1 2 4 8] [--days 21]
+    [--latency 0.2] [--repeat 5]
+Each provider is a StubFinder answering from its own mock LATAM server, with its
+own prices, and every search has a cold cache. As the providers run concurrently
+under the same scheduler and deadline, the search time should stay close to the
+one of a single provider, and the merge of their prices (merge_providers) grow
+linearly with their number.
+Prints one json line per number of providers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
+
+from benchmarks.mock_latam import HOST, PORT, MockLatamServer
+
+# Removed at the end of main
+TMP_DIR = tempfile.TemporaryDirectory(prefix="latam-bench-")
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "1000000")
+os.environ.setdefault("RATE_LIMIT_BURST", "1000000")
+os.environ.setdefault("RATE_LIMIT_STATE_PATH", "")
+os.environ.setdefault(
+    "HISTORY_SQLITE_PATH", str(Path(TMP_DIR.name) / "history.sqlite3")
+)
+os.environ.setdefault("CACHE_BACKEND", "memory")
+
+from cache import get_cache  # noqa: E402
+from http_client import get_session  # noqa: E402
+from providers import create_finder  # noqa: E402
+from scrapers import StubFinder  # noqa: E402
+from tracing import start_trace  # noqa: E402
+from validators import FlightData  # noqa: E402
+
+# Ports of the mock servers, one per provider
+FIRST_PORT = PORT + 10
+
+
+def provider(number: int) -> type:
+    url = f"http://{HOST}:{FIRST_PORT + number}/bestprices/roundtrip"
+    return type(
+        f"Bench{number}Finder",
+        (StubFinder,),
+        {"airline": f"bench{number}", "_bestprices_url": lambda self: url},
+    )
+
+
+async def search(flight: FlightData, names: tuple) -> tuple[float, float, int]:
+    """
+    :return: Tuple (seconds, merge_providers milliseconds, upstream requests)
+    """
+    get_cache().clear()
+    sent = get_session().metrics["requests"]
+    with start_trace() as trace:
+        start = time.perf_counter()
+        await create_finder(flight, names).get_all_flights()
+        elapsed = time.perf_counter() - start
+    merge = trace.summary()["stages"].get("merge_providers", {"total_ms": 0})
+    return elapsed, merge["total_ms"], get_session().metrics["requests"] - sent
+
+
+async def run(providers: int, args) -> dict:
+    flight = FlightData(
+        departure_date=(date.today() + timedelta(days=10)).isoformat(),
+        origin="CGH",
+        destination="VIX",
+        days=args.days,
+    )
+    classes = {f"bench{number}": provider(number) for number in range(providers)}
+    with mock.patch.dict("providers.PROVIDERS", classes):
+        results = [await search(flight, tuple(classes)) for _ in range(args.repeat)]
+    seconds, merge_ms, requests = zip(*results)
+    return {
+        "providers": providers,
+        "days": args.days,
+        "p50_ms": round(statistics.median(seconds) * 1e3, 2),
+        "max_ms": round(max(seconds) * 1e3, 2),
+        "merge_p50_ms": round(statistics.median(merge_ms), 3),
+        "upstream_requests": statistics.mean(requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--providers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--days", type=int, default=21)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with TMP_DIR, ExitStack() as servers:
+        for number in range(max(args.providers)):
+            servers.enter_context(
+                MockLatamServer(
+                    latency=args.latency,
+                    port=FIRST_PORT + number,
+                    price_scale=1 - 0.02 * number,
+                    seed=number,
+                )
+            )
+        for providers in args.providers:
+            print(json.dumps(asyncio.run(run(providers, args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Load test replaying captured LATAM traffic (see capture.py) instead of hitting LATAM.
+
+Usage: python -m benchmarks.bench_replay ARCHIVE [--speed 1] [--record 20]
+Requests every url of ARCHIVE through LatamFinder._request_url, at the same offsets
+from the first one as when it was captured, with the captured response times,
+both divided by --speed (0 sends everything at once and answers immediately).
+Capture production traffic with CAPTURE_PATH=ARCHIVE, or pass --record N to first
+capture N searches of different routes against the local mock LATAM server.
+Prints one json line with the replay results.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+from benchmarks.mock_latam import ROUTES, URL, MockLatamServer
+
+os.environ.setdefault("LATAM_BESTPRICES_URL", URL)
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "1000000")
+os.environ.setdefault("RATE_LIMIT_BURST", "1000000")
+os.environ.setdefault("RATE_LIMIT_STATE_PATH", "")
+
+from cache import TTLCache  # noqa: E402
+from capture import CaptureArchive, CaptureWriter, ReplayTransport  # noqa: E402
+from history import PriceHistory  # noqa: E402
+from http_client import HttpSession  # noqa: E402
+from ratelimit import CircuitBreaker  # noqa: E402
+from scrapers import LatamFinder  # noqa: E402
+from validators import FlightData  # noqa: E402
+
+
+def finder(session: HttpSession, capture: CaptureWriter | None = None) -> LatamFinder:
+    flight = FlightData(
+        departure_date=(date.today() + timedelta(days=10)).isoformat(),
+        origin="CGH",
+        destination="VIX",
+    )
+    return LatamFinder(
+        flight,
+        session=session,
+        cache=TTLCache(),
+        circuit_breaker=CircuitBreaker(),
+        history=PriceHistory(":memory:"),
+        capture=capture,
+    )
+
+
+async def record(path: str, searches: int) -> None:
+    writer = CaptureWriter(path)
+    departure_date = (date.today() + timedelta(days=10)).isoformat()
+    await asyncio.gather(
+        *(
+            LatamFinder(
+                FlightData(
+                    departure_date=departure_date,
+                    origin=origin,
+                    destination=destination,
+                ),
+                cache=TTLCache(),
+                history=PriceHistory(":memory:"),
+                capture=writer,
+            ).get_all_flights()
+            for origin, destination in ROUTES[:searches]
+        )
+    )
+    writer.close()
+
+
+async def replay(archive: CaptureArchive, speed: float) -> dict:
+    transport = ReplayTransport(archive, speed)
+    latam = finder(HttpSession(transport=transport))
+    captured = sorted(archive, key=lambda captured: captured.started_at)
+    first_at = captured[0].started_at
+    started_at = time.perf_counter()
+
+    async def request(url: str, offset: float) -> float:
+        if speed > 0:
+            await asyncio.sleep(offset / speed - (time.perf_counter() - started_at))
+        request_started_at = time.perf_counter()
+        await latam._request_url(url)
+        return time.perf_counter() - request_started_at
+
+    latencies = sorted(
+        await asyncio.gather(
+            *(request(item.url, item.started_at - first_at) for item in captured)
+        )
+    )
+    wall = time.perf_counter() - started_at
+    return {
+        "requests": len(latencies),
+        "urls": len(archive.urls()),
+        "speed": speed,
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(latencies) / wall, 1),
+        "p50_ms": round(statistics.median(latencies) * 1e3, 2),
+        "p95_ms": round(latencies[math.ceil(0.95 * len(latencies)) - 1] * 1e3, 2),
+        "misses": transport.misses,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("archive")
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--record", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.record:
+        with MockLatamServer(distribution="lognormal", seed=1):
+            asyncio.run(record(args.archive, args.record))
+
+    archive = CaptureArchive(args.archive)
+    if not len(archive):
+        parser.error(f"{args.archive} has no captured responses")
+    print(json.dumps(asyncio.run(replay(archive, args.speed))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures search latency and memory against the local mock LATAM server.
+
+Usage: python -m benchmarks.bench_search [--latency 0.2] [--concurrency 1 10 100]
+Prints one json line per concurrency level.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import time
+from datetime import date, timedelta
+
+from benchmarks.mock_latam import URL, MockLatamServer
+
+os.environ.setdefault("LATAM_BESTPRICES_URL", URL)
+
+from http_client import get_session  # noqa: E402
+from scrapers import LatamFinder  # noqa: E402
+from validators import FlightData  # noqa: E402
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def one_search(flight: FlightData) -> float:
+    start = time.perf_counter()
+    await LatamFinder(flight).get_all_flights()
+    return time.perf_counter() - start
+
+
+async def run_level(concurrency: int) -> dict:
+    flight = FlightData(
+        departure_date=(date.today() + timedelta(days=10)).isoformat(),
+        origin="CGH",
+        destination="VIX",
+    )
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one_search(flight) for _ in range(concurrency)))
+    wall = time.perf_counter() - start
+    latencies = sorted(latencies)
+    return {
+        "concurrency": concurrency,
+        "wall_s": round(wall, 4),
+        "p50_s": round(statistics.median(latencies), 4),
+        "p95_s": round(latencies[int(0.95 * (len(latencies) - 1))], 4),
+        "max_s": round(latencies[-1], 4),
+        "max_rss_mb": round(max_rss_mb(), 1),
+        "http": get_session().metrics,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    with MockLatamServer(latency=args.latency):
+        for concurrency in args.concurrency:
+            print(json.dumps(asyncio.run(run_level(concurrency))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Local stand-in for the LATAM bestprices endpoint, used by the benchmarks.
+
+Run it alone with `python -m benchmarks.mock_latam` and point the app to it
+with LATAM_BESTPRICES_URL=http://127.0.0.1:8001/bestprices/roundtrip
+A second one, e.g. `python -m benchmarks.mock_latam --port 8002 --price-scale 0.9`,
+stands for the "stub" provider (STUB_BESTPRICES_URL).
+"""
+import argparse
+import asyncio
+import math
+import multiprocessing
+import random
+import socket
+import time
+from datetime import date, timedelta
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+HOST = "127.0.0.1"
+PORT = 8001
+URL = f"http://{HOST}:{PORT}/bestprices/roundtrip"
+
+# Number of departure and return days that LATAM returns for a single request
+WINDOW_DAYS = 7
+
+
+# Routes of the concurrent benchmark searches, all in airports.json
+ROUTES = [
+    (origin, destination)
+    for origin in ("CGH", "GRU", "VCP", "SDU", "GIG", "BSB", "CNF", "POA")
+    for destination in ("VIX", "SSA", "REC", "FOR", "CWB", "FLN", "NAT", "MCZ")
+]
+
+# Latency distributions of create_app
+DISTRIBUTIONS = ("normal", "lognormal", "exponential", "fixed")
+
+
+def build_bestprices(
+    departure: date,
+    return_: date,
+    window_days: int = WINDOW_DAYS,
+    price_scale: float = 1.0,
+) -> dict:
+    """
+    Builds a response with the same shape as the LATAM bestprices api
+    :param window_days: Departure and return days in the response, to change its size
+    :param price_scale: Multiplies every price, so the servers of different
+    providers answer different prices
+    :return: Dict: {bestPrices: [{departureDate, returnDates: [...]}], cheapestPrice}
+    """
+    best_prices = []
+    cheapest = None
+    for dep_offset in range(window_days):
+        departure_date = departure + timedelta(days=dep_offset)
+        return_dates = []
+        for ret_offset in range(window_days):
+            return_date = return_ + timedelta(days=ret_offset)
+            available = return_date >= departure_date
+            price = round(
+                (500 + 37.3 * dep_offset + 11.9 * ret_offset) * price_scale, 2
+            )
+            return_dates.append(
+                {
+                    "date": return_date.isoformat(),
+                    "price": {"amount": price, "currency": "BRL"},
+                    "availability": "AVAILABLE" if available else "NOT_AVAILABLE",
+                    "available": available,
+                    "notAvailable": not available,
+                }
+            )
+            if available and (cheapest is None or price < cheapest):
+                cheapest = price
+        best_prices.append(
+            {"departureDate": departure_date.isoformat(), "returnDates": return_dates}
+        )
+    return {"bestPrices": best_prices, "cheapestPrice": cheapest}
+
+
+def sample_latency(
+    rng: random.Random, distribution: str, latency: float, jitter: float
+) -> float:
+    """
+    :return: Seconds of a response, with mean latency and standard deviation jitter
+    (exponential ignores jitter, fixed ignores both)
+    """
+    if distribution == "fixed" or latency <= 0:
+        return max(0.0, latency)
+    if distribution == "exponential":
+        return rng.expovariate(1 / latency)
+    if distribution == "lognormal":
+        # Long right tail, as the real upstream latencies
+        sigma2 = math.log(1 + (jitter / latency) ** 2)
+        return rng.lognormvariate(math.log(latency) - sigma2 / 2, math.sqrt(sigma2))
+    return max(0.0, rng.gauss(latency, jitter))
+
+
+def create_app(
+    latency: float = 0.2,
+    jitter: float = 0.05,
+    stall: float = 0.0,
+    stall_every: int = 0,
+    fail_every: int = 0,
+    distribution: str = "normal",
+    error_rate: float = 0.0,
+    window_days: int = WINDOW_DAYS,
+    seed: int | None = None,
+    price_scale: float = 1.0,
+) -> Starlette:
+    """
+    :param stall: Seconds taken instead of latency by the first request and then
+    every stall_every-th one
+    :param fail_every: Every fail_every-th request answers 503
+    :param distribution: One of DISTRIBUTIONS (see sample_latency)
+    :param error_rate: Share of the requests answering 503, at random
+    :param window_days: Size of the responses (see build_bestprices)
+    :param seed: Seed of the latencies and errors, for reproducible runs
+    :param price_scale: See build_bestprices
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"distribution must be one of {DISTRIBUTIONS}")
+    rng = random.Random(seed)
+    requests = 0
+
+    async def bestprices(request: Request) -> JSONResponse:
+        nonlocal requests
+        requests += 1
+        if (fail_every and requests % fail_every == 0) or rng.random() < error_rate:
+            return JSONResponse({"error": "unavailable"}, status_code=503)
+        if stall_every and (requests - 1) % stall_every == 0:
+            await asyncio.sleep(stall)
+        else:
+            await asyncio.sleep(sample_latency(rng, distribution, latency, jitter))
+        departure = date.fromisoformat(request.query_params["departure"])
+        return_ = date.fromisoformat(request.query_params["return"])
+        return JSONResponse(
+            build_bestprices(departure, return_, window_days, price_scale)
+        )
+
+    return Starlette(routes=[Route("/bestprices/roundtrip", bestprices)])
+
+
+class MockLatamServer:
+    """
+    Runs the mock server in a separate process, so it does not compete with the
+    code being measured for the GIL or pollute its memory usage.
+    Usage: with MockLatamServer(latency=0.2): ...
+    The other options of create_app make it slow or flaky.
+    """
+
+    def __init__(
+        self, latency: float = 0.2, jitter: float = 0.05, port: int = PORT, **options
+    ):
+        self._port = port
+        self._process = multiprocessing.Process(
+            target=_serve, args=(latency, jitter, port), kwargs=options, daemon=True
+        )
+
+    def __enter__(self) -> "MockLatamServer":
+        self._process.start()
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection((HOST, self._port), timeout=0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self._process.terminate()
+        raise RuntimeError("Mock LATAM server did not start")
+
+    def __exit__(self, *exc) -> None:
+        self._process.terminate()
+        self._process.join()
+
+
+def _serve(latency: float, jitter: float, port: int, **options) -> None:
+    uvicorn.run(
+        create_app(latency, jitter, **options), host=HOST, port=port, log_level="error"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--price-scale", type=float, default=1.0)
+    args = parser.parse_args()
+    _serve(0.2, 0.05, args.port, price_scale=args.price_scale)
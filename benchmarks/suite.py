@@ -0,0 +1,290 @@
+"""
+Reproducible benchmark suite of the searches against the local mock LATAM server.
+
+Usage: python -m benchmarks.suite [--scenarios single concurrent cold_warm
+    long_horizon flaky api] [--latency 0.2] [--jitter 0.05]
+    [--distribution lognormal] [--error-rate 0.1] [--window-days 7] [--repeat 5]
+    [--concurrency 50] [--seed 1] [--output results.json]
+    [--baseline baseline.json] [--tolerance 0.25]
+
+Scenarios:
+- single: one 21 day search with a cold cache, --repeat times
+- concurrent: --concurrency searches of different routes at the same time
+- cold_warm: the same search with a cold and then a warm cache
+- long_horizon: one 90 day search with a cold cache, --repeat times
+- flaky: single against a server answering 503 to --error-rate of the requests
+- api: GET /{departure_date}/{origin}/{destination} through main.app, --repeat times
+
+Prints one json line per scenario. --output writes them with the options used, and
+--baseline compares the p50_ms of each scenario with a previous --output, exiting
+with 1 when one is more than --tolerance slower.
+The rate limiter is lifted and the price history goes to a temporary file unless
+their settings are given, so the numbers measure the search and nothing else.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock
+
+from benchmarks.mock_latam import (
+    DISTRIBUTIONS,
+    HOST,
+    PORT,
+    ROUTES,
+    URL,
+    MockLatamServer,
+)
+
+# Removed at the end of main
+TMP_DIR = tempfile.TemporaryDirectory(prefix="latam-bench-")
+os.environ.setdefault("LATAM_BESTPRICES_URL", URL)
+os.environ.setdefault("RATE_LIMIT_PER_SECOND", "1000000")
+os.environ.setdefault("RATE_LIMIT_BURST", "1000000")
+os.environ.setdefault("RATE_LIMIT_STATE_PATH", "")
+os.environ.setdefault(
+    "HISTORY_SQLITE_PATH", str(Path(TMP_DIR.name) / "history.sqlite3")
+)
+os.environ.setdefault("CACHE_BACKEND", "memory")
+
+import httpx  # noqa: E402
+
+from cache import get_cache  # noqa: E402
+from http_client import get_session  # noqa: E402
+from main import app  # noqa: E402
+from ratelimit import get_circuit_breaker  # noqa: E402
+from scrapers import LatamFinder  # noqa: E402
+from settings import LATAM_BESTPRICES_URL  # noqa: E402
+from validators import FlightData  # noqa: E402
+
+SCENARIOS = ("single", "concurrent", "cold_warm", "long_horizon", "flaky", "api")
+FLAKY_PORT = PORT + 1
+
+
+def departure_date(offset: int = 10) -> str:
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+
+def summarize(scenario: str, seconds: list, **extra) -> dict:
+    """
+    :return: Dict: {scenario, samples, p50_ms, p95_ms, max_ms, ...extra}
+    """
+    seconds = sorted(seconds)
+    return {
+        "scenario": scenario,
+        "samples": len(seconds),
+        "p50_ms": round(statistics.median(seconds) * 1e3, 2),
+        "p95_ms": round(seconds[math.ceil(0.95 * len(seconds)) - 1] * 1e3, 2),
+        "max_ms": round(seconds[-1] * 1e3, 2),
+        **extra,
+    }
+
+
+async def timed_search(flight: FlightData) -> tuple[float, LatamFinder]:
+    latam = LatamFinder(flight)
+    start = time.perf_counter()
+    await latam.get_all_flights()
+    return time.perf_counter() - start, latam
+
+
+def known_cells(latam: LatamFinder) -> int:
+    return int(latam._all_flights.known.sum())
+
+
+def reset() -> int:
+    """
+    Clears the cache and the circuit breaker between runs
+    :return: Upstream requests sent so far
+    """
+    get_cache().clear()
+    get_circuit_breaker().reset()
+    return get_session().metrics["requests"]
+
+
+async def cold_searches(scenario: str, repeat: int, days: int) -> dict:
+    flight = FlightData(
+        departure_date=departure_date(), origin="CGH", destination="VIX", days=days
+    )
+    seconds = []
+    requests = 0
+    for _ in range(repeat):
+        sent = reset()
+        elapsed, latam = await timed_search(flight)
+        requests += get_session().metrics["requests"] - sent
+        seconds.append(elapsed)
+    return summarize(
+        scenario,
+        seconds,
+        days=days,
+        known_cells=known_cells(latam),
+        upstream_requests=requests / repeat,
+    )
+
+
+async def single(args) -> dict:
+    return await cold_searches("single", args.repeat, 21)
+
+
+async def long_horizon(args) -> dict:
+    return await cold_searches("long_horizon", args.repeat, 90)
+
+
+async def concurrent(args) -> dict:
+    sent = reset()
+    flights = [
+        FlightData(
+            departure_date=departure_date(), origin=origin, destination=destination
+        )
+        for origin, destination in ROUTES[: args.concurrency]
+    ]
+    start = time.perf_counter()
+    results = await asyncio.gather(*(timed_search(flight) for flight in flights))
+    wall = time.perf_counter() - start
+    return summarize(
+        "concurrent",
+        [elapsed for elapsed, _ in results],
+        searches=len(flights),
+        wall_ms=round(wall * 1e3, 2),
+        searches_per_s=round(len(flights) / wall, 2),
+        upstream_requests=get_session().metrics["requests"] - sent,
+    )
+
+
+async def cold_warm(args) -> dict:
+    flight = FlightData(
+        departure_date=departure_date(), origin="CGH", destination="VIX"
+    )
+    cold, warm = [], []
+    for _ in range(args.repeat):
+        reset()
+        cold.append((await timed_search(flight))[0])
+        sent = get_session().metrics["requests"]
+        warm.append((await timed_search(flight))[0])
+        warm_requests = get_session().metrics["requests"] - sent
+    warm_result = summarize("cold_warm", warm, warm_upstream_requests=warm_requests)
+    return {
+        **warm_result,
+        "cold_p50_ms": summarize("cold", cold)["p50_ms"],
+        "cache": get_cache().stats,
+    }
+
+
+async def flaky(args) -> dict:
+    flaky_url = f"http://{HOST}:{FLAKY_PORT}/bestprices/roundtrip"
+    with mock.patch("scrapers.LATAM_BESTPRICES_URL", flaky_url):
+        result = await cold_searches("flaky", args.repeat, 21)
+    return {**result, "error_rate": args.error_rate}
+
+
+async def api(args) -> dict:
+    seconds = []
+    async with httpx.AsyncClient(app=app, base_url="http://app") as client:
+        for _ in range(args.repeat):
+            reset()
+            start = time.perf_counter()
+            response = await client.get(f"/{departure_date()}/CGH/VIX")
+            seconds.append(time.perf_counter() - start)
+            response.raise_for_status()
+    return summarize("api", seconds, response_bytes=len(response.content))
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """
+    :return: List of {scenario, p50_ms, baseline_p50_ms, ratio} of the scenarios
+    slower than the baseline by more than tolerance
+    """
+    baseline = {
+        result["scenario"]: result
+        for result in json.loads(Path(baseline_path).read_text())["results"]
+    }
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["scenario"])
+        if previous is None or not previous["p50_ms"]:
+            continue
+        ratio = result["p50_ms"] / previous["p50_ms"]
+        if ratio > 1 + tolerance:
+            regressions.append(
+                {
+                    "scenario": result["scenario"],
+                    "p50_ms": result["p50_ms"],
+                    "baseline_p50_ms": previous["p50_ms"],
+                    "ratio": round(ratio, 2),
+                }
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--window-days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    server_options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "distribution": args.distribution,
+        "window_days": args.window_days,
+        "seed": args.seed,
+    }
+    scenarios = {
+        "single": single,
+        "concurrent": concurrent,
+        "cold_warm": cold_warm,
+        "long_horizon": long_horizon,
+        "flaky": flaky,
+        "api": api,
+    }
+    results = []
+    with TMP_DIR, MockLatamServer(**server_options), MockLatamServer(
+        port=FLAKY_PORT, error_rate=args.error_rate, **server_options
+    ):
+        for name in args.scenarios:
+            result = asyncio.run(scenarios[name](args))
+            print(json.dumps(result))
+            results.append(result)
+
+    if args.output:
+        Path(args.output).write_text(
+            json.dumps(
+                {
+                    "options": vars(args),
+                    "python": platform.python_version(),
+                    "upstream": LATAM_BESTPRICES_URL,
+                    "results": results,
+                },
+                indent=2,
+            )
+        )
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(json.dumps({"regression": True, **regression}))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
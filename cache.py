@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from settings import (
+    CACHE_BACKEND,
+    CACHE_EVICT_INTERVAL,
+    CACHE_MAX_ENTRIES,
+    CACHE_SQLITE_PATH,
+    CACHE_TTL,
+)
+
+
+class ResultCache(ABC):
+    """
+    Interface for the cache of reformatted airline responses
+    Keys are tuples like (airline, origin, destination, departure, return)
+    """
+
+    # True when the entries set by a worker are read by the others
+    shared = False
+
+    def __init__(self, ttl: float = CACHE_TTL):
+        self._ttl = ttl
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {hits:int, misses:int, hit_rate:float, entries:int}
+        """
+        total = self._hits + self._misses
+        return {
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / total if total else 0.0,
+            "entries": self._entries_count(),
+        }
+
+    def _entries_count(self) -> int:
+        """
+        :return: Number of entries shown by stats, which must not do io
+        """
+        return len(self)
+
+    def get(self, key: tuple) -> dict | None:
+        value = self._get(key)
+        if value is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return value
+
+    @abstractmethod
+    def _get(self, key: tuple) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, key: tuple, value: dict) -> None:
+        raise NotImplementedError
+
+    def find(self, prefix: tuple) -> list[dict]:
+        """
+        :return: All the values not expired whose key starts with prefix, each one
+        counted as a hit
+        """
+        values = self._find(prefix)
+        self._hits += len(values)
+        return values
+
+    @abstractmethod
+    def _find(self, prefix: tuple) -> list[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    # Used by the searches. The in memory cache answers at once, a cache doing io
+    # overrides them so the event loop is not blocked
+    async def aget(self, key: tuple) -> dict | None:
+        return self.get(key)
+
+    async def aset(self, key: tuple, value: dict) -> None:
+        self.set(key, value)
+
+    async def afind(self, prefix: tuple) -> list[dict]:
+        return self.find(prefix)
+
+
+class TTLCache(ResultCache):
+    """
+    In memory LRU cache. Entries expire after ttl seconds and the least recently
+    used entry is evicted when max_entries is reached. The keys are indexed by
+    route, their first ROUTE_KEY_LENGTH parts, so find reads only the entries of
+    the searched route.
+    """
+
+    ROUTE_KEY_LENGTH = 3
+
+    def __init__(self, ttl: float = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__(ttl)
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        # Route -> {key: None}, the keys of the route in insertion order
+        self._routes = {}
+
+    def _get(self, key: tuple) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._delete(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: tuple, value: dict) -> None:
+        self._entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(key)
+        self._routes.setdefault(key[: self.ROUTE_KEY_LENGTH], {})[key] = None
+        while len(self._entries) > self._max_entries:
+            self._delete(next(iter(self._entries)))
+
+    def _find(self, prefix: tuple) -> list[dict]:
+        now = time.monotonic()
+        if len(prefix) >= self.ROUTE_KEY_LENGTH:
+            keys = self._routes.get(prefix[: self.ROUTE_KEY_LENGTH], ())
+        else:
+            keys = self._entries
+        entries = (self._entries[key] for key in keys if key[: len(prefix)] == prefix)
+        return [value for expires_at, value in entries if expires_at >= now]
+
+    def _delete(self, key: tuple) -> None:
+        del self._entries[key]
+        route = key[: self.ROUTE_KEY_LENGTH]
+        del self._routes[route][key]
+        if not self._routes[route]:
+            del self._routes[route]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._routes.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(ResultCache):
+    """
+    Cache stored in a sqlite file, so it can be shared by all gunicorn workers.
+    Entries expire after ttl seconds. Every evict_interval seconds the expired
+    entries are deleted, and the ones expiring first while there are more than
+    max_entries. The searches query it from a thread of its own (see aget), and
+    stats shows the entries counted there by the last eviction.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        path: str = CACHE_SQLITE_PATH,
+        ttl: float = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        evict_interval: float = CACHE_EVICT_INTERVAL,
+    ):
+        super().__init__(ttl)
+        self._max_entries = max_entries
+        self._evict_interval = evict_interval
+        self._evicted_at = time.monotonic()
+        # One thread, so the connection is never used by two at the same time
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="sqlite-cache")
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)"
+            )
+        self._entries = len(self)
+
+    @staticmethod
+    def _serialize_key(key: tuple) -> str:
+        return "|".join(str(part) for part in key)
+
+    def _get(self, key: tuple) -> dict | None:
+        row = self._connection.execute(
+            "SELECT value FROM results WHERE key = ? AND expires_at >= ?",
+            (self._serialize_key(key), time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: tuple, value: dict) -> None:
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                (self._serialize_key(key), json.dumps(value), time.time() + self._ttl),
+            )
+        if time.monotonic() - self._evicted_at >= self._evict_interval:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Deletes the expired entries, then the ones expiring first beyond max_entries.
+        Both use the expires_at index.
+        """
+        self._evicted_at = time.monotonic()
+        with self._connection:
+            self._connection.execute(
+                "DELETE FROM results WHERE expires_at < ?", (time.time(),)
+            )
+            self._connection.execute(
+                "DELETE FROM results WHERE expires_at < "
+                "(SELECT expires_at FROM results ORDER BY expires_at DESC "
+                "LIMIT 1 OFFSET ?)",
+                (self._max_entries - 1,),
+            )
+        self._entries = len(self)
+
+    def _find(self, prefix: tuple) -> list[dict]:
+        # Range of the primary key instead of LIKE, so only the rows of the prefix
+        # are read: "|" is followed by "}" in ascii
+        start = self._serialize_key(prefix) + "|"
+        rows = self._connection.execute(
+            "SELECT value FROM results WHERE key >= ? AND key < ? AND expires_at >= ?",
+            (start, start[:-1] + "}", time.time()),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def aget(self, key: tuple) -> dict | None:
+        return await self._run(self.get, key)
+
+    async def aset(self, key: tuple, value: dict) -> None:
+        await self._run(self.set, key, value)
+
+    async def afind(self, prefix: tuple) -> list[dict]:
+        return await self._run(self.find, prefix)
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, function, *args
+        )
+
+    def clear(self) -> None:
+        with self._connection:
+            self._connection.execute("DELETE FROM results")
+        self._entries = 0
+
+    def _entries_count(self) -> int:
+        return self._entries
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class WriteOnlyCache(ResultCache):
+    """
+    Writes to another cache and never reads from it, so a refresh requests every
+    window again while the searches still get the fresh windows from the cache
+    (of every worker, with the sqlite backend)
+    """
+
+    def __init__(self, cache: ResultCache):
+        super().__init__(cache._ttl)
+        self._cache = cache
+        self.shared = cache.shared
+
+    def get(self, key: tuple) -> dict | None:
+        return None
+
+    def _get(self, key: tuple) -> dict | None:
+        return None
+
+    def set(self, key: tuple, value: dict) -> None:
+        self._cache.set(key, value)
+
+    def find(self, prefix: tuple) -> list[dict]:
+        return []
+
+    def _find(self, prefix: tuple) -> list[dict]:
+        return []
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def _entries_count(self) -> int:
+        return self._cache._entries_count()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def aset(self, key: tuple, value: dict) -> None:
+        await self._cache.aset(key, value)
+
+
+_CACHE = None
+
+
+def get_cache() -> ResultCache:
+    """
+    :return: The process wide cache, chosen by the CACHE_BACKEND setting
+    """
+    global _CACHE
+    if _CACHE is None:
+        if CACHE_BACKEND == "sqlite":
+            _CACHE = SQLiteCache()
+        else:
+            _CACHE = TTLCache()
+    return _CACHE
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import mmap
+import os
+import struct
+import zlib
+from collections import defaultdict
+from typing import Iterator, NamedTuple
+
+import httpx
+
+from settings import CAPTURE_PATH
+
+# magic, started_at, elapsed, status_code, content_type length, url length, body length
+_RECORD = struct.Struct("<4sdfHHII")
+_MAGIC = b"LCR1"
+
+
+class CapturedResponse(NamedTuple):
+    url: str
+    started_at: float
+    elapsed: float
+    status_code: int
+    content_type: str
+    content: bytes
+
+
+def _normalize_url(url: str) -> str:
+    return str(httpx.URL(url))
+
+
+class CaptureWriter:
+    """
+    Appends the upstream responses to an archive: one record per response, a fixed
+    header followed by the url, the content type and the zlib compressed body.
+    Each record is a single write to a file opened with O_APPEND, so the workers of
+    a host can capture to the same archive without interleaving records.
+    """
+
+    def __init__(self, path: str = CAPTURE_PATH):
+        self._path = path
+        self._fd = None
+        self._records = 0
+        self._bytes = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {records:int, bytes:int}
+        """
+        return {"records": self._records, "bytes": self._bytes}
+
+    def record(
+        self, url: str, response: httpx.Response, started_at: float, elapsed: float
+    ) -> None:
+        url_bytes = _normalize_url(url).encode()
+        content_type = response.headers.get("content-type", "").encode()
+        body = zlib.compress(response.content)
+        record = (
+            _RECORD.pack(
+                _MAGIC,
+                started_at,
+                elapsed,
+                response.status_code,
+                len(content_type),
+                len(url_bytes),
+                len(body),
+            )
+            + url_bytes
+            + content_type
+            + body
+        )
+        if self._fd is None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT
+            self._fd = os.open(self._path, flags, 0o644)
+        os.write(self._fd, record)
+        self._records += 1
+        self._bytes += len(record)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class CaptureArchive:
+    """
+    Read only view of an archive written by CaptureWriter. The file is memory
+    mapped, so only the headers are read to build the index and each body is
+    decompressed when it is served.
+    """
+
+    def __init__(self, path: str):
+        self._offsets = []
+        self._mmap = None
+        with open(path, "rb") as file:
+            if os.fstat(file.fileno()).st_size:
+                self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index()
+
+    def _index(self) -> None:
+        if self._mmap is None:
+            return
+        offset = 0
+        size = len(self._mmap)
+        while offset + _RECORD.size <= size:
+            magic, *_, type_length, url_length, body_length = _RECORD.unpack_from(
+                self._mmap, offset
+            )
+            end = offset + _RECORD.size + type_length + url_length + body_length
+            if magic != _MAGIC or end > size:
+                # A record being appended or a damaged tail, the rest is skipped
+                break
+            self._offsets.append(offset)
+            offset = end
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, number: int) -> CapturedResponse:
+        offset = self._offsets[number]
+        (
+            _,
+            started_at,
+            elapsed,
+            status_code,
+            type_length,
+            url_length,
+            body_length,
+        ) = _RECORD.unpack_from(self._mmap, offset)
+        start = offset + _RECORD.size
+        url = self._mmap[start : start + url_length].decode()
+        start += url_length
+        content_type = self._mmap[start : start + type_length].decode()
+        start += type_length
+        content = zlib.decompress(self._mmap[start : start + body_length])
+        return CapturedResponse(
+            url, started_at, elapsed, status_code, content_type, content
+        )
+
+    def __iter__(self) -> Iterator[CapturedResponse]:
+        return (self[number] for number in range(len(self)))
+
+    def urls(self) -> dict[str, list[int]]:
+        """
+        :return: Dict: {url: [record numbers, oldest first]}
+        """
+        urls = defaultdict(list)
+        for number, offset in enumerate(self._offsets):
+            *_, type_length, url_length, _ = _RECORD.unpack_from(self._mmap, offset)
+            start = offset + _RECORD.size
+            urls[self._mmap[start : start + url_length].decode()].append(number)
+        return dict(urls)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    """
+    Answers the requests from a CaptureArchive instead of the network, taking the
+    captured time of each response divided by speed (0 answers at once).
+    The responses of a url are served in the order they were captured, starting
+    over after the last one. Urls that were not captured get a 404.
+    """
+
+    def __init__(self, archive: CaptureArchive, speed: float = 1.0):
+        self._archive = archive
+        self._speed = speed
+        self._urls = archive.urls()
+        self._served = defaultdict(int)
+        self.misses = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        numbers = self._urls.get(url)
+        if not numbers:
+            self.misses += 1
+            return httpx.Response(404, request=request)
+        captured = self._archive[numbers[self._served[url] % len(numbers)]]
+        self._served[url] += 1
+        if self._speed > 0:
+            await asyncio.sleep(captured.elapsed / self._speed)
+        return httpx.Response(
+            captured.status_code,
+            headers={"content-type": captured.content_type},
+            content=captured.content,
+            request=request,
+        )
+
+
+_CAPTURE_WRITER = None
+
+
+def get_capture_writer() -> CaptureWriter | None:
+    """
+    :return: The process wide CaptureWriter, None unless CAPTURE_PATH is set
+    """
+    global _CAPTURE_WRITER
+    if _CAPTURE_WRITER is None and CAPTURE_PATH:
+        _CAPTURE_WRITER = CaptureWriter()
+    return _CAPTURE_WRITER
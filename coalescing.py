@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls: while a call for a key is running, other calls
+    with the same key wait for it and get the same result instead of running again.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._executed = 0
+        self._shared = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {executed:int, shared:int, in_flight:int}
+        """
+        return {
+            "executed": self._executed,
+            "shared": self._shared,
+            "in_flight": len(self._calls),
+        }
+
+    async def do(self, key: tuple, function: Callable[..., Awaitable], *args):
+        """
+        Runs function(*args) unless a call with the same key is already running.
+        The shared result must be treated as read only by the callers.
+        """
+        # Futures belong to an event loop, so calls are only shared inside the same loop
+        call_key = (id(asyncio.get_running_loop()), key)
+        task = self._calls.get(call_key)
+        if task is None:
+            self._executed += 1
+            task = asyncio.ensure_future(function(*args))
+            self._calls[call_key] = task
+            task.add_done_callback(lambda _: self._calls.pop(call_key, None))
+        else:
+            self._shared += 1
+        # A cancelled waiter must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+
+from settings import HEDGE_MIN_SAMPLES, HEDGE_SAMPLE_SIZE
+
+
+class LatencyTracker:
+    """
+    Keeps the latency of the last successful upstream requests to tell how long
+    a request is expected to take.
+    """
+
+    def __init__(
+        self, size: int = HEDGE_SAMPLE_SIZE, min_samples: int = HEDGE_MIN_SAMPLES
+    ):
+        self._samples = deque(maxlen=size)
+        self._min_samples = min_samples
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {samples:int, p50:float|None, p95:float|None}
+        """
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {
+            "samples": len(self._samples),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p95": round(p95, 3) if p95 is not None else None,
+        }
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        :return: The q quantile of the latencies, None until there are min_samples
+        """
+        if len(self._samples) < self._min_samples:
+            return None
+        samples = sorted(self._samples)
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+async def hedged(
+    function: Callable[..., Awaitable],
+    *args,
+    delay: float,
+    should_hedge: Callable[[], bool] = lambda: True,
+):
+    """
+    Runs function(*args) and, if it has not finished after delay seconds, runs it
+    once more. The first call to succeed wins and the other one is cancelled.
+    If both fail, the error of the first one to fail is raised.
+    :param should_hedge: Called before the second call, False skips it
+    """
+    first = asyncio.ensure_future(function(*args))
+    pending = {first}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not should_hedge():
+            return await first
+
+        pending.add(asyncio.ensure_future(function(*args)))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # Also when the caller is cancelled while waiting
+        for task in pending:
+            task.cancel()
+
+
+_LATENCY_TRACKER = None
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """
+    :return: The process wide LatencyTracker of the upstream requests
+    """
+    global _LATENCY_TRACKER
+    if _LATENCY_TRACKER is None:
+        _LATENCY_TRACKER = LatencyTracker()
+    return _LATENCY_TRACKER
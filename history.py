@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import logging
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+from datetime import datetime, timezone
+
+from settings import HISTORY_SQLITE_PATH
+
+LOGGER = logging.getLogger("app.history")
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+
+class PriceHistory:
+    """
+    Append only sqlite store of every price returned by the airlines, one row per
+    (departure, return) cell and observation, to query how prices changed over time.
+    0 is kept as the price of unavailable flights.
+    The searches write with record_later, from a thread of its own, so a slow or
+    failing write neither blocks the event loop nor fails the search.
+    """
+
+    def __init__(self, path: str = HISTORY_SQLITE_PATH):
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="price-history")
+        self._failures = 0
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._rows = 0
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS prices ("
+                "airline TEXT NOT NULL, origin TEXT NOT NULL, destination TEXT NOT NULL, "
+                "departure_date TEXT NOT NULL, return_date TEXT NOT NULL, "
+                "observed_at REAL NOT NULL, price REAL NOT NULL)"
+            )
+            # Price history of a cell
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS prices_cell ON prices "
+                "(origin, destination, departure_date, return_date, observed_at)"
+            )
+            # Minimum price of a route over time, covering so the table is not read
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS prices_route ON prices "
+                "(origin, destination, observed_at, price)"
+            )
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {rows_written:int, failed_writes:int}
+        """
+        return {"rows_written": self._rows, "failed_writes": self._failures}
+
+    def record(
+        self,
+        airline: str,
+        origin: str,
+        destination: str,
+        flights: dict,
+        observed_at: float | None = None,
+    ) -> int:
+        """
+        Appends a response in the format {departure_date: {return_date: price}}
+        :return: Number of rows written
+        """
+        observed_at = time.time() if observed_at is None else observed_at
+        rows = [
+            (
+                airline,
+                origin,
+                destination,
+                departure_date,
+                return_date,
+                observed_at,
+                price,
+            )
+            for departure_date, return_dates in flights.items()
+            for return_date, price in return_dates.items()
+            if price is not None
+        ]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO prices VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+            )
+        self._rows += len(rows)
+        return len(rows)
+
+    def record_later(
+        self, airline: str, origin: str, destination: str, flights: dict
+    ) -> Future:
+        """
+        Same as record, in the thread of the history. Errors are logged, not raised.
+        :return: Future of the number of rows written, 0 if it failed
+        """
+        return self._executor.submit(
+            self._record_logging_errors,
+            airline,
+            origin,
+            destination,
+            flights,
+            time.time(),
+        )
+
+    def run_later(self, function: Callable, *args) -> Future:
+        """
+        Runs function(*args) in the thread of the history, after the writes sent so
+        far, e.g. the alerts of the prices just recorded. Errors are logged, not raised.
+        :return: Future of the result of the function, None if it failed
+        """
+        return self._executor.submit(self._run_logging_errors, function, *args)
+
+    def flush(self) -> None:
+        """
+        Waits for the writes of record_later sent so far
+        """
+        self._executor.submit(lambda: None).result()
+
+    def _record_logging_errors(self, *args) -> int:
+        try:
+            return self.record(*args)
+        except Exception as error:
+            self._failures += 1
+            LOGGER.error(f"Could not record the prices in the history: {error}")
+            return 0
+
+    @staticmethod
+    def _run_logging_errors(function: Callable, *args):
+        try:
+            return function(*args)
+        except Exception as error:
+            name = getattr(function, "__qualname__", function)
+            LOGGER.error(f"Could not run {name} in the history thread: {error}")
+            return None
+
+    def cell_history(
+        self,
+        origin: str,
+        destination: str,
+        departure_date: str,
+        return_date: str,
+        since: float = 0,
+    ) -> list[dict]:
+        """
+        :return: List of {observed_at, price, airline} of a cell, oldest first
+        """
+        rows = self._connection.execute(
+            "SELECT observed_at, price, airline FROM prices "
+            "WHERE origin = ? AND destination = ? AND departure_date = ? "
+            "AND return_date = ? AND observed_at >= ? ORDER BY observed_at",
+            (origin, destination, departure_date, return_date, since),
+        ).fetchall()
+        return [
+            {
+                "observed_at": _format_time(observed_at),
+                "price": price,
+                "airline": airline,
+            }
+            for observed_at, price, airline in rows
+        ]
+
+    def route_min_over_time(
+        self, origin: str, destination: str, bucket: int = 3600, since: float = 0
+    ) -> list[dict]:
+        """
+        Cheapest available price of any cell of the route in each bucket of seconds
+        :return: List of {observed_at, best_price}, where observed_at is the start of
+        the bucket, oldest first
+        """
+        rows = self._connection.execute(
+            "SELECT CAST(observed_at / ? AS INTEGER) AS slot, MIN(price) FROM prices "
+            "WHERE origin = ? AND destination = ? AND observed_at >= ? AND price > 0 "
+            "GROUP BY slot ORDER BY slot",
+            (bucket, origin, destination, since),
+        ).fetchall()
+        return [
+            {"observed_at": _format_time(slot * bucket), "best_price": best_price}
+            for slot, best_price in rows
+        ]
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM prices").fetchone()[0]
+
+
+_HISTORY = None
+
+
+def get_price_history() -> PriceHistory:
+    """
+    :return: The process wide PriceHistory
+    """
+    global _HISTORY
+    if _HISTORY is None:
+        _HISTORY = PriceHistory()
+    return _HISTORY
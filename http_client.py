@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator
+from urllib.parse import urlsplit
+
+import httpx
+
+from settings import (
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_CONNECTIONS_PER_HOST,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT,
+)
+from tracing import record_event, span
+
+
+class HttpSession:
+    """
+    Connection pooled http client shared by all the ticket finders.
+    Keeps the connections alive between requests, limits the number of
+    concurrent requests per host and counts how often a connection is reused.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+        timeout: float = HTTP_TIMEOUT,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self._max_connections_per_host = max_connections_per_host
+        self._timeout = timeout
+        self._transport = transport
+        self._client = None
+        self._closer = None
+        self._loop = None
+        self._host_semaphores = {}
+        self._requests = 0
+        self._new_connections = 0
+
+    @property
+    def metrics(self) -> dict:
+        """
+        :return: Dict: {requests:int, new_connections:int, reuse_rate:float}
+        """
+        reused = max(self._requests - self._new_connections, 0)
+        return {
+            "requests": self._requests,
+            "new_connections": self._new_connections,
+            "reuse_rate": reused / self._requests if self._requests else 0.0,
+        }
+
+    async def get(self, url: str, headers: dict | None = None) -> httpx.Response:
+        client = await self._get_client()
+        semaphore = self._host_semaphores.setdefault(
+            urlsplit(url).netloc, asyncio.Semaphore(self._max_connections_per_host)
+        )
+        with span("host_slot_wait"):
+            await semaphore.acquire()
+        try:
+            self._requests += 1
+            return await client.get(
+                url, headers=headers, extensions={"trace": self._trace}
+            )
+        finally:
+            semaphore.release()
+
+    async def aclose(self) -> None:
+        if self._closer is not None and self._loop is asyncio.get_running_loop():
+            await self._closer.aclose()
+        self._client = None
+        self._closer = None
+        self._loop = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """
+        The connections of an AsyncClient belong to the event loop that opened them,
+        so a new client is created if the session is used from another loop, and
+        each client is closed by its own loop (see _close_with_loop).
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            with span("client_startup"):
+                self._client = httpx.AsyncClient(
+                    limits=self._limits,
+                    timeout=self._timeout,
+                    transport=self._transport,
+                )
+            self._closer = self._close_with_loop(self._client)
+            await self._closer.asend(None)
+            self._loop = loop
+            self._host_semaphores = {}
+        return self._client
+
+    @staticmethod
+    async def _close_with_loop(client: httpx.AsyncClient) -> AsyncIterator[None]:
+        """
+        Closes the client when the generator is closed. The loop closes the async
+        generators it started before it stops (asyncio.run does), the only time
+        the connections of the client can still be closed once the session moved to
+        another loop.
+        """
+        try:
+            yield
+        finally:
+            await client.aclose()
+
+    async def _trace(self, event_name: str, info: dict) -> None:
+        record_event(event_name)
+        if event_name == "connection.connect_tcp.complete":
+            self._new_connections += 1
+
+
+_SESSION = None
+
+
+def get_session() -> HttpSession:
+    """
+    :return: The process wide HttpSession
+    """
+    global _SESSION
+    if _SESSION is None:
+        _SESSION = HttpSession()
+    return _SESSION
@@ -1,17 +1,52 @@
+import asyncio
 import json
 import logging
+import time
+from contextlib import asynccontextmanager
 from logging.config import dictConfig
+from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, status, HTTPException
+from fastapi import (
+    Body,
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import ValidationError
-from starlette.responses import FileResponse
+from starlette.responses import FileResponse, PlainTextResponse, StreamingResponse
 
-from airports import load_airports
-from scrapers import LatamFinder
-from settings import ORIGINS, LogConfig
-from validators import FlightData
+from airports import get_airport_registry
+from alerts import get_alert_engine
+from cache import get_cache
+from capture import get_capture_writer
+from coalescing import SingleFlight
+from hedging import get_latency_tracker
+from history import get_price_history
+from http_client import get_session
+from matrix import CheapestPriceMatrix
+from metrics import REGISTRY, SEARCH_SECONDS, SEARCHES_IN_PROGRESS
+from providers import create_finder, get_search_providers
+from ratelimit import CircuitBreaker, get_circuit_breaker, get_rate_limiter
+from refresher import format_refreshed_at, get_refresher
+from responses import CompressionMiddleware, negotiate_flights
+from scrapers import WINDOW_REQUESTS
+from settings import (
+    AIRPORTS_MAX_AGE,
+    ORIGINS,
+    PROFILE_SAMPLE_INTERVAL,
+    TRACE_ENABLED,
+    SEARCH_RETRY_AFTER,
+    LogConfig,
+)
+from scheduler import get_scheduler, get_search_limiter
+from tracing import SamplingProfiler, span, start_trace
+from validators import AlertRule, BatchSearch, FlightData, MetroFlightData
 
 dictConfig(LogConfig().dict())
 logger = logging.getLogger("app")
@@ -19,6 +54,9 @@ logger = logging.getLogger("app")
 
 app = FastAPI()
 
+# Identical searches running at the same time share the same finder
+SEARCHES = SingleFlight()
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +65,160 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+
+# Read from the stats of each component when /metrics is requested
+REGISTRY.counter(
+    "latam_cache_hits_total",
+    "Window lookups found in the cache",
+    function=lambda: get_cache().stats["hits"],
+)
+REGISTRY.counter(
+    "latam_cache_misses_total",
+    "Window lookups not found in the cache",
+    function=lambda: get_cache().stats["misses"],
+)
+REGISTRY.gauge(
+    "latam_cache_hit_ratio",
+    "Share of the window lookups found in the cache",
+    function=lambda: get_cache().stats["hit_rate"],
+)
+REGISTRY.gauge(
+    "latam_upstream_requests_in_flight",
+    "LATAM requests running in the scheduler",
+    function=lambda: get_scheduler().stats["running"],
+)
+REGISTRY.gauge(
+    "latam_upstream_requests_waiting",
+    "LATAM requests waiting for a slot in the scheduler",
+    function=lambda: get_scheduler().stats["waiting"],
+)
+REGISTRY.gauge(
+    "latam_windows_in_flight",
+    "Distinct LATAM windows being requested",
+    function=lambda: WINDOW_REQUESTS.stats["in_flight"],
+)
+REGISTRY.counter(
+    "latam_http_requests_total",
+    "Requests sent by the http session",
+    function=lambda: get_session().metrics["requests"],
+)
+REGISTRY.counter(
+    "latam_http_new_connections_total",
+    "Connections opened by the http session",
+    function=lambda: get_session().metrics["new_connections"],
+)
+REGISTRY.gauge(
+    "latam_searches_waiting",
+    "Searches waiting for a slot of the worker",
+    function=lambda: get_search_limiter().stats["waiting"],
+)
+REGISTRY.counter(
+    "latam_searches_rejected_total",
+    "Searches answered 503 because the worker was saturated",
+    function=lambda: get_search_limiter().stats["rejected"],
+)
+REGISTRY.gauge(
+    "latam_circuit_breaker_open",
+    "1 while the upstream circuit breaker is open",
+    function=lambda: float(get_circuit_breaker().state == CircuitBreaker.OPEN),
+)
+
+
+@asynccontextmanager
+async def search_slots(slots: int = 1):
+    """
+    Holds slots of the SearchLimiter, one per searched route, or answers 503 with
+    a Retry-After when the worker is saturated
+    """
+    limiter = get_search_limiter()
+    if not await limiter.acquire(slots):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many searches. Please try again later",
+            headers={"Retry-After": str(SEARCH_RETRY_AFTER)},
+        )
+    try:
+        yield
+    finally:
+        limiter.release(slots)
+
+
+async def search_slot():
+    """
+    Dependency of the single route searches: holds a slot until the response is
+    sent (streams included)
+    """
+    async with search_slots():
+        yield
+
+
+async def search_flight(flight: FlightData) -> tuple:
+    """
+    Searches the flight, sharing the search with identical ones already running
+    :return: Tuple (best_price, all_flights, views, airlines, matrix), matrix being
+    the PriceMatrix of all_flights
+    """
+    started_at = time.perf_counter()
+    SEARCHES_IN_PROGRESS.inc()
+    try:
+        key = (
+            get_search_providers(),
+            flight.origin,
+            flight.destination,
+            flight.departure_date,
+            flight.days,
+        )
+        return await SEARCHES.do(key, _run_search, flight)
+    finally:
+        SEARCHES_IN_PROGRESS.dec()
+        SEARCH_SECONDS.observe(time.perf_counter() - started_at)
+
+
+async def _run_search(flight: FlightData) -> tuple:
+    finder = create_finder(flight)
+    best_price, all_flights = await finder.get_all_flights()
+    return best_price, all_flights, finder.views, finder.airlines, finder.matrix
+
+
+async def traced_search(flight: FlightData, profile: bool = False) -> tuple:
+    """
+    Runs the search on its own, neither shared with identical searches nor served
+    by the refresher, recording the spans of each stage.
+    With profile, the event loop thread is sampled while the search runs.
+    :return: Tuple (best_price, all_flights, views, airlines, matrix, trace summary
+    (see Trace.summary), collapsed stacks or None)
+    """
+    profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL) if profile else None
+    with start_trace() as trace:
+        if profiler is not None:
+            profiler.start()
+        try:
+            with span(
+                "get_flights",
+                origin=flight.origin,
+                destination=flight.destination,
+                days=flight.days,
+            ):
+                result = await _run_search(flight)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+    stacks = profiler.collapsed() if profiler is not None else None
+    return (*result, trace.summary(), stacks)
+
+
+@app.on_event("startup")
+async def start_refresher():
+    # Fails the startup on an unknown provider instead of every search
+    get_search_providers()
+    get_refresher().start()
+
+
+@app.on_event("shutdown")
+async def close_http_session():
+    await get_refresher().stop()
+    await get_session().aclose()
 
 
 @app.get("/")
@@ -34,12 +226,99 @@ async def read_index():
     return FileResponse("frontend/index.html")
 
 
-@app.get("/{departure_date}/{origin}/{destination}")
-def get_flights(departure_date: str, origin: str, destination: str):
+@app.get("/history/{origin}/{destination}")
+def get_route_history(
+    origin: str,
+    destination: str,
+    bucket: int = Query(3600, ge=60),
+    days: int = Query(30, ge=1, le=365),
+):
+    """
+    Cheapest price of the route over time, in buckets of seconds, for the last days.
+    Sync so the sqlite queries run in the threadpool instead of the event loop.
+    :return: List of {observed_at, best_price}
+    """
+    return get_price_history().route_min_over_time(
+        origin.upper(), destination.upper(), bucket, time.time() - days * 86400
+    )
+
+
+@app.get("/history/{origin}/{destination}/{departure_date}/{return_date}")
+def get_cell_history(
+    origin: str,
+    destination: str,
+    departure_date: str,
+    return_date: str,
+    days: int = Query(30, ge=1, le=365),
+):
+    """
+    Every price observed for a departure and return date in the last days
+    :return: List of {observed_at, price, airline}
+    """
+    return get_price_history().cell_history(
+        origin.upper(),
+        destination.upper(),
+        departure_date,
+        return_date,
+        time.time() - days * 86400,
+    )
+
+
+@app.get(
+    "/{departure_date}/{origin}/{destination}", dependencies=[Depends(search_slot)]
+)
+async def get_flights(
+    request: Request,
+    departure_date: str,
+    origin: str,
+    destination: str,
+    days: Optional[int] = None,
+    weeks: Optional[int] = None,
+    trace: bool = False,
+    profile: bool = False,
+):
+    """
+    :return: Dict: {flights, best_price, views, airlines, refreshed_at}. views are
+    derived from the prices (see PriceMatrix.views). airlines is the provider of
+    each price when SEARCH_PROVIDERS has more than one, otherwise None.
+    refreshed_at is the time the prices of a watched route were refreshed, None
+    when they were just searched.
+    flights are sent in the compact format (see PriceMatrix.to_compact) when the
+    Accept header asks for it (see negotiate_flights).
+    With ?trace=1 (or the X-Trace: 1 header) and TRACE_ENABLED, the search runs on
+    its own and the response has a "trace" with the time of each stage (see
+    traced_search).
+    With ?profile=1 the response is the sampled stacks of the search in the
+    collapsed format, e.g. for flamegraph.pl.
+    """
+    if profile and not PROFILE_SAMPLE_INTERVAL:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Profiling is disabled"
+        )
+    trace = trace or request.headers.get("X-Trace") == "1"
+    if trace and not TRACE_ENABLED:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Tracing is disabled"
+        )
+    traced = trace or profile
+    trace_summary = stacks = None
     try:
         flight = FlightData(**locals())
-        latam = LatamFinder(flight)
-        best_price, all_flights = latam.get_all_flights()
+        refresher = get_refresher()
+        refresher.record_request(flight)
+        refreshed = None if traced else refresher.lookup(flight)
+        if traced:
+            search = await traced_search(flight, profile)
+            best_price, all_flights, views, airlines, matrix, *search = search
+            trace_summary, stacks = search
+            refreshed_at = None
+        elif refreshed is None:
+            search = await search_flight(flight)
+            best_price, all_flights, views, airlines, matrix = search
+            refreshed_at = None
+        else:
+            best_price, all_flights, views, airlines, matrix, refreshed_at = refreshed
+            refreshed_at = format_refreshed_at(refreshed_at)
     except ValidationError as e:
         error_msg = json.loads(e.json())
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_msg)
@@ -50,24 +329,281 @@ def get_flights(departure_date: str, origin: str, destination: str):
             detail="Could not get the results. Please try again later",
         )
 
+    if stacks is not None:
+        return PlainTextResponse(stacks)
+
     if best_price is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Could not get flights for this destination or date",
         )
 
-    return {"flights": all_flights, "best_price": best_price}
+    content = {
+        "flights": all_flights,
+        "best_price": best_price,
+        "views": views,
+        "airlines": airlines,
+        "refreshed_at": refreshed_at,
+    }
+    if trace_summary is not None:
+        content["trace"] = trace_summary
+    return negotiate_flights(request, content, matrix)
+
+
+@app.post("/search/batch")
+async def search_batch(body: dict = Body(...)):
+    """
+    Searches many routes at once. All their upstream requests share the same scheduler.
+    Body: {"searches": [{departure_date, origin, destination, days}]} and/or
+    {"departure_date", "origin", "destinations": [...], "days"}
+    :return: Dict: {routes: [{origin, destination, departure_date, days, best_price, flights}],
+    cheapest: {origin, destination, departure_date, return_date, price} or None}
+    """
+    try:
+        flights = BatchSearch(**body).flights()
+    except ValidationError as e:
+        error_msg = json.loads(e.json())
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_msg)
+
+    async with search_slots(len(flights)):
+        results = await asyncio.gather(
+            *(search_flight(flight) for flight in flights), return_exceptions=True
+        )
+
+    routes = []
+    cheapest = None
+    for flight, result in zip(flights, results):
+        route = {
+            "origin": flight.origin,
+            "destination": flight.destination,
+            "departure_date": flight.departure_date,
+            "days": flight.days,
+        }
+        if isinstance(result, Exception):
+            logging.error(result)
+            routes.append({**route, "detail": "Could not get the results"})
+            continue
+
+        best_price, all_flights, *_ = result
+        routes.append({**route, "best_price": best_price, "flights": all_flights})
+        for departure_date, return_dates in all_flights.items():
+            for return_date, price in return_dates.items():
+                if price and (cheapest is None or price < cheapest["price"]):
+                    cheapest = {
+                        "origin": flight.origin,
+                        "destination": flight.destination,
+                        "departure_date": departure_date,
+                        "return_date": return_date,
+                        "price": price,
+                    }
+
+    return {"routes": routes, "cheapest": cheapest}
+
+
+@app.get("/metro/{departure_date}/{origin}/{destination}")
+async def get_metro_flights(
+    request: Request,
+    departure_date: str,
+    origin: str,
+    destination: str,
+    days: Optional[int] = None,
+    weeks: Optional[int] = None,
+):
+    """
+    Searches every airport pair between two metro areas (e.g. SAO and RIO) or
+    airports at once and keeps the cheapest price of each date.
+    :return: Dict: {flights: {departure_date: {return_date: price}}, best_price,
+    airports: {departure_date: {return_date: "ORIGIN-DESTINATION" or None}}}
+    """
+    try:
+        flights = MetroFlightData(**locals()).flights()
+    except ValidationError as e:
+        error_msg = json.loads(e.json())
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_msg)
+
+    async with search_slots(len(flights)):
+        results = await asyncio.gather(
+            *(search_flight(flight) for flight in flights), return_exceptions=True
+        )
+
+    cheapest = CheapestPriceMatrix(flights[0].departure_date, flights[0].days)
+    pairs = []
+    best_prices = []
+    for flight, result in zip(flights, results):
+        if isinstance(result, Exception):
+            logging.error(result)
+            continue
+        best_price, all_flights, *_ = result
+        if best_price is not None:
+            best_prices.append(best_price)
+        cheapest.merge(all_flights, source=len(pairs))
+        pairs.append(f"{flight.origin}-{flight.destination}")
+
+    if not best_prices:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not get flights for this destination or date",
+        )
+
+    return negotiate_flights(
+        request,
+        {
+            "flights": cheapest.to_dict(),
+            "best_price": min(best_prices),
+            "views": cheapest.views(),
+            "airports": cheapest.sources_to_dict(pairs),
+        },
+        cheapest,
+    )
+
+
+@app.get(
+    "/{departure_date}/{origin}/{destination}/stream",
+    dependencies=[Depends(search_slot)],
+)
+async def stream_flights(
+    departure_date: str,
+    origin: str,
+    destination: str,
+    days: Optional[int] = None,
+    weeks: Optional[int] = None,
+):
+    """
+    Streams the search as newline delimited json, one line as soon as each upstream
+    response arrives: {"flights": {...}, "best_price": best price so far}, plus the
+    "airline" of the response when SEARCH_PROVIDERS has more than one.
+    The last line is {"done": true, "best_price": best price or null, "views": views of
+    all the prices, "airlines": provider of each price or null}
+    """
+    try:
+        flight = FlightData(**locals())
+        finder = create_finder(flight)
+    except ValidationError as e:
+        error_msg = json.loads(e.json())
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_msg)
+
+    async def generate_lines():
+        best_price = None
+        try:
+            async for response in finder.iter_flights():
+                best_price = response["best_price"]
+                yield json.dumps(response) + "\n"
+        except Exception as e:
+            logging.error(e)
+            yield json.dumps(
+                {
+                    "done": True,
+                    "best_price": best_price,
+                    "detail": "Could not get the results. Please try again later",
+                }
+            ) + "\n"
+            return
+        yield json.dumps(
+            {
+                "done": True,
+                "best_price": best_price,
+                "views": finder.views,
+                "airlines": finder.airlines,
+            }
+        ) + "\n"
+
+    return StreamingResponse(generate_lines(), media_type="application/x-ndjson")
 
 
 @app.get("/airports")
-def get_airports():
-    AIRPORTS = load_airports()
-    if len(AIRPORTS) == 0:
+async def get_airports(request: Request):
+    registry = get_airport_registry()
+    if len(registry) == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Could not load the airport list",
         )
-    return AIRPORTS
+    headers = {
+        "ETag": registry.etag,
+        "Cache-Control": f"public, max-age={AIRPORTS_MAX_AGE}",
+    }
+    if request.headers.get("if-none-match") == registry.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(registry.json, media_type="application/json", headers=headers)
+
+
+@app.post("/alerts")
+def create_alert(body: dict = Body(...)):
+    """
+    Registers a price drop alert, checked on every new LATAM response of the route.
+    Body: {origin, destination, departure_from, departure_to, return_from,
+    return_to, threshold}
+    :return: Dict: {id, rule, alerts}, where alerts are the ones already matched by
+    the last known prices
+    """
+    try:
+        rule = AlertRule(**body)
+    except ValidationError as e:
+        error_msg = json.loads(e.json())
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error_msg)
+
+    rule_id, alerts = get_alert_engine().add(rule)
+    return {"id": rule_id, "rule": rule, "alerts": alerts}
+
+
+@app.get("/alerts/{rule_id}")
+def get_alert(rule_id: int):
+    rule = get_alert_engine().get(rule_id)
+    if rule is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Alert not found"
+        )
+    return {"id": rule_id, "rule": rule}
+
+
+@app.delete("/alerts/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_alert(rule_id: int):
+    if not get_alert_engine().remove(rule_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Alert not found"
+        )
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@app.get("/airports/search")
+async def search_airports(
+    q: str = Query(..., min_length=1), limit: int = Query(10, ge=1, le=50)
+):
+    """
+    Autocomplete over iata code, city and airport name, accents are ignored
+    """
+    return get_airport_registry().index.search(q, limit)
+
+
+@app.get("/stats")
+async def get_stats():
+    capture = get_capture_writer()
+    return {
+        "http": get_session().metrics,
+        "cache": get_cache().stats,
+        "coalescing": {"searches": SEARCHES.stats, "windows": WINDOW_REQUESTS.stats},
+        "scheduler": get_scheduler().stats,
+        "searches": get_search_limiter().stats,
+        "upstream": {
+            "rate_limiter": get_rate_limiter().stats,
+            "circuit_breaker": get_circuit_breaker().stats,
+            "latency": get_latency_tracker().stats,
+        },
+        "refresher": get_refresher().stats,
+        "history": get_price_history().stats,
+        "alerts": get_alert_engine().stats,
+        "capture": capture.stats if capture is not None else None,
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Same counters as /stats plus latency histograms, in the Prometheus text format
+    """
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,317 @@
+from __future__ import annotations
+
+import calendar
+from datetime import date, timedelta
+from itertools import chain
+
+import numpy as np
+
+from settings import VIEWS_TOP_K
+
+
+# Ordinal of the "YYYY-MM-DD" dates already seen, looking them up is faster than parsing
+_ORDINALS = {}
+
+
+def _date_ordinals(date_strs) -> list[int]:
+    try:
+        return list(map(_ORDINALS.__getitem__, date_strs))
+    except KeyError:
+        for date_str in date_strs:
+            if date_str not in _ORDINALS:
+                _ORDINALS[date_str] = date.fromisoformat(date_str).toordinal()
+        return list(map(_ORDINALS.__getitem__, date_strs))
+
+
+class PriceMatrix:
+    """
+    Departure x return price grid stored in a float32 array indexed by the number of
+    days since the first date. Missing cells are NaN and the known mask tells the
+    cells that were returned by the airline, so unavailable flights are kept apart
+    from the ones never searched.
+    The grid grows when a cell outside of it is merged.
+    """
+
+    def __init__(self, first_date: date, days: int):
+        self._first_date = first_date
+        self._prices = np.full((days, days), np.nan, dtype=np.float32)
+        self._known = np.zeros((days, days), dtype=bool)
+
+    @property
+    def first_date(self) -> date:
+        return self._first_date
+
+    @property
+    def shape(self) -> tuple:
+        return self._prices.shape
+
+    @property
+    def prices(self) -> np.ndarray:
+        """
+        :return: Array with the prices, NaN where there is no price
+        """
+        return self._prices
+
+    @property
+    def known(self) -> np.ndarray:
+        """
+        :return: Boolean array, True for the cells returned by the airline
+        """
+        return self._known
+
+    def merge(self, *all_flights: dict) -> None:
+        """
+        Merges responses in the format {departure_date: {return_date: price}},
+        where 0 is an unavailable flight and None an unknown one. Later responses override the earlier ones.
+        Merging many responses at once is faster than one at a time.
+        """
+        cells = self._cells(all_flights)
+        if cells is None:
+            return
+        rows, columns, values = cells
+        self._prices[rows, columns] = values
+        self._known[rows, columns] = True
+
+    def _cells(self, all_flights: tuple) -> tuple | None:
+        """
+        Converts the responses to grid indexes, growing the grid when needed.
+        A LATAM response is a block of departures x the same return dates, so the
+        dates of a block are parsed once and its prices copied row by row.
+        :return: Tuple (rows, columns, values) of numpy arrays, None if there are no cells
+        """
+        # Departure and number of cells of each row, repeated once for all at the end
+        departures, sizes, columns, values = [], [], [], []
+        for flights in all_flights:
+            return_dates = list(flights.values())
+            if not return_dates:
+                continue
+            returns = return_dates[0].keys()
+            if all(map(returns.__eq__, map(dict.keys, return_dates))):
+                departures.extend(_date_ordinals(flights))
+                sizes.extend([len(returns)] * len(return_dates))
+                columns.extend(_date_ordinals(returns) * len(return_dates))
+                values.extend(chain.from_iterable(map(dict.values, return_dates)))
+                continue
+            for departure, other in zip(_date_ordinals(flights), return_dates):
+                departures.append(departure)
+                sizes.append(len(other))
+                columns.extend(_date_ordinals(other))
+                values.extend(other.values())
+
+        if not values:
+            return None
+        rows = np.repeat(np.array(departures, dtype=np.int64), sizes)
+        columns = np.fromiter(columns, dtype=np.int64, count=len(columns))
+        # None (an unknown cell of a dense output) becomes NaN, nothing to merge
+        values = np.array(values, dtype=np.float32)
+        merged = ~np.isnan(values)
+        if not merged.all():
+            rows, columns, values = rows[merged], columns[merged], values[merged]
+            if not len(values):
+                return None
+
+        self._grow(
+            int(min(rows.min(), columns.min())), int(max(rows.max(), columns.max()))
+        )
+        origin = self._first_date.toordinal()
+        rows -= origin
+        columns -= origin
+        values[values == 0] = np.nan
+        return rows, columns, values
+
+    def best_price(self) -> float | None:
+        if np.isnan(self._prices).all():
+            return None
+        return round(float(np.nanmin(self._prices)), 2)
+
+    def to_dict(self) -> dict:
+        """
+        Output in the api format {departure_date: {return_date: price}}. Every departure
+        with a known cell gets every return date with a known cell, 0 when the airline
+        has no price and None when the cell is unknown (e.g. its request failed).
+        """
+        rows = np.flatnonzero(self._known.any(axis=1))
+        columns = np.flatnonzero(self._known.any(axis=0))
+        prices = self._prices[np.ix_(rows, columns)]
+        grid = prices.astype(np.float64).round(2).astype(object)
+        # The ints and None of the api, which json encodes faster than floats
+        grid[np.isnan(prices)] = 0
+        grid[~self._known[np.ix_(rows, columns)]] = None
+        labels = self._labels()
+        column_labels = [labels[column] for column in columns]
+        return {
+            labels[row]: dict(zip(column_labels, prices))
+            for row, prices in zip(rows.tolist(), grid.tolist())
+        }
+
+    def to_compact(self) -> dict:
+        """
+        Same cells as to_dict without repeating the dates: the departures and returns
+        are day offsets from first_date and prices is the row major grid of
+        len(departures) x len(returns) (0 when there is no price, None when unknown).
+        :return: Dict: {first_date, departures: [int], returns: [int], prices: [float|None]}
+        """
+        rows = np.flatnonzero(self._known.any(axis=1))
+        columns = np.flatnonzero(self._known.any(axis=0))
+        grid = self._prices[np.ix_(rows, columns)].astype(np.float64).round(2)
+        known = self._known[np.ix_(rows, columns)]
+        prices = np.where(known, np.nan_to_num(grid, nan=0), np.nan).ravel().tolist()
+        return {
+            "first_date": self._first_date.strftime("%Y-%m-%d"),
+            "departures": rows.tolist(),
+            "returns": columns.tolist(),
+            "prices": [None if price != price else price for price in prices],
+        }
+
+    @classmethod
+    def from_dict(cls, all_flights: dict) -> "PriceMatrix":
+        """
+        :param all_flights: Output of to_dict
+        """
+        dates = [
+            date_str
+            for departure_date, return_dates in all_flights.items()
+            for date_str in (departure_date, *return_dates)
+        ]
+        first_date = date.fromisoformat(min(dates)) if dates else date.today()
+        matrix = cls(first_date, 1)
+        matrix.merge(all_flights)
+        return matrix
+
+    def views(self, top_k: int = VIEWS_TOP_K) -> dict:
+        """
+        Aggregates of the cells with a price, so the clients do not have to walk the
+        whole grid. The cheapest cell of each group is a
+        {departure_date, return_date, price} dict.
+        :return: Dict: {by_trip_length: {days: cell}, by_weekday: {departure weekday: cell},
+        top: [top_k cheapest cells], min_by_departure: {departure_date: price},
+        min_by_return: {return_date: price}}
+        """
+        rows, columns = np.nonzero(~np.isnan(self._prices))
+        values = self._prices[rows, columns].astype(np.float64).round(2)
+        labels = self._labels()
+
+        def cell(index: int) -> dict:
+            return {
+                "departure_date": labels[rows[index]],
+                "return_date": labels[columns[index]],
+                "price": float(values[index]),
+            }
+
+        def cheapest_by(groups: np.ndarray) -> list:
+            # Sorted by group and then price, the first cell of each group is the cheapest
+            order = np.lexsort((values, groups))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = groups[order][1:] != groups[order][:-1]
+            return order[first].tolist()
+
+        trip_lengths = columns - rows
+        weekdays = (self._first_date.weekday() + rows) % 7
+        by_row = np.where(np.isnan(self._prices), np.inf, self._prices)
+        min_by_departure = by_row.min(axis=1).astype(np.float64).round(2).tolist()
+        min_by_return = by_row.min(axis=0).astype(np.float64).round(2).tolist()
+        return {
+            "by_trip_length": {
+                int(trip_lengths[index]): cell(index)
+                for index in cheapest_by(trip_lengths)
+                if trip_lengths[index] >= 0
+            },
+            "by_weekday": {
+                calendar.day_name[weekdays[index]].lower(): cell(index)
+                for index in cheapest_by(weekdays)
+            },
+            "top": [cell(index) for index in np.argsort(values, kind="stable")[:top_k]],
+            "min_by_departure": {
+                labels[row]: price
+                for row, price in enumerate(min_by_departure)
+                if price != np.inf
+            },
+            "min_by_return": {
+                labels[column]: price
+                for column, price in enumerate(min_by_return)
+                if price != np.inf
+            },
+        }
+
+    def _labels(self) -> list[str]:
+        return [
+            (self._first_date + timedelta(days=offset)).strftime("%Y-%m-%d")
+            for offset in range(self._prices.shape[0])
+        ]
+
+    def _grow(self, first_ordinal: int, last_ordinal: int) -> None:
+        """
+        Resizes the grid so the dates from first_ordinal to last_ordinal fit in it
+        """
+        size = self._prices.shape[0]
+        shift = max(self._first_date.toordinal() - first_ordinal, 0)
+        new_size = max(last_ordinal - self._first_date.toordinal() + 1, size) + shift
+        if new_size == size:
+            return
+        prices = np.full((new_size, new_size), np.nan, dtype=np.float32)
+        known = np.zeros((new_size, new_size), dtype=bool)
+        prices[shift : shift + size, shift : shift + size] = self._prices
+        known[shift : shift + size, shift : shift + size] = self._known
+        self._prices, self._known = prices, known
+        self._first_date -= timedelta(days=shift)
+        self._grew(shift, size, new_size)
+
+    def _grew(self, shift: int, size: int, new_size: int) -> None:
+        """
+        Hook for subclasses with other arrays of the same shape
+        """
+
+
+class CheapestPriceMatrix(PriceMatrix):
+    """
+    PriceMatrix that keeps the cheapest price of many sources (e.g. airport pairs)
+    for each cell, and which source it came from.
+    """
+
+    def __init__(self, first_date: date, days: int):
+        super().__init__(first_date, days)
+        self._sources = np.full((days, days), -1, dtype=np.int16)
+
+    @property
+    def sources(self) -> np.ndarray:
+        """
+        :return: Array with the source of each price, -1 where there is no price
+        """
+        return self._sources
+
+    def merge(self, *all_flights: dict, source: int = 0) -> None:
+        """
+        Merges the responses of a source, keeping the cheapest price of each cell
+        """
+        cells = self._cells(all_flights)
+        if cells is None:
+            return
+        rows, columns, values = cells
+        current = self._prices[rows, columns]
+        cheaper = ~np.isnan(values) & (np.isnan(current) | (values < current))
+        self._prices[rows[cheaper], columns[cheaper]] = values[cheaper]
+        self._sources[rows[cheaper], columns[cheaper]] = source
+        self._known[rows, columns] = True
+
+    def sources_to_dict(self, labels: list) -> dict:
+        """
+        Same cells as to_dict with the label of the source of each price, None when
+        there is no price
+        """
+        rows = np.flatnonzero(self._known.any(axis=1))
+        columns = np.flatnonzero(self._known.any(axis=0))
+        grid = self._sources[np.ix_(rows, columns)].tolist()
+        dates = self._labels()
+        column_dates = [dates[column] for column in columns]
+        return {
+            dates[row]: {
+                return_date: labels[source] if source >= 0 else None
+                for return_date, source in zip(column_dates, sources)
+            }
+            for row, sources in zip(rows, grid)
+        }
+
+    def _grew(self, shift: int, size: int, new_size: int) -> None:
+        sources = np.full((new_size, new_size), -1, dtype=np.int16)
+        sources[shift : shift + size, shift : shift + size] = self._sources
+        self._sources = sources
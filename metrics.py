@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from typing import Callable
+
+# Seconds of the searches and upstream requests
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# Seconds of the cpu bound steps, parsing and merging
+STEP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        function: Callable[[], float] | None = None,
+    ):
+        """
+        :param function: Called when the metrics are collected to read the value,
+        so values counted elsewhere (see the stats properties) cost nothing until then
+        """
+        self.name = name
+        self.documentation = documentation
+        self._labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = function
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self._labelnames):
+            raise ValueError(f"{self.name} takes the labels {self._labelnames}")
+        return tuple((name, labels[name]) for name in self._labelnames)
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        """
+        :return: List of (sample name, labels, value)
+        """
+        if self._function is not None:
+            return [(self.name, (), self._function())]
+        return [(self.name, labels, value) for labels, value in self._values.items()]
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{_format_labels(labels)} {_format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up, e.g. number of retries
+    """
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, e.g. searches in progress
+    """
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observations in cumulative buckets, e.g. request latencies.
+    An observation is a bisect and two additions, cheap enough for the hot path.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # [count per bucket (the last one is +Inf), sum]
+            series = self._values[key] = [[0] * (len(self._buckets) + 1), 0.0]
+        series[0][bisect_left(self._buckets, value)] += 1
+        series[1] += value
+
+    def count(self, **labels) -> int:
+        series = self._values.get(self._key(labels))
+        return sum(series[0]) if series else 0
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        samples = []
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self._buckets, math.inf), counts):
+                cumulative += count
+                bucket_labels = (*labels, ("le", _format_value(bound)))
+                samples.append((f"{self.name}_bucket", bucket_labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process, rendered in the Prometheus text format.
+    The metrics are updated from the event loop only, so they are not locked.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        function: Callable[[], float] | None = None,
+    ) -> Counter:
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        function: Callable[[], float] | None = None,
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+SEARCH_SECONDS = REGISTRY.histogram(
+    "latam_search_seconds", "End to end duration of the flight searches"
+)
+SEARCHES_IN_PROGRESS = REGISTRY.gauge(
+    "latam_searches_in_progress", "Flight searches running"
+)
+UPSTREAM_REQUEST_SECONDS = REGISTRY.histogram(
+    "latam_upstream_request_seconds", "Duration of each LATAM window request"
+)
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "latam_upstream_retries_total", "LATAM window requests tried again"
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "latam_upstream_errors_total",
+    "Failed LATAM requests, by http status code, timeout or network",
+    ("code",),
+)
+PARSE_SECONDS = REGISTRY.histogram(
+    "latam_parse_seconds",
+    "Time reformatting a LATAM response (_reformat_latam_response)",
+    buckets=STEP_BUCKETS,
+)
+MERGE_SECONDS = REGISTRY.histogram(
+    "latam_merge_seconds",
+    "Time merging the windows of a search into its price grid",
+    buckets=STEP_BUCKETS,
+)
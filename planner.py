@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import math
+from datetime import date, timedelta
+from typing import Iterable
+
+# Number of departure and return days returned by a single bestprices request
+WINDOW_DAYS = 7
+
+
+def window_cells(departure_date: date, return_date: date) -> set:
+    """
+    :return: Set of (departure, return) cells returned by the window starting at the dates
+    """
+    return {
+        (departure_date + timedelta(days=dep), return_date + timedelta(days=ret))
+        for dep in range(WINDOW_DAYS)
+        for ret in range(WINDOW_DAYS)
+    }
+
+
+def plan_windows(
+    first_date: date, days: int, covered: Iterable[tuple] = ()
+) -> list[tuple[date, date]]:
+    """
+    Plans the bestprices windows needed to get every (departure, return) cell, with
+    return >= departure, of the days starting at first_date.
+    The cells are walked by departure and then return date and a window is placed
+    on the first one not covered yet, skipping the cells already in covered.
+    If skipping the covered cells shifts the windows into a worse plan, the fixed
+    grid without the fully covered windows is used instead.
+    :return: List of (departure_date, return_date) where each window starts
+    """
+    covered = set(covered)
+    windows = _greedy_windows(first_date, days, covered)
+    if not covered:
+        return windows
+
+    last_date = first_date + timedelta(days=days - 1)
+    grid_windows = [
+        window
+        for window in _greedy_windows(first_date, days, set())
+        if any(
+            departure_date <= return_date <= last_date
+            and (departure_date, return_date) not in covered
+            for departure_date, return_date in window_cells(*window)
+        )
+    ]
+    return grid_windows if len(grid_windows) < len(windows) else windows
+
+
+def _greedy_windows(first_date: date, days: int, covered: set) -> list:
+    covered = set(covered)
+    windows = []
+    for dep in range(days):
+        departure_date = first_date + timedelta(days=dep)
+        for ret in range(dep, days):
+            return_date = first_date + timedelta(days=ret)
+            if (departure_date, return_date) in covered:
+                continue
+            windows.append((departure_date, return_date))
+            covered |= window_cells(departure_date, return_date)
+    return windows
+
+
+def plan_cost(days: int, windows: list) -> dict:
+    """
+    Compares a plan with the fixed grid of windows every WINDOW_DAYS days.
+    :return: Dict: {windows:int, naive_windows:int, calls_saved:int}
+    """
+    blocks = math.ceil(days / WINDOW_DAYS)
+    naive_windows = blocks * (blocks + 1) // 2
+    return {
+        "windows": len(windows),
+        "naive_windows": naive_windows,
+        "calls_saved": naive_windows - len(windows),
+    }
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import AsyncIterator
+
+from cache import ResultCache
+from matrix import CheapestPriceMatrix
+from metrics import MERGE_SECONDS
+from scrapers import LatamFinder, StubFinder, TicketFinder
+from settings import SEARCH_PROVIDERS
+from tracing import span
+from validators import FlightData
+
+LOGGER = logging.getLogger("app.providers")
+
+# Ticket finders by the name used in SEARCH_PROVIDERS
+PROVIDERS = {LatamFinder.airline: LatamFinder, StubFinder.airline: StubFinder}
+
+
+def parse_providers(value: str) -> tuple[str, ...]:
+    """
+    :param value: Comma separated names of PROVIDERS, e.g. "latam,stub"
+    :return: Tuple of the names, in the given order
+    """
+    names = tuple(
+        dict.fromkeys(name.strip().lower() for name in value.split(",") if name.strip())
+    )
+    unknown = [name for name in names if name not in PROVIDERS]
+    if not names or unknown:
+        raise ValueError(
+            f"SEARCH_PROVIDERS must be some of {sorted(PROVIDERS)}, got {value!r}"
+        )
+    return names
+
+
+class MultiProviderFinder:
+    """
+    Searches a flight with several providers at the same time and keeps the
+    cheapest price of each cell among them, and which provider it came from.
+    Every provider uses the process wide scheduler, rate limiter and circuit
+    breaker, and they all start together, so the search deadline is the same.
+    A provider that fails leaves its cells to the others.
+    """
+
+    def __init__(
+        self,
+        flight: FlightData,
+        names: tuple[str, ...],
+        cache: ResultCache | None = None,
+    ):
+        self._names = list(names)
+        self._finders = [PROVIDERS[name](flight, cache=cache) for name in names]
+        self._cheapest = CheapestPriceMatrix(flight.departure_date, flight.days)
+        self._views = None
+        self._airlines = None
+
+    @property
+    def views(self) -> dict | None:
+        """
+        :return: Derived views of the cheapest prices, None before the search is over
+        """
+        return self._views
+
+    @property
+    def matrix(self) -> CheapestPriceMatrix:
+        """
+        :return: The cheapest prices found so far, the same cells as the flights
+        returned
+        """
+        return self._cheapest
+
+    @property
+    def airlines(self) -> dict | None:
+        """
+        :return: Dict: {departure_date: {return_date: provider or None}}, None before
+        the search is over
+        """
+        return self._airlines
+
+    async def get_all_flights(self) -> tuple:
+        """
+        :return: Tuple (best_price, all_flights) with the cheapest price of each cell
+        """
+        results = await asyncio.gather(
+            *(finder.get_all_flights() for finder in self._finders),
+            return_exceptions=True,
+        )
+        started_at = time.perf_counter()
+        with span("merge_providers", providers=len(self._finders)):
+            for source, (name, result) in enumerate(zip(self._names, results)):
+                if isinstance(result, Exception):
+                    LOGGER.error(f"Could not search {name}: {result}")
+                    continue
+                _, all_flights = result
+                self._cheapest.merge(all_flights, source=source)
+            self._finish()
+        MERGE_SECONDS.observe(time.perf_counter() - started_at)
+        return self._cheapest.best_price(), self._cheapest.to_dict()
+
+    async def iter_flights(self) -> AsyncIterator[dict]:
+        """
+        Same search as get_all_flights, yielding the responses of every provider as
+        soon as they arrive.
+        :return: Async iterator of Dict: {airline, best_price, flights}, where
+        best_price is the best one found so far among all the providers
+        """
+        queue = asyncio.Queue()
+
+        async def drain(source: int) -> None:
+            try:
+                async for response in self._finders[source].iter_flights():
+                    await queue.put((source, response))
+            except Exception as error:
+                LOGGER.error(f"Could not search {self._names[source]}: {error}")
+            finally:
+                queue.put_nowait((source, None))
+
+        tasks = [
+            asyncio.ensure_future(drain(source)) for source in range(len(self._finders))
+        ]
+        best_price = None
+        try:
+            running = len(tasks)
+            while running:
+                source, response = await queue.get()
+                if response is None:
+                    running -= 1
+                    continue
+                self._cheapest.merge(response["flights"], source=source)
+                if best_price is None or response["best_price"] < best_price:
+                    best_price = response["best_price"]
+                yield {
+                    "airline": self._names[source],
+                    "flights": response["flights"],
+                    "best_price": best_price,
+                }
+            self._finish()
+        finally:
+            # The client may stop reading before the end of the search
+            for task in tasks:
+                task.cancel()
+
+    def _finish(self) -> None:
+        self._views = self._cheapest.views()
+        self._airlines = self._cheapest.sources_to_dict(self._names)
+
+
+def create_finder(
+    flight: FlightData,
+    names: tuple[str, ...] | None = None,
+    cache: ResultCache | None = None,
+) -> TicketFinder | MultiProviderFinder:
+    """
+    :param names: Providers to search, SEARCH_PROVIDERS by default
+    :return: The finder of the provider when there is only one, otherwise a
+    MultiProviderFinder of all of them. Both have the same get_all_flights,
+    iter_flights, views, matrix and airlines.
+    """
+    names = names or get_search_providers()
+    if len(names) == 1:
+        return PROVIDERS[names[0]](flight, cache=cache)
+    return MultiProviderFinder(flight, names, cache)
+
+
+_SEARCH_PROVIDERS = None
+
+
+def get_search_providers() -> tuple[str, ...]:
+    """
+    :return: The providers of SEARCH_PROVIDERS
+    """
+    global _SEARCH_PROVIDERS
+    if _SEARCH_PROVIDERS is None:
+        _SEARCH_PROVIDERS = parse_providers(SEARCH_PROVIDERS)
+    return _SEARCH_PROVIDERS
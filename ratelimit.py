@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import struct
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from settings import (
+    CIRCUIT_BREAKER_FAILURES,
+    CIRCUIT_BREAKER_RESET_TIMEOUT,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_PER_SECOND,
+    RATE_LIMIT_STATE_PATH,
+    RETRY_BACKOFF_BASE,
+    RETRY_BACKOFF_MAX,
+)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# tokens, updated_at, blocked_until
+_STATE = struct.Struct("ddd")
+# Seconds acquire waits before trying again when another worker holds the file lock
+_LOCK_RETRY = 0.001
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the upstream requests per second. With a path, the bucket
+    is kept in a file locked on every update, so all the gunicorn workers of the
+    host share the same rate. Without it (or without fcntl) it is per process.
+    The lock is never waited for, so the event loop is not blocked by another
+    worker holding it: acquire sleeps and tries again, try_acquire gives up, stats
+    shows the last state this worker saw and a pause is written with the next
+    update that gets the lock.
+    """
+
+    def __init__(
+        self,
+        rate: float = RATE_LIMIT_PER_SECOND,
+        burst: int = RATE_LIMIT_BURST,
+        path: str | None = RATE_LIMIT_STATE_PATH,
+    ):
+        self._rate = rate
+        self._burst = burst
+        self._path = path if path and fcntl is not None else None
+        # The bucket without a path, otherwise the last state read from the file
+        self._state = [float(burst), time.time(), 0.0]
+        self._paused_until = 0.0
+        self._waits = 0
+        self._lock_busy = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {rate:float, burst:int, tokens:float, blocked_for:float,
+        waits:int, lock_busy:int}
+        """
+        with self._locked_state() as state:
+            tokens, updated_at, blocked_until = state or self._state
+        blocked_until = max(blocked_until, self._paused_until)
+        now = time.time()
+        return {
+            "rate": self._rate,
+            "burst": self._burst,
+            "tokens": round(
+                min(self._burst, tokens + (now - updated_at) * self._rate), 2
+            ),
+            "blocked_for": round(max(blocked_until - now, 0.0), 2),
+            "waits": self._waits,
+            "lock_busy": self._lock_busy,
+        }
+
+    async def acquire(self) -> None:
+        """
+        Waits until there is a token to make a request
+        """
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                return
+            self._waits += 1
+            await asyncio.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a token only if there is one available now
+        :return: True if a token was taken
+        """
+        return self._take() <= 0
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops handing out tokens for seconds, e.g. when upstream sends a Retry-After
+        """
+        self._paused_until = max(self._paused_until, time.time() + seconds)
+        with self._locked_state():
+            pass
+
+    def _take(self) -> float:
+        """
+        :return: 0 if a token was taken, or the seconds to wait for the next one
+        """
+        with self._locked_state() as state:
+            if state is None:
+                self._lock_busy += 1
+                return _LOCK_RETRY
+            tokens, updated_at, blocked_until = state
+            now = time.time()
+            if now < blocked_until:
+                return blocked_until - now
+            tokens = min(self._burst, tokens + (now - updated_at) * self._rate)
+            if tokens >= 1:
+                state[:] = [tokens - 1, now, blocked_until]
+                return 0
+            state[:] = [tokens, now, blocked_until]
+            return (1 - tokens) / self._rate
+
+    @contextmanager
+    def _locked_state(self):
+        """
+        :return: Context of the state to read and update, None if another worker
+        holds the lock
+        """
+        if self._path is None:
+            self._state[2] = max(self._state[2], self._paused_until)
+            yield self._state
+            return
+        # Opened on every update: a lock on a descriptor inherited through a fork
+        # would be shared by the workers instead of excluding them
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+            data = os.pread(fd, _STATE.size, 0)
+            if len(data) == _STATE.size:
+                state = list(_STATE.unpack(data))
+            else:
+                state = [float(self._burst), time.time(), 0.0]
+            state[2] = max(state[2], self._paused_until)
+            yield state
+            os.pwrite(fd, _STATE.pack(*state), 0)
+            self._state = state
+        finally:
+            os.close(fd)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while upstream is down. After failure_threshold failures in a row the
+    circuit opens and no request is made for reset_timeout seconds, then a single
+    request is let through: success closes the circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURES,
+        reset_timeout: float = CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.reset()
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {state:str, failures:int, trips:int, retry_in:float}
+        """
+        retry_in = 0.0
+        if self._opened_at is not None:
+            retry_in = max(
+                self._opened_at + self._reset_timeout - time.monotonic(), 0.0
+            )
+        return {
+            "state": self.state,
+            "failures": self._failures,
+            "trips": self._trips,
+            "retry_in": round(retry_in, 2),
+        }
+
+    def allow(self) -> bool:
+        """
+        :return: True if a request can be made
+        """
+        state = self.state
+        if state == self.HALF_OPEN:
+            # Only one probe per reset_timeout, the others keep failing fast
+            self._opened_at = time.monotonic()
+            return True
+        return state == self.CLOSED
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self._failure_threshold:
+            if self._opened_at is None:
+                self._trips += 1
+            self._opened_at = time.monotonic()
+
+    def reset(self) -> None:
+        self._failures = 0
+        self._trips = 0
+        self._opened_at = None
+
+
+def backoff_delay(
+    attempt: int, base: float = RETRY_BACKOFF_BASE, cap: float = RETRY_BACKOFF_MAX
+) -> float:
+    """
+    Exponential backoff with full jitter
+    :return: Seconds to wait before retrying, between 0 and min(cap, base * 2 ** attempt)
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    :param value: Retry-After header, in seconds or as an http date
+    :return: Seconds to wait or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+_RATE_LIMITER = None
+_CIRCUIT_BREAKER = None
+
+
+def get_rate_limiter() -> TokenBucket:
+    """
+    :return: The process wide TokenBucket, shared with the other workers by its file
+    """
+    global _RATE_LIMITER
+    if _RATE_LIMITER is None:
+        _RATE_LIMITER = TokenBucket()
+    return _RATE_LIMITER
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """
+    :return: The process wide CircuitBreaker
+    """
+    global _CIRCUIT_BREAKER
+    if _CIRCUIT_BREAKER is None:
+        _CIRCUIT_BREAKER = CircuitBreaker()
+    return _CIRCUIT_BREAKER
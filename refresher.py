@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+from cache import ResultCache, WriteOnlyCache, get_cache
+from matrix import PriceMatrix
+from providers import create_finder
+from ratelimit import CircuitBreaker, get_circuit_breaker, get_rate_limiter
+from settings import (
+    REFRESH_INTERVAL,
+    REFRESH_LOCK_PATH,
+    REFRESH_MAX_AGE,
+    REFRESH_MAX_CONCURRENT,
+    REFRESH_TICK,
+    SEARCH_DEFAULT_DAYS,
+    WATCHED_ROUTES,
+)
+from validators import FlightData
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOGGER = logging.getLogger("app.refresher")
+
+
+def parse_watched_routes(value: str) -> list[tuple[str, str, int, int]]:
+    """
+    :param value: Comma separated ORIGIN-DESTINATION[:days[:offset]], e.g. "CGH-VIX:30,GRU-GIG"
+    where the range starts offset days from today (default 0) and lasts days
+    (default SEARCH_DEFAULT_DAYS)
+    :return: List of (origin, destination, days, offset)
+    """
+    routes = []
+    for route in filter(None, (route.strip() for route in value.split(","))):
+        airports, *range_ = route.split(":")
+        origin, destination = airports.upper().split("-")
+        days = int(range_[0]) if range_ else SEARCH_DEFAULT_DAYS
+        offset = int(range_[1]) if len(range_) > 1 else 0
+        routes.append((origin, destination, days, offset))
+    return routes
+
+
+class PriceRefresher:
+    """
+    Keeps the prices of the watched routes warm, so their searches are answered
+    without requesting LATAM. Every tick the due routes (not refreshed for interval
+    seconds) are refreshed, the stalest and most requested first, at most
+    max_concurrent at a time and only while LATAM is not rate limiting us or down.
+    The refreshed windows are written to the cache too. When it is shared by the
+    workers (sqlite), a lock_path (and fcntl) elects the worker holding its lock as
+    the only one refreshing, the others get the windows from the cache and take
+    over when it stops. With a cache of its own, every worker refreshes.
+    """
+
+    def __init__(
+        self,
+        routes: list[tuple[str, str, int, int]],
+        interval: float = REFRESH_INTERVAL,
+        max_age: float = REFRESH_MAX_AGE,
+        max_concurrent: int = REFRESH_MAX_CONCURRENT,
+        tick: float = REFRESH_TICK,
+        cache: ResultCache | None = None,
+        lock_path: str | None = REFRESH_LOCK_PATH,
+    ):
+        self._routes = {
+            (origin, destination): (days, offset)
+            for origin, destination, days, offset in routes
+        }
+        self._interval = interval
+        self._max_age = max_age
+        self._max_concurrent = max_concurrent
+        self._tick = tick
+        self._cache = cache if cache is not None else get_cache()
+        self._lock_path = (
+            lock_path
+            if lock_path and fcntl is not None and self._cache.shared
+            else None
+        )
+        self._lock_fd = None
+        # (origin, destination) ->
+        # (first_date, days, best_price, flights, views, airlines, matrix, refreshed_at)
+        self._store = {}
+        self._requests = Counter()
+        self._refreshes = 0
+        self._served = 0
+        self._task = None
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {routes:int, refreshes:int, served:int, running:bool,
+        leader:bool, ages: {"ORIGIN-DESTINATION": seconds or None}}
+        """
+        now = time.time()
+        return {
+            "routes": len(self._routes),
+            "refreshes": self._refreshes,
+            "served": self._served,
+            "running": self._task is not None and not self._task.done(),
+            "leader": self._lock_path is None or self._lock_fd is not None,
+            "ages": {
+                f"{origin}-{destination}": (
+                    round(now - self._store[(origin, destination)][-1], 1)
+                    if (origin, destination) in self._store
+                    else None
+                )
+                for origin, destination in self._routes
+            },
+        }
+
+    def record_request(self, flight: FlightData) -> None:
+        """
+        Counts a search of a watched route, to refresh the popular ones first
+        """
+        route = (flight.origin, flight.destination)
+        if route in self._routes:
+            self._requests[route] += 1
+
+    def lookup(self, flight: FlightData) -> tuple | None:
+        """
+        :return: Tuple (best_price, all_flights, views, airlines, matrix, refreshed_at)
+        from the refreshed prices if they cover the searched days and are not older
+        than max_age, otherwise None
+        """
+        entry = self._store.get((flight.origin, flight.destination))
+        if entry is None:
+            return None
+        (
+            first_date,
+            days,
+            best_price,
+            flights,
+            views,
+            airlines,
+            matrix,
+            refreshed_at,
+        ) = entry
+        last_date = first_date + timedelta(days=days - 1)
+        search_last_date = flight.departure_date + timedelta(days=flight.days - 1)
+        if (
+            flight.departure_date < first_date
+            or search_last_date > last_date
+            or time.time() - refreshed_at > self._max_age
+        ):
+            return None
+
+        self._served += 1
+        if (flight.departure_date, flight.days) == (first_date, days):
+            return best_price, flights, views, airlines, matrix, refreshed_at
+
+        first_date_str = flight.departure_date.strftime("%Y-%m-%d")
+        last_date_str = search_last_date.strftime("%Y-%m-%d")
+        all_flights = _trim(flights, first_date_str, last_date_str)
+        if airlines is not None:
+            airlines = _trim(airlines, first_date_str, last_date_str)
+        matrix = PriceMatrix(flight.departure_date, flight.days)
+        matrix.merge(all_flights)
+        best_price = matrix.best_price()
+        return best_price, all_flights, matrix.views(), airlines, matrix, refreshed_at
+
+    def start(self) -> None:
+        """
+        Starts refreshing in the background, on the running event loop
+        """
+        if self._routes and (self._task is None or self._task.done()):
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def refresh_once(self) -> int:
+        """
+        Refreshes the due routes that fit in this tick
+        :return: Number of routes refreshed
+        """
+        if (
+            get_circuit_breaker().state == CircuitBreaker.OPEN
+            or get_rate_limiter().stats["blocked_for"] > 0
+        ):
+            LOGGER.info("LATAM is unavailable or rate limiting, skipping the refresh")
+            return 0
+
+        now = time.time()
+        due = []
+        for route in self._routes:
+            entry = self._store.get(route)
+            staleness = now - entry[-1] if entry is not None else float("inf")
+            if staleness >= self._interval:
+                due.append((staleness * (1 + self._requests[route]), route))
+        due.sort(reverse=True)
+
+        routes = [route for _, route in due[: self._max_concurrent]]
+        results = await asyncio.gather(
+            *(self._refresh(route) for route in routes), return_exceptions=True
+        )
+        for route, result in zip(routes, results):
+            if isinstance(result, Exception):
+                LOGGER.error(f"Error refreshing {'-'.join(route)}: {result}")
+        return len(routes)
+
+    async def _run(self) -> None:
+        while True:
+            if self._lead():
+                await self.refresh_once()
+            await asyncio.sleep(self._tick)
+
+    def _lead(self) -> bool:
+        """
+        Takes the lock of lock_path if no other worker holds it
+        :return: True if this worker refreshes
+        """
+        if self._lock_path is None or self._lock_fd is not None:
+            return True
+        # Opened by the worker, a descriptor inherited through a fork would share
+        # the lock
+        fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        LOGGER.info(f"Refreshing the watched routes in the worker {os.getpid()}")
+        self._lock_fd = fd
+        return True
+
+    async def _refresh(self, route: tuple[str, str]) -> None:
+        origin, destination = route
+        days, offset = self._routes[route]
+        first_date = date.today() + timedelta(days=offset)
+        flight = FlightData(
+            departure_date=first_date.strftime("%Y-%m-%d"),
+            origin=origin,
+            destination=destination,
+            days=days,
+        )
+        # Not reading the windows it is replacing, but writing them for the searches
+        finder = create_finder(flight, cache=WriteOnlyCache(self._cache))
+        best_price, all_flights = await finder.get_all_flights()
+        if best_price is None:
+            LOGGER.warning(f"Could not refresh {origin}-{destination}")
+            return
+        self._store[route] = (
+            first_date,
+            days,
+            best_price,
+            all_flights,
+            finder.views,
+            finder.airlines,
+            finder.matrix,
+            time.time(),
+        )
+        self._refreshes += 1
+
+
+def _trim(grid: dict, first_date: str, last_date: str) -> dict:
+    """
+    :return: The cells of {departure_date: {return_date: value}} between the dates
+    """
+    return {
+        departure_date: {
+            return_date: value
+            for return_date, value in return_dates.items()
+            if first_date <= return_date <= last_date
+        }
+        for departure_date, return_dates in grid.items()
+        if first_date <= departure_date <= last_date
+    }
+
+
+def format_refreshed_at(refreshed_at: float) -> str:
+    return datetime.fromtimestamp(refreshed_at, timezone.utc).isoformat(
+        timespec="seconds"
+    )
+
+
+_REFRESHER = None
+
+
+def get_refresher() -> PriceRefresher:
+    """
+    :return: The process wide PriceRefresher of the WATCHED_ROUTES
+    """
+    global _REFRESHER
+    if _REFRESHER is None:
+        _REFRESHER = PriceRefresher(parse_watched_routes(WATCHED_ROUTES))
+    return _REFRESHER
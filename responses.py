@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from matrix import PriceMatrix
+from settings import COMPRESSION_MINIMUM_SIZE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# Flights as start date + day offsets + dense price array (see PriceMatrix.to_compact)
+COMPACT_MEDIA_TYPE = "application/vnd.latam.compact+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Streams are sent as they are, compressing them would hold back their lines
+_UNCOMPRESSED_MEDIA_TYPES = ("application/x-ndjson", "image/", "application/gzip")
+
+
+def negotiate_flights(
+    request: Request, content: dict, matrix: PriceMatrix
+) -> Response | dict:
+    """
+    Encodes a response with a "flights" grid in the format asked by the Accept header:
+    compact json, MessagePack of the compact format (when msgpack is installed) or
+    the regular json, returned as is.
+    :param matrix: The PriceMatrix of the "flights", the compact format is built
+    from it
+    """
+    accept = request.headers.get("accept", "")
+    if msgpack is not None and MSGPACK_MEDIA_TYPE in accept:
+        return Response(
+            msgpack.packb(_compact(content, matrix)), media_type=MSGPACK_MEDIA_TYPE
+        )
+    if COMPACT_MEDIA_TYPE in accept:
+        return JSONResponse(_compact(content, matrix), media_type=COMPACT_MEDIA_TYPE)
+    return content
+
+
+def _compact(content: dict, matrix: PriceMatrix) -> dict:
+    return {**content, "flights": matrix.to_compact()}
+
+
+class CompressionMiddleware:
+    """
+    Compresses the responses with brotli (when installed) or gzip, as accepted by
+    the client. Only responses sent in a single body of at least minimum_size
+    bytes are compressed, so streamed responses keep flowing line by line.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        self._app = app
+        self._minimum_size = minimum_size
+        self._gzip_level = gzip_level
+        self._brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        if brotli is not None and "br" in accept_encoding:
+            encoding = "br"
+        elif "gzip" in accept_encoding:
+            encoding = "gzip"
+        else:
+            await self._app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self._minimum_size
+                or "content-encoding" in headers
+                or headers.get("content-type", "").startswith(_UNCOMPRESSED_MEDIA_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+
+            body = self._compress(body, encoding)
+            headers["content-encoding"] = encoding
+            headers["content-length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({**message, "body": body})
+
+        await self._app(scope, receive, send_compressed)
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self._brotli_quality)
+        return gzip.compress(body, compresslevel=self._gzip_level)
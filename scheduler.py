@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable
+
+from settings import (
+    SCHEDULER_MAX_CONCURRENT_REQUESTS,
+    SEARCH_MAX_CONCURRENT,
+    SEARCH_MAX_WAITING,
+    SEARCH_QUEUE_TIMEOUT,
+)
+
+
+class RequestScheduler:
+    """
+    Bounds how many upstream requests run at the same time, shared by every search
+    of the process (single searches, batches and streams), so a batch of many
+    routes is spread over the same slots instead of opening them all at once.
+    """
+
+    def __init__(self, max_concurrent: int = SCHEDULER_MAX_CONCURRENT_REQUESTS):
+        self._max_concurrent = max_concurrent
+        self._semaphore = None
+        self._loop = None
+        self._running = 0
+        self._waiting = 0
+        self._completed = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {max_concurrent:int, running:int, waiting:int, completed:int}
+        """
+        return {
+            "max_concurrent": self._max_concurrent,
+            "running": self._running,
+            "waiting": self._waiting,
+            "completed": self._completed,
+        }
+
+    async def run(self, function: Callable[..., Awaitable], *args):
+        """
+        Runs function(*args) as soon as there is a free slot
+        """
+        semaphore = self._get_semaphore()
+        self._waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting -= 1
+        self._running += 1
+        try:
+            return await function(*args)
+        finally:
+            self._running -= 1
+            self._completed += 1
+            semaphore.release()
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # A semaphore belongs to an event loop, so each loop gets its own
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent)
+            self._loop = loop
+        return self._semaphore
+
+
+class SearchLimiter:
+    """
+    Bounds how many searches a worker takes at the same time, a batch or metro
+    search taking one slot per route. Up to max_waiting more wait at most
+    queue_timeout seconds for their slots, first come first served, and the others
+    are turned away at once, so a saturated worker answers quickly instead of
+    piling up searches that would miss their deadline anyway.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = SEARCH_MAX_CONCURRENT,
+        max_waiting: int = SEARCH_MAX_WAITING,
+        queue_timeout: float = SEARCH_QUEUE_TIMEOUT,
+    ):
+        self._max_concurrent = max_concurrent
+        self._max_waiting = max_waiting
+        self._queue_timeout = queue_timeout
+        self._waiters = deque()
+        self._loop = None
+        self._running = 0
+        self._rejected = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        :return: Dict: {max_concurrent:int, running:int, waiting:int, rejected:int},
+        running being the slots taken
+        """
+        return {
+            "max_concurrent": self._max_concurrent,
+            "running": self._running,
+            "waiting": len(self._waiters),
+            "rejected": self._rejected,
+        }
+
+    async def acquire(self, slots: int = 1) -> bool:
+        """
+        Takes slots, waiting for them up to queue_timeout seconds
+        :param slots: Searches run by the caller, at most max_concurrent are taken
+        :return: False if max_waiting searches were already waiting or the slots
+        were not freed in time
+        """
+        slots = self._slots(slots)
+        self._check_loop()
+        if not self._waiters and self._running + slots <= self._max_concurrent:
+            self._running += slots
+            return True
+        if len(self._waiters) >= self._max_waiting:
+            self._rejected += 1
+            return False
+
+        waiter = (slots, asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], self._queue_timeout)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter[1].done() and not waiter[1].cancelled():
+                # The slots were handed over as the caller was cancelled
+                self.release(slots)
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return True
+
+    def release(self, slots: int = 1) -> None:
+        self._running -= self._slots(slots)
+        # Hands the freed slots over in order, so a large batch is not starved
+        while self._waiters:
+            slots, future = self._waiters[0]
+            if future.done():
+                # Timed out or cancelled, about to leave the queue
+                self._waiters.popleft()
+                continue
+            if self._running + slots > self._max_concurrent:
+                break
+            self._waiters.popleft()
+            self._running += slots
+            future.set_result(None)
+
+    def _slots(self, slots: int) -> int:
+        return min(slots, self._max_concurrent)
+
+    def _check_loop(self) -> None:
+        # The waiting futures belong to an event loop, so each loop starts afresh
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._waiters = deque()
+            self._loop = loop
+
+
+_SCHEDULER = None
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    :return: The process wide RequestScheduler
+    """
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = RequestScheduler()
+    return _SCHEDULER
+
+
+_SEARCH_LIMITER = None
+
+
+def get_search_limiter() -> SearchLimiter:
+    """
+    :return: The process wide SearchLimiter
+    """
+    global _SEARCH_LIMITER
+    if _SEARCH_LIMITER is None:
+        _SEARCH_LIMITER = SearchLimiter()
+    return _SEARCH_LIMITER
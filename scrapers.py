@@ -1,62 +1,175 @@
 from __future__ import annotations
 
-import itertools
+import asyncio
 import json
 import logging
 import time
 from abc import ABC, abstractmethod
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import partial
 from logging.config import dictConfig
-from multiprocessing import Pool
+from typing import AsyncIterator, List, Optional, TypedDict
 
 from pydantic import ValidationError
 
 from validators import FlightData
 
-import requests
-
-from settings import LogConfig
+import httpx
+
+from alerts import AlertEngine, get_alert_engine
+from cache import ResultCache, get_cache
+from capture import CaptureWriter, get_capture_writer
+from coalescing import SingleFlight
+from hedging import get_latency_tracker, hedged
+from history import PriceHistory, get_price_history
+from http_client import HttpSession, get_session
+from matrix import PriceMatrix
+from metrics import (
+    MERGE_SECONDS,
+    PARSE_SECONDS,
+    UPSTREAM_ERRORS,
+    UPSTREAM_REQUEST_SECONDS,
+    UPSTREAM_RETRIES,
+)
+from planner import plan_cost, plan_windows
+from ratelimit import (
+    CircuitBreaker,
+    TokenBucket,
+    backoff_delay,
+    get_circuit_breaker,
+    get_rate_limiter,
+    parse_retry_after,
+)
+from scheduler import RequestScheduler, get_scheduler
+from settings import (
+    HEDGE_DEFAULT_DELAY,
+    HEDGE_QUANTILE,
+    LATAM_BESTPRICES_URL,
+    RETRY_BACKOFF_MAX,
+    SEARCH_DEADLINE,
+    STUB_BESTPRICES_URL,
+    LogConfig,
+)
+from tracing import span
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 dictConfig(LogConfig().dict())
 LOGGER = logging.getLogger("app.scraper")
 
+# Status codes worth retrying, the others are not going to change
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Identical window requests running at the same time share one upstream call
+WINDOW_REQUESTS = SingleFlight()
+
 
 class TicketFinder(ABC):
     """
     Interface for ticket finder
-    Must always define url when creating a subclass
+    Must always define url when creating a subclass, and airline, the name of the
+    provider in SEARCH_PROVIDERS, the cache keys and the price history
     """
 
-    _number_of_total_searches = 3
+    airline = ""
 
     @abstractmethod
-    def __init__(self, flight: FlightData):
+    def __init__(
+        self,
+        flight: FlightData,
+        session: HttpSession | None = None,
+        cache: ResultCache | None = None,
+        scheduler: RequestScheduler | None = None,
+        rate_limiter: TokenBucket | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        deadline: float = SEARCH_DEADLINE,
+        history: PriceHistory | None = None,
+        alerts: AlertEngine | None = None,
+        capture: CaptureWriter | None = None,
+    ):
+        self._session = session or get_session()
+        self._cache = cache if cache is not None else get_cache()
+        self._scheduler = scheduler or get_scheduler()
+        self._rate_limiter = rate_limiter or get_rate_limiter()
+        self._circuit_breaker = circuit_breaker or get_circuit_breaker()
+        self._latency = get_latency_tracker()
+        self._history = history if history is not None else get_price_history()
+        self._alerts = alerts or get_alert_engine()
+        self._capture = capture or get_capture_writer()
+        self._search_deadline = deadline
+        self._deadline = None
         self._origin = flight.origin
         self._destination = flight.destination
         self._departure_date = flight.departure_date
-        self._generate_travel_dates()
-        self._best_price = float("inf")
-        self._all_flights = {}
+        self._search_days = flight.days
+        self._all_flights = PriceMatrix(self._departure_date, self._search_days)
+        self._views = None
+
+    @property
+    def views(self) -> dict | None:
+        """
+        :return: Derived views of the prices (see PriceMatrix.views), computed once
+        the search is over, None before that
+        """
+        return self._views
+
+    @property
+    def matrix(self) -> PriceMatrix:
+        """
+        :return: The prices found so far, the same cells as the flights returned
+        """
+        return self._all_flights
+
+    @property
+    def airlines(self) -> dict | None:
+        """
+        :return: Provider of each cell when the prices come from more than one (see
+        providers.MultiProviderFinder), None as they are all from this airline
+        """
+        return None
 
     @abstractmethod
-    def _generate_travel_dates(self) -> None:
+    async def _generate_travel_dates(self) -> None:
         """
-        Generates all possible travel dates for the search.
+        Generates all possible travel dates for the search, when it starts.
         """
         raise NotImplementedError
 
     @abstractmethod
-    def get_all_flights(self) -> dict:
+    async def get_all_flights(self) -> tuple(float, dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_flights(self) -> AsyncIterator[dict]:
         raise NotImplementedError
 
     @abstractmethod
-    def _get_one_flight(self, departure_date, return_date) -> dict:
+    async def _get_one_flight(self, departure_date, return_date) -> dict:
         raise NotImplementedError
 
-    def _request_url(self, url) -> dict | None:
+    def _start_deadline(self) -> None:
+        """
+        Starts counting the deadline of the search, shared by all its requests
+        """
+        self._deadline = asyncio.get_running_loop().time() + self._search_deadline
+
+    def _remaining(self) -> float | None:
+        """
+        :return: Seconds left until the deadline of the search, None if it was not started
+        """
+        if self._deadline is None:
+            return None
+        return self._deadline - asyncio.get_running_loop().time()
+
+    async def _request_url(self, url) -> dict | None:
         """
-        Requests url (json content) and returns the response in json format
+        Requests url (json content) and returns the response in json format.
+        A request slower than usual is hedged with a second one, and no request
+        or retry goes past the deadline of the search.
         :return: Dict with json response or None
         """
         number_of_attemps = 4
@@ -66,109 +179,343 @@ class TicketFinder(ABC):
             "Accept-Encoding": "application/json",
         }
         for attempts in range(number_of_attemps):
+            if not self._circuit_breaker.allow():
+                LOGGER.warning(f"Upstream circuit is open, not requesting {url}")
+                break
+            with span("rate_limit_wait"):
+                await self._rate_limiter.acquire()
+            delay = backoff_delay(attempts)
             try:
                 LOGGER.debug(f"Requesting {url} for the {attempts} time.")
-                response = requests.get(url, headers=headers, timeout=15)
+                # Includes the wait for a scheduler slot and the hedged request.
+                # Only the request is hedged, once the slot is held, so the
+                # time queued for the slot does not count against the delay.
+                with span("attempt", number=attempts) as attempt:
+                    response = await asyncio.wait_for(
+                        self._scheduler.run(
+                            partial(
+                                hedged,
+                                self._timed_get,
+                                delay=self._hedge_delay(),
+                                should_hedge=self._rate_limiter.try_acquire,
+                            ),
+                            url,
+                            headers,
+                        ),
+                        timeout=self._remaining(),
+                    )
+                    attempt["status_code"] = response.status_code
                 response.raise_for_status()
 
+                self._circuit_breaker.record_success()
                 return self._convert_request_response_to_dict(response)
 
-            except (
-                requests.exceptions.Timeout,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.HTTPError,
-            ) as error:
-                code = None
-                if type(error) == requests.exceptions.HTTPError:
-                    code = response.status_code
-                    LOGGER.error(f"Http error code: {code}")
-
-                LOGGER.warning(
-                    f"Could not get the url. Trying it again in {str(attempts * 2)} "
-                    f"seconds"
-                )
+            except asyncio.TimeoutError:
+                LOGGER.warning(f"Search deadline reached, canceling requesting {url}")
+                break
+
+            except httpx.TimeoutException:
+                UPSTREAM_ERRORS.inc(code="timeout")
+                self._circuit_breaker.record_failure()
+
+            except httpx.NetworkError:
+                UPSTREAM_ERRORS.inc(code="network")
+                self._circuit_breaker.record_failure()
+
+            except httpx.HTTPStatusError:
+                code = response.status_code
+                LOGGER.error(f"Http error code: {code}")
+                UPSTREAM_ERRORS.inc(code=str(code))
+                if code not in RETRY_STATUS_CODES:
+                    # Upstream answered, the request itself is wrong
+                    self._circuit_breaker.record_success()
+                    break
+                if code != 429:
+                    self._circuit_breaker.record_failure()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None:
+                    # Every worker waits, not only this request
+                    self._rate_limiter.pause(retry_after)
+                    if retry_after > RETRY_BACKOFF_MAX:
+                        break
+                    delay = max(delay, retry_after)
 
             except Exception as error:
                 LOGGER.error(f"Error: {error}")
                 LOGGER.error(f"Canceling requesting {url}")
                 break
-            time.sleep(attempts * 2)
+
+            remaining = self._remaining()
+            if (
+                attempts == number_of_attemps - 1
+                or self._circuit_breaker.state == CircuitBreaker.OPEN
+                or (remaining is not None and remaining <= delay)
+            ):
+                break
+            LOGGER.warning(
+                f"Could not get the url. Trying it again in {delay:.2f} seconds"
+            )
+            UPSTREAM_RETRIES.inc()
+            with span("backoff", seconds=round(delay, 3)):
+                await asyncio.sleep(delay)
 
         return None
 
+    async def _timed_get(self, url: str, headers: dict) -> httpx.Response:
+        """
+        Requests url, timing it, and appends the response to the capture archive
+        when CAPTURE_PATH is set
+        """
+        started_at = time.monotonic()
+        with span("http_get"):
+            response = await self._session.get(url, headers)
+        elapsed = time.monotonic() - started_at
+        self._latency.record(elapsed)
+        UPSTREAM_REQUEST_SECONDS.observe(elapsed)
+        if self._capture is not None:
+            self._capture.record(url, response, time.time() - elapsed, elapsed)
+        return response
+
+    def _hedge_delay(self) -> float:
+        """
+        :return: Seconds to wait for a request before hedging it
+        """
+        delay = self._latency.quantile(HEDGE_QUANTILE)
+        return HEDGE_DEFAULT_DELAY if delay is None else delay
+
     @staticmethod
-    def _convert_request_response_to_dict(response: requests.Response) -> dict:
+    def _convert_request_response_to_dict(response: httpx.Response) -> dict:
+        """
+        Parses the raw bytes of the response, with orjson when it is installed, so the
+        body is not decoded to str before parsing.
+        """
         if "application/json" in response.headers["content-type"]:
-            return json.loads(response.text)
+            with span("json_decode"):
+                if orjson is not None:
+                    return orjson.loads(response.content)
+                return json.loads(response.content)
         else:
-            raise requests.exceptions.InvalidJSONError(
-                "The url must return a json response."
-            )
+            raise httpx.DecodingError("The url must return a json response.")
+
+
+class LatamPrice(TypedDict):
+    amount: float
+    currency: str
+
+
+class LatamReturnDate(TypedDict):
+    date: str
+    price: LatamPrice
+    available: bool
+
+
+class LatamBestPrice(TypedDict):
+    departureDate: str
+    returnDates: List[LatamReturnDate]
+
+
+class LatamBestPricesResponse(TypedDict):
+    """
+    Fields used from the latam bestprices response
+    """
+
+    bestPrices: List[LatamBestPrice]
+    cheapestPrice: Optional[float]
 
 
 class LatamFinder(TicketFinder):
-    def __init__(self, flight: FlightData):
-        super().__init__(flight)
+    airline = "latam"
+
+    def __init__(
+        self,
+        flight: FlightData,
+        session: HttpSession | None = None,
+        cache: ResultCache | None = None,
+        scheduler: RequestScheduler | None = None,
+        rate_limiter: TokenBucket | None = None,
+        circuit_breaker: CircuitBreaker | None = None,
+        deadline: float = SEARCH_DEADLINE,
+        history: PriceHistory | None = None,
+        alerts: AlertEngine | None = None,
+        capture: CaptureWriter | None = None,
+    ):
+        super().__init__(
+            flight,
+            session,
+            cache,
+            scheduler,
+            rate_limiter,
+            circuit_breaker,
+            deadline,
+            history,
+            alerts,
+            capture,
+        )
 
-    def _generate_travel_dates(self) -> None:
+    async def _generate_travel_dates(self) -> None:
         """
         Generates all possible travel dates for the search.
-        Latam: We search using multiple of 7 due to original response format
-        total travel dates = 2 * number_of_total_searches
+        Latam: Each request returns 7 departure x 7 return days, so the requests are
+        planned to cover the searched days, skipping the days already returned by
+        requests in the cache.
         """
-        all_dates = [
-            self._departure_date + timedelta(days=7 * x)
-            for x in range(0, self._number_of_total_searches)
-        ]
-        trips_combinations = tuple(
-            i for i in itertools.combinations_with_replacement(all_dates, 2)
+        self._cached_flights = await self._find_cached_flights(self._search_days)
+        covered_dates = {
+            (date.fromisoformat(departure_date), date.fromisoformat(return_date))
+            for flight in self._cached_flights
+            for departure_date, return_dates in flight["flights"].items()
+            for return_date in return_dates
+        }
+        self._all_travel_dates = tuple(
+            plan_windows(self._departure_date, self._search_days, covered_dates)
+        )
+        LOGGER.debug(
+            f"Search plan: {plan_cost(self._search_days, self._all_travel_dates)}"
         )
-        self._all_travel_dates = trips_combinations
 
-    def get_all_flights(self) -> tuple(float, dict):
+    async def _find_cached_flights(self, search_days: int) -> list[dict]:
+        """
+        Returns the cached responses of this route trimmed to the searched days
+        :return: List of Dict: {best_price:float, flights: {departure_date: {arrival_date: price}}}
+        """
+        first_date = self._departure_date.strftime("%Y-%m-%d")
+        last_date = (self._departure_date + timedelta(days=search_days - 1)).strftime(
+            "%Y-%m-%d"
+        )
+        cached_flights = []
+        for cached_flight in await self._cache.afind(
+            (self.airline, self._origin, self._destination)
+        ):
+            flights = {
+                departure_date: {
+                    return_date: price
+                    for return_date, price in return_dates.items()
+                    if first_date <= return_date <= last_date
+                }
+                for departure_date, return_dates in cached_flight["flights"].items()
+                if first_date <= departure_date <= last_date
+            }
+            prices = [
+                price
+                for return_dates in flights.values()
+                for price in return_dates.values()
+                if price
+            ]
+            if prices:
+                cached_flights.append({"flights": flights, "best_price": min(prices)})
+        return cached_flights
+
+    async def get_all_flights(self) -> tuple(float, dict):
         """
         Retrieves all possible flights and prices concurrently and saves to instance
-        variable all_flights.
-        Saves in the instance the all_flights and best_price
+        variable all_flights (a PriceMatrix).
+        All the requests run on the same event loop, so no processes are spawned.
+        The windows not returned before the search deadline are left as unknown cells.
+        Saves in the instance the all_flights
         :return: Tuple (best_price, all_flights)
         """
 
-        with Pool(processes=16) as pool:
-            list_of_responses = pool.starmap(
-                self._get_one_flight, self._all_travel_dates
-            )
+        self._start_deadline()
+        await self._generate_travel_dates()
+        with span(
+            "get_all_flights",
+            windows=len(self._all_travel_dates),
+            cached_windows=len(self._cached_flights),
+        ) as search:
+            pending_flights = [
+                asyncio.ensure_future(self._get_one_flight(departure_date, return_date))
+                for departure_date, return_date in self._all_travel_dates
+            ]
+            missing = set()
+            if pending_flights:
+                _, missing = await asyncio.wait(
+                    pending_flights, timeout=self._remaining()
+                )
+                if missing:
+                    # Their cells stay unknown instead of failing the whole search
+                    LOGGER.warning(f"{len(missing)} windows missed the search deadline")
+                    search["missed_deadline"] = len(missing)
+                    for pending_flight in missing:
+                        pending_flight.cancel()
+
+            list_of_responses = self._cached_flights + [
+                pending_flight.result()
+                for pending_flight in pending_flights
+                if pending_flight not in missing
+            ]
+
+            started_at = time.perf_counter()
+            with span("merge", responses=len(list_of_responses)):
+                # At once, faster than one response at a time
+                self._all_flights.merge(
+                    *(
+                        response["flights"]
+                        for response in list_of_responses
+                        if response.get("best_price") is not None
+                    )
+                )
+                self._views = self._all_flights.views()
+            MERGE_SECONDS.observe(time.perf_counter() - started_at)
 
-        list_of_all_return_dates = set()
-        for response in list_of_responses:
-            if response.get("best_price") is not None:
-                if response["best_price"] < self._best_price:
-                    self._best_price = response["best_price"]
-
-                for departure_date in response["flights"].keys():
-                    list_of_all_return_dates.add(departure_date)
-                    if self._all_flights.get(departure_date):
-                        self._all_flights[departure_date].update(
-                            response["flights"][departure_date]
-                        )
-                    else:
-                        self._all_flights[departure_date] = {
-                            arrival_date: 0 for arrival_date in list_of_all_return_dates
-                        }
-                        self._all_flights[departure_date].update(
-                            response["flights"][departure_date]
-                        )
-
-        return_best_price = (
-            self._best_price if self._best_price != float("inf") else None
-        )
-        return return_best_price, self._all_flights
+        return self._all_flights.best_price(), self._all_flights.to_dict()
 
-    def _get_one_flight(
+    async def iter_flights(self) -> AsyncIterator[dict]:
+        """
+        Same search as get_all_flights, but yields each response merged as soon as its
+        request finishes, so the results can be streamed.
+        :return: Async iterator of Dict: {best_price:float, flights: {departure_date: {arrival_date: price}}}
+        The best_price is the best one found so far.
+        """
+        self._start_deadline()
+        await self._generate_travel_dates()
+        pending_flights = [
+            asyncio.ensure_future(self._get_one_flight(departure_date, return_date))
+            for departure_date, return_date in self._all_travel_dates
+        ]
+        try:
+            for response in self._cached_flights:
+                if self._merge_response(response):
+                    yield {
+                        "flights": response["flights"],
+                        "best_price": self._all_flights.best_price(),
+                    }
+            for next_flight in asyncio.as_completed(
+                pending_flights, timeout=self._remaining()
+            ):
+                response = await next_flight
+                if self._merge_response(response):
+                    yield {
+                        "flights": response["flights"],
+                        "best_price": self._all_flights.best_price(),
+                    }
+        except asyncio.TimeoutError:
+            LOGGER.warning("Search deadline reached, stopping the stream")
+        finally:
+            # The client may stop reading before the end of the search
+            for pending_flight in pending_flights:
+                pending_flight.cancel()
+        # Also after the deadline, from the windows returned in time
+        self._views = self._all_flights.views()
+
+    def _merge_response(self, response: dict) -> bool:
+        """
+        Merges a response from _get_one_flight into all_flights
+        :return: True if the response had flights
+        """
+        if response.get("best_price") is None:
+            return False
+
+        self._all_flights.merge(response["flights"])
+        return True
+
+    async def _get_one_flight(
         self, departure_date: datetime.date, return_date: datetime.date
     ) -> dict:
         """
         Returns a formated response from a single latam request
         ** This request returns multiple dates due to the api in latam.
+        Successful responses are kept in the cache, so repeated searches do not hit latam,
+        and identical requests running at the same time share the same latam call.
 
         :return: Dict: {best_price:float, flights: {departure_date: {arrival_date: price}}}
         """
@@ -176,10 +523,53 @@ class LatamFinder(TicketFinder):
         return_date_str = return_date.strftime("%Y-%m-%d")
 
         LOGGER.debug(f"{departure_date_str} -> {return_date_str}")
+        cache_key = (
+            self.airline,
+            self._origin,
+            self._destination,
+            departure_date_str,
+            return_date_str,
+        )
+        with span(
+            "_get_one_flight",
+            departure_date=departure_date_str,
+            return_date=return_date_str,
+        ) as window:
+            cached_flight = await self._cache.aget(cache_key)
+            window["cached"] = cached_flight is not None
+            if cached_flight is not None:
+                return cached_flight
+
+            return await WINDOW_REQUESTS.do(
+                cache_key,
+                self._request_one_flight,
+                cache_key,
+                departure_date_str,
+                return_date_str,
+            )
+
+    async def _request_one_flight(
+        self, cache_key: tuple, departure_date_str: str, return_date_str: str
+    ) -> dict:
         url = self._generate_complete_url(departure_date_str, return_date_str)
-        response = self._request_url(url)
+        with span("_request_url"):
+            response = await self._request_url(url)
         if response:
-            flight = self._reformat_latam_response(response)
+            started_at = time.perf_counter()
+            with span("_reformat_latam_response"):
+                flight = self._reformat_latam_response(response)
+            PARSE_SECONDS.observe(time.perf_counter() - started_at)
+            await self._cache.aset(cache_key, flight)
+            self._history.record_later(
+                self.airline, self._origin, self._destination, flight["flights"]
+            )
+            self._history.run_later(
+                self._alerts.evaluate,
+                self.airline,
+                self._origin,
+                self._destination,
+                flight["flights"],
+            )
             return flight
         else:
             return {}
@@ -188,34 +578,47 @@ class LatamFinder(TicketFinder):
         self, departure_date_str: str, return_date_str: str
     ) -> str:
         return (
-            f"http://bff.latam.com/ws/proxy/booking-webapp-bff/v1/public/revenue"
-            f"/bestprices/roundtrip?departure={departure_date_str}&origin={self._origin}"
+            f"{self._bestprices_url()}?departure={departure_date_str}&origin={self._origin}"
             f"&destination={self._destination}&cabin=Y&country=BR&language=PT&home=pt_br"
             f"&return={return_date_str}&adult=1&promoCode="
         )
 
+    def _bestprices_url(self) -> str:
+        return LATAM_BESTPRICES_URL
+
     @staticmethod
-    def _reformat_latam_response(api_response: dict) -> dict:
+    def _reformat_latam_response(api_response: LatamBestPricesResponse) -> dict:
         """
         Reformats latam response using departure date as key and a dict for return date with the
-        date as key as well.
+        date as key as well. The output is built in a single pass.
 
         :return: Dict: {best_price:float, flights: {departure_date: {arrival_date: price}}}
         """
-        response = {"flights": {}}
-        for dt_departure in api_response["bestPrices"]:
-            response["flights"][dt_departure["departureDate"]] = {}
-            for dt_return in dt_departure["returnDates"]:
-                if dt_return["available"]:
-                    response["flights"][dt_departure["departureDate"]].update(
-                        {dt_return["date"]: dt_return["price"]["amount"]}
-                    )
-                else:
-                    response["flights"][dt_departure["departureDate"]].update(
-                        {dt_return["date"]: 0}
+        return {
+            "flights": {
+                dt_departure["departureDate"]: {
+                    dt_return["date"]: (
+                        dt_return["price"]["amount"] if dt_return["available"] else 0
                     )
-        response["best_price"] = api_response.get("cheapestPrice")
-        return response
+                    for dt_return in dt_departure["returnDates"]
+                }
+                for dt_departure in api_response["bestPrices"]
+            },
+            "best_price": api_response.get("cheapestPrice"),
+        }
+
+
+class StubFinder(LatamFinder):
+    """
+    Second airline answering in the LATAM bestprices format from a local stub
+    (benchmarks/mock_latam.py), to run and measure the searches of more than one
+    provider without a second real upstream
+    """
+
+    airline = "stub"
+
+    def _bestprices_url(self) -> str:
+        return STUB_BESTPRICES_URL
 
 
 if __name__ == "__main__":
@@ -224,7 +627,7 @@ if __name__ == "__main__":
             departure_date="2022-12-01", origin="CGH", destination="VIX"
         )
         latam = LatamFinder(my_flight)
-        best_price, all_flights = latam.get_all_flights()
+        best_price, all_flights = asyncio.run(latam.get_all_flights())
         print(all_flights)
     except ValidationError as e:
         print(e.json())
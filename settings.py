@@ -1,8 +1,154 @@
+import math
+import os
+
 from pydantic import BaseModel
 
 
 ORIGINS = ["*"]
 
+LATAM_BESTPRICES_URL = os.environ.get(
+    "LATAM_BESTPRICES_URL",
+    "http://bff.latam.com/ws/proxy/booking-webapp-bff/v1/public/revenue"
+    "/bestprices/roundtrip",
+)
+
+# Airlines searched at the same time for each flight, comma separated names of
+# providers.PROVIDERS. "stub" answers from STUB_BESTPRICES_URL, e.g. the mock server
+# of the benchmarks (python -m benchmarks.mock_latam --port 8002)
+SEARCH_PROVIDERS = os.environ.get("SEARCH_PROVIDERS", "latam")
+STUB_BESTPRICES_URL = os.environ.get(
+    "STUB_BESTPRICES_URL", "http://127.0.0.1:8002/bestprices/roundtrip"
+)
+
+# Seconds the browsers may keep the airport list without revalidating it
+AIRPORTS_MAX_AGE = int(os.environ.get("AIRPORTS_MAX_AGE", 3600))
+
+# Number of days searched from the departure date
+SEARCH_DEFAULT_DAYS = int(os.environ.get("SEARCH_DEFAULT_DAYS", 21))
+SEARCH_MAX_DAYS = int(os.environ.get("SEARCH_MAX_DAYS", 90))
+
+# Seconds a search may take. Windows not returned by then are left as unknown cells
+SEARCH_DEADLINE = float(os.environ.get("SEARCH_DEADLINE", 20))
+
+# A request slower than the HEDGE_QUANTILE of the last HEDGE_SAMPLE_SIZE requests is
+# sent again, keeping the first answer. HEDGE_DEFAULT_DELAY is used until there
+# are HEDGE_MIN_SAMPLES requests
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", 0.95))
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", 2))
+HEDGE_SAMPLE_SIZE = int(os.environ.get("HEDGE_SAMPLE_SIZE", 500))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+
+# Routes kept warm in the background, comma separated ORIGIN-DESTINATION[:days[:offset]]
+# (e.g. "CGH-VIX:30,GRU-GIG"), searched from offset days after today.
+# Each one is refreshed every REFRESH_INTERVAL seconds, at most REFRESH_MAX_CONCURRENT
+# at a time, and its prices are served while younger than REFRESH_MAX_AGE seconds
+WATCHED_ROUTES = os.environ.get("WATCHED_ROUTES", "")
+REFRESH_INTERVAL = float(os.environ.get("REFRESH_INTERVAL", 300))
+REFRESH_MAX_AGE = float(os.environ.get("REFRESH_MAX_AGE", 900))
+REFRESH_MAX_CONCURRENT = int(os.environ.get("REFRESH_MAX_CONCURRENT", 2))
+REFRESH_TICK = float(os.environ.get("REFRESH_TICK", 10))
+# With CACHE_BACKEND=sqlite, only the worker holding the lock of this file refreshes,
+# writing the windows to the cache shared by all of them. With the memory backend, or
+# an empty REFRESH_LOCK_PATH, every worker refreshes
+REFRESH_LOCK_PATH = os.environ.get("REFRESH_LOCK_PATH", "/tmp/latam_refresher.lock")
+
+# Number of cheapest cells in the derived views of a search
+VIEWS_TOP_K = int(os.environ.get("VIEWS_TOP_K", 10))
+
+# Seconds between the stack samples of a search profiled with ?profile=1, 0 disables it.
+# Disabled by default: the sampling thread and the search it runs on its own are paid
+# by the whole worker, so it is only for deployments whose api is not public
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0))
+# 1 enables ?trace=1 and the X-Trace: 1 header. Disabled by default for the same
+# reason: a traced search skips the refresher and the identical searches in flight
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "0") == "1"
+
+# Responses smaller than this (in bytes) are not gzip/brotli compressed
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 500))
+
+# Maximum number of routes in a batch search
+BATCH_MAX_ROUTES = int(os.environ.get("BATCH_MAX_ROUTES", 50))
+
+# Upstream requests running at the same time, shared by every search of the process
+SCHEDULER_MAX_CONCURRENT_REQUESTS = int(
+    os.environ.get("SCHEDULER_MAX_CONCURRENT_REQUESTS", 32)
+)
+
+# Upstream requests per second shared by every worker of the host through the state
+# file (empty RATE_LIMIT_STATE_PATH limits each process on its own)
+RATE_LIMIT_PER_SECOND = float(os.environ.get("RATE_LIMIT_PER_SECOND", 20))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 40))
+RATE_LIMIT_STATE_PATH = os.environ.get(
+    "RATE_LIMIT_STATE_PATH", "/tmp/latam_rate_limit.state"
+)
+
+# Searches (routes, for batch and metro searches) a worker runs at the same time.
+# Up to SEARCH_MAX_WAITING more wait at most SEARCH_QUEUE_TIMEOUT seconds for a slot,
+# the others get a 503 with a Retry-After of SEARCH_RETRY_AFTER seconds.
+# By default, as many cold searches of SEARCH_DEFAULT_DAYS as the rate limit lets
+# finish within SEARCH_DEADLINE, and as many more as it lets finish while waiting.
+# A LATAM request returns 7 x 7 days, and only return dates after the departure
+# dates are requested.
+SEARCH_QUEUE_TIMEOUT = float(os.environ.get("SEARCH_QUEUE_TIMEOUT", 2))
+SEARCH_RETRY_AFTER = int(os.environ.get("SEARCH_RETRY_AFTER", 5))
+_WINDOWS_PER_SEARCH = math.ceil(SEARCH_DEFAULT_DAYS / 7)
+_REQUESTS_PER_SEARCH = _WINDOWS_PER_SEARCH * (_WINDOWS_PER_SEARCH + 1) // 2
+SEARCH_MAX_CONCURRENT = int(
+    os.environ.get(
+        "SEARCH_MAX_CONCURRENT",
+        max(1, RATE_LIMIT_PER_SECOND * SEARCH_DEADLINE // _REQUESTS_PER_SEARCH),
+    )
+)
+SEARCH_MAX_WAITING = int(
+    os.environ.get(
+        "SEARCH_MAX_WAITING",
+        max(1, RATE_LIMIT_PER_SECOND * SEARCH_QUEUE_TIMEOUT // _REQUESTS_PER_SEARCH),
+    )
+)
+
+# Retries of a failed upstream request wait a random time up to
+# min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt) seconds
+RETRY_BACKOFF_BASE = float(os.environ.get("RETRY_BACKOFF_BASE", 0.5))
+RETRY_BACKOFF_MAX = float(os.environ.get("RETRY_BACKOFF_MAX", 8))
+
+# Failures in a row that stop the upstream requests for CIRCUIT_BREAKER_RESET_TIMEOUT seconds
+CIRCUIT_BREAKER_FAILURES = int(os.environ.get("CIRCUIT_BREAKER_FAILURES", 5))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get("CIRCUIT_BREAKER_RESET_TIMEOUT", 30)
+)
+
+# Shared http session used to request the airlines
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", 20))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 15))
+
+# Cache of the airline responses. CACHE_BACKEND: memory | sqlite
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory")
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 600))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 5000))
+CACHE_SQLITE_PATH = os.environ.get("CACHE_SQLITE_PATH", "/tmp/latam_cache.sqlite3")
+# Seconds between the evictions of the expired and exceeding sqlite cache entries
+CACHE_EVICT_INTERVAL = float(os.environ.get("CACHE_EVICT_INTERVAL", 30))
+
+# Append only store of every price returned by the airlines
+HISTORY_SQLITE_PATH = os.environ.get(
+    "HISTORY_SQLITE_PATH", "/tmp/latam_history.sqlite3"
+)
+
+# Archive where every LATAM response is appended, to replay it later (see capture.py).
+# Empty disables the capture
+CAPTURE_PATH = os.environ.get("CAPTURE_PATH", "")
+
+# Where the price drop alerts are delivered: log | file | memory
+ALERTS_SINK = os.environ.get("ALERTS_SINK", "log")
+ALERTS_FILE_PATH = os.environ.get("ALERTS_FILE_PATH", "/tmp/latam_alerts.jsonl")
+# Last prices kept per route with alert rules and airline, to notify only the prices
+# that dropped. A forgotten cell is checked again as if it was never seen
+ALERTS_MAX_CELLS_PER_ROUTE = int(os.environ.get("ALERTS_MAX_CELLS_PER_ROUTE", 20000))
+
 
 class LogConfig(BaseModel):
     """Logging configuration to be set for the server"""
@@ -0,0 +1,10 @@
+import os
+import tempfile
+
+# The tests keep their price history, rate limit, refresher lock and sqlite cache in
+# files of their own, removed at the end of the run
+TMP_DIR = tempfile.TemporaryDirectory(prefix="latam-tests-")
+os.environ["HISTORY_SQLITE_PATH"] = os.path.join(TMP_DIR.name, "history.sqlite3")
+os.environ["RATE_LIMIT_STATE_PATH"] = os.path.join(TMP_DIR.name, "rate_limit.state")
+os.environ["REFRESH_LOCK_PATH"] = os.path.join(TMP_DIR.name, "refresher.lock")
+os.environ["CACHE_SQLITE_PATH"] = os.path.join(TMP_DIR.name, "cache.sqlite3")
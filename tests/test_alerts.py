@@ -0,0 +1,150 @@
+import json
+import tempfile
+import unittest
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import TestCase
+
+from alerts import AlertEngine, FileSink, MemorySink
+from validators import AlertRule
+
+
+def day(offset: int) -> str:
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+
+def rule(threshold, departure=(1, 10), returns=None, destination="VIX") -> AlertRule:
+    return AlertRule(
+        origin="CGH",
+        destination=destination,
+        departure_from=day(departure[0]),
+        departure_to=day(departure[1]),
+        return_from=day(returns[0]) if returns else None,
+        return_to=day(returns[1]) if returns else None,
+        threshold=threshold,
+    )
+
+
+class TestAlertEngine(TestCase):
+    def setUp(self) -> None:
+        self.sink = MemorySink()
+        self.engine = AlertEngine(self.sink, path=":memory:")
+
+    def test_price_drop_below_threshold(self):
+        rule_id, alerts = self.engine.add(rule(500))
+        self.assertEqual([], alerts)
+        self.engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 600}})
+        self.assertEqual([], list(self.sink.alerts))
+        alerts = self.engine.evaluate(
+            "latam", "CGH", "VIX", {day(2): {day(5): 450, day(6): 0}}
+        )
+        self.assertEqual(1, len(alerts))
+        self.assertEqual(rule_id, alerts[0]["rule_id"])
+        self.assertEqual(450, alerts[0]["price"])
+        self.assertEqual(600, alerts[0]["previous_price"])
+        self.assertEqual(alerts, list(self.sink.alerts))
+
+    def test_last_prices_of_each_airline(self):
+        self.engine.add(rule(500))
+        alerts = [
+            len(self.engine.evaluate(airline, "CGH", "VIX", {day(2): {day(5): price}}))
+            for airline, price in (("latam", 450), ("stub", 400), ("latam", 450))
+        ]
+        self.assertEqual([1, 1, 0], alerts)
+        self.assertEqual("stub", self.sink.alerts[1]["airline"])
+        _, alerts = self.engine.add(rule(600))
+        self.assertEqual({"latam", "stub"}, {alert["airline"] for alert in alerts})
+
+    def test_not_notified_again_until_price_goes_back_up(self):
+        self.engine.add(rule(500))
+        prices = [450, 400, 550, 420]
+        alerts = [
+            len(self.engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): price}}))
+            for price in prices
+        ]
+        self.assertEqual([1, 0, 0, 1], alerts)
+
+    def test_only_rules_of_the_route_and_dates(self):
+        self.engine.add(rule(500, departure=(1, 3), returns=(4, 5)))
+        self.engine.add(rule(500, destination="GIG"))
+        alerts = self.engine.evaluate(
+            "latam",
+            "CGH",
+            "VIX",
+            {day(2): {day(5): 100, day(7): 100}, day(4): {day(5): 100}},
+        )
+        self.assertEqual(
+            [(day(2), day(5))],
+            [(alert["departure_date"], alert["return_date"]) for alert in alerts],
+        )
+        self.assertEqual(
+            [], self.engine.evaluate("latam", "GRU", "VIX", {day(2): {day(5): 100}})
+        )
+
+    def test_only_crossed_rules_are_checked(self):
+        for threshold in range(100, 1100, 100):
+            self.engine.add(rule(threshold))
+        self.engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 650}})
+        checked = self.engine.stats["checked_rules"]
+        self.engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 450}})
+        self.assertEqual(2, self.engine.stats["checked_rules"] - checked)
+
+    def test_new_rule_checks_known_prices(self):
+        self.engine.add(rule(300))
+        self.engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 450}})
+        _, alerts = self.engine.add(rule(500))
+        self.assertEqual(1, len(alerts))
+        self.assertIsNone(alerts[0]["previous_price"])
+
+    def test_remove(self):
+        rule_id, _ = self.engine.add(rule(500))
+        self.assertTrue(self.engine.remove(rule_id))
+        self.assertFalse(self.engine.remove(rule_id))
+        self.assertIsNone(self.engine.get(rule_id))
+        self.assertEqual(
+            [], self.engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 100}})
+        )
+
+    def test_least_recently_seen_prices_are_forgotten(self):
+        engine = AlertEngine(self.sink, path=":memory:", max_cells_per_route=2)
+        engine.add(rule(500))
+        engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 450, day(6): 450}})
+        engine.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 450, day(7): 450}})
+        # Seen again as a new price
+        alerts = engine.evaluate("latam", "CGH", "VIX", {day(2): {day(6): 450}})
+        self.assertEqual(1, len(alerts))
+        self.assertIsNone(alerts[0]["previous_price"])
+
+
+class TestSharedAlertEngine(TestCase):
+    def test_rules_shared_between_workers(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(Path(tmp_dir) / "alerts.sqlite3")
+            first, second = AlertEngine(MemorySink(), path), AlertEngine(
+                MemorySink(), path
+            )
+            rule_id, _ = first.add(rule(500))
+            self.assertEqual(500, second.get(rule_id).threshold)
+            self.assertEqual(
+                1, len(second.evaluate("latam", "CGH", "VIX", {day(2): {day(5): 450}}))
+            )
+            self.assertTrue(second.remove(rule_id))
+            self.assertIsNone(first.get(rule_id))
+            self.assertFalse(first.remove(rule_id))
+            self.assertEqual(0, first.stats["rules"])
+
+
+class TestFileSink(TestCase):
+    def test_appends_json_lines(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "alerts.jsonl"
+            FileSink(str(path)).deliver([{"price": 1}, {"price": 2}])
+            FileSink(str(path)).deliver([{"price": 3}])
+            self.assertEqual(
+                [1, 2, 3],
+                [json.loads(line)["price"] for line in path.read_text().splitlines()],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
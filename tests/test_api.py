@@ -1,3 +1,6 @@
+import json
+import os
+import tempfile
 import unittest
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -6,8 +9,12 @@ from unittest import TestCase, mock
 from fastapi import status
 from fastapi.testclient import TestClient
 
-from airports import load_airports
+from airports import AirportRegistry, get_airport_registry, load_airports
+from alerts import AlertEngine, MemorySink
+from history import PriceHistory
 from main import app
+from matrix import PriceMatrix
+from responses import COMPACT_MEDIA_TYPE
 
 BASE_PATH = Path(__file__).resolve().parent
 
@@ -28,11 +35,93 @@ class TestAirports(TestCase):
         self.assertEqual(load_airports("nofile.json"), [])
 
     def test_404_airport_list_empty(self):
-        with mock.patch("main.load_airports") as mock_load_airports:
-            mock_load_airports.return_value = []
+        with mock.patch("main.get_airport_registry") as mock_registry:
+            mock_registry.return_value.__len__.return_value = 0
             response = self.client.get("/airports")
             self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
 
+    def test_airport_list_not_modified(self):
+        response = self.client.get("/airports")
+        self.assertIn("max-age", response.headers["cache-control"])
+        response = self.client.get(
+            "/airports", headers={"If-None-Match": response.headers["etag"]}
+        )
+        self.assertEqual(status.HTTP_304_NOT_MODIFIED, response.status_code)
+        self.assertEqual(b"", response.content)
+
+    def test_registry_reloads_changed_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = Path(tmp_dir) / "airports.json"
+            airport = {
+                "iata": "CGH",
+                "city": "São Paulo",
+                "name": "Congonhas",
+                "type": "AIRPORT",
+                "countryAlpha2": "BR",
+            }
+            filename.write_text(json.dumps([airport]))
+            registry = AirportRegistry(str(filename))
+            self.assertEqual("São Paulo | Congonhas", registry.get("CGH"))
+            etag = registry.etag
+
+            filename.write_text(json.dumps([airport, {**airport, "iata": "GRU"}]))
+            os.utime(filename, ns=(0, 0))
+            registry._checked_at = None
+            self.assertEqual(2, len(registry))
+            self.assertNotEqual(etag, registry.etag)
+
+    def test_registry_keeps_airports_when_the_file_can_not_be_loaded(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            filename = Path(tmp_dir) / "airports.json"
+            airport = {
+                "iata": "CGH",
+                "city": "São Paulo",
+                "name": "Congonhas",
+                "type": "AIRPORT",
+                "countryAlpha2": "BR",
+            }
+            filename.write_text(json.dumps([airport]))
+            registry = AirportRegistry(str(filename))
+
+            # Read in the middle of a write
+            filename.write_text(json.dumps([airport, airport])[:30])
+            os.utime(filename, ns=(0, 0))
+            registry._checked_at = None
+            with self.assertLogs("app.airports", level="ERROR"):
+                self.assertEqual("São Paulo | Congonhas", registry.get("CGH"))
+
+            # Tried again even if the modification time did not change
+            filename.write_text(json.dumps([airport, {**airport, "iata": "GRU"}]))
+            os.utime(filename, ns=(0, 0))
+            registry._checked_at = None
+            self.assertEqual(2, len(registry))
+
+    def test_registry_expands_metro_areas(self):
+        registry = get_airport_registry()
+        self.assertEqual(["CGH", "GRU"], registry.expand("SAO"))
+        self.assertEqual(["GIG"], registry.expand("GIG"))
+        self.assertEqual([], registry.expand("XYZ"))
+
+    def test_search_airports(self):
+        response = self.client.get("/airports/search", params={"q": "sao paulo"})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(
+            {"CGH", "GRU"}, {airport["iata"] for airport in response.json()}
+        )
+
+    def test_search_airports_exact_iata_first(self):
+        response = self.client.get("/airports/search", params={"q": "gru", "limit": 3})
+        self.assertEqual("GRU", response.json()[0]["iata"])
+        self.assertEqual("São Paulo | Guarulhos Intl.", response.json()[0]["label"])
+
+    def test_search_airports_with_typo(self):
+        response = self.client.get("/airports/search", params={"q": "sao palo"})
+        self.assertIn("CGH", [airport["iata"] for airport in response.json()])
+
+    def test_search_airports_empty_query_422(self):
+        response = self.client.get("/airports/search", params={"q": ""})
+        self.assertEqual(status.HTTP_422_UNPROCESSABLE_ENTITY, response.status_code)
+
 
 class TestFlights(TestCase):
     @classmethod
@@ -427,22 +516,200 @@ class TestFlights(TestCase):
         }
 
     def test_get_flights_200(self):
-        with mock.patch("main.LatamFinder.get_all_flights") as mock_latam:
+        with mock.patch("scrapers.LatamFinder.get_all_flights") as mock_latam:
             mock_best_price = 0
             mock_latam.return_value = mock_best_price, self.flights_response
             response = self.client.get(
                 f"/{self.departure_date}/{self.origin}/{self.destination}"
             )
             self.assertEqual(status.HTTP_200_OK, response.status_code)
-            self.assertEqual(
-                mock_best_price, response.json()["best_price"]
+            self.assertEqual(mock_best_price, response.json()["best_price"])
+            self.assertEqual(self.flights_response, response.json()["flights"])
+
+    def test_get_flights_of_every_provider(self):
+        flights = {"2022-10-12": {"2022-10-13": 100, "2022-10-14": 90}}
+        stub_flights = {"2022-10-12": {"2022-10-13": 95, "2022-10-14": 120}}
+        with mock.patch(
+            "providers.get_search_providers", return_value=("latam", "stub")
+        ), mock.patch(
+            "scrapers.LatamFinder.get_all_flights",
+            mock.AsyncMock(return_value=(90, flights)),
+        ), mock.patch(
+            "scrapers.StubFinder.get_all_flights",
+            mock.AsyncMock(return_value=(95, stub_flights)),
+        ):
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}?days=30"
             )
-            self.assertEqual(
-                self.flights_response, response.json()["flights"]
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(90, response.json()["best_price"])
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": 95, "2022-10-14": 90}},
+            response.json()["flights"],
+        )
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": "stub", "2022-10-14": "latam"}},
+            response.json()["airlines"],
+        )
+
+    def test_saturated_worker_503(self):
+        with mock.patch("main.get_search_limiter") as mock_limiter, mock.patch(
+            "main.create_finder"
+        ) as mock_latam:
+            mock_limiter.return_value.acquire = mock.AsyncMock(return_value=False)
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}"
             )
+        mock_latam.assert_not_called()
+        mock_limiter.return_value.release.assert_not_called()
+        self.assertEqual(status.HTTP_503_SERVICE_UNAVAILABLE, response.status_code)
+        self.assertEqual("5", response.headers["retry-after"])
+
+    def test_search_slot_released(self):
+        with mock.patch(
+            "scrapers.LatamFinder.get_all_flights",
+            mock.AsyncMock(return_value=(10, self.flights_response)),
+        ):
+            self.client.get(f"/{self.departure_date}/{self.origin}/{self.destination}")
+            self.client.get(f"/2000-01-01/{self.origin}/{self.destination}")
+        stats = self.client.get("/stats").json()["searches"]
+        self.assertEqual(0, stats["running"])
+        self.assertEqual(0, stats["waiting"])
+
+    def test_get_flights_compact(self):
+        flights = {"2022-10-12": {"2022-10-12": 100, "2022-10-14": 0}}
+        with mock.patch("main.get_refresher") as mock_refresher:
+            mock_refresher.return_value.lookup.return_value = (
+                100,
+                flights,
+                {},
+                None,
+                PriceMatrix.from_dict(flights),
+                0.0,
+            )
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}",
+                headers={"Accept": COMPACT_MEDIA_TYPE},
+            )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(COMPACT_MEDIA_TYPE, response.headers["content-type"])
+        self.assertEqual(
+            {
+                "first_date": "2022-10-12",
+                "departures": [0],
+                "returns": [0, 2],
+                "prices": [100, 0],
+            },
+            response.json()["flights"],
+        )
+        self.assertEqual(100, response.json()["best_price"])
+
+    def test_searched_flights_compact_from_the_finder_matrix(self):
+        matrix = PriceMatrix.from_dict({"2022-10-12": {"2022-10-13": 90}})
+        with mock.patch("main.create_finder") as mock_latam, mock.patch(
+            "responses.PriceMatrix.from_dict"
+        ) as mock_from_dict:
+            mock_latam.return_value.get_all_flights = mock.AsyncMock(
+                return_value=(90, matrix.to_dict())
+            )
+            mock_latam.return_value.views = {}
+            mock_latam.return_value.airlines = None
+            mock_latam.return_value.matrix = matrix
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}",
+                headers={"Accept": COMPACT_MEDIA_TYPE},
+            )
+        mock_from_dict.assert_not_called()
+        self.assertEqual(matrix.to_compact(), response.json()["flights"])
+
+    def test_get_flights_gzip(self):
+        flights = {
+            f"2022-10-{day}": {f"2022-11-{day}": 100 + day} for day in range(10, 30)
+        }
+        with mock.patch("main.get_refresher") as mock_refresher:
+            mock_refresher.return_value.lookup.return_value = (
+                110,
+                flights,
+                {},
+                None,
+                PriceMatrix.from_dict(flights),
+                0.0,
+            )
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}",
+                headers={"Accept-Encoding": "gzip"},
+            )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual("gzip", response.headers["content-encoding"])
+        self.assertIn("Accept-Encoding", response.headers["vary"])
+        self.assertEqual(flights, response.json()["flights"])
+
+    def test_traced_search(self):
+        with mock.patch("main.create_finder") as mock_latam, mock.patch(
+            "main.get_refresher"
+        ) as mock_refresher, mock.patch("main.TRACE_ENABLED", True):
+            mock_latam.return_value.get_all_flights = mock.AsyncMock(
+                return_value=(10, self.flights_response)
+            )
+            mock_latam.return_value.views = {}
+            mock_latam.return_value.airlines = None
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}",
+                headers={"X-Trace": "1"},
+            )
+        mock_refresher.return_value.lookup.assert_not_called()
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        trace = response.json()["trace"]
+        self.assertEqual("get_flights", trace["spans"][0]["name"])
+        self.assertEqual(1, trace["stages"]["get_flights"]["count"])
+
+    def test_trace_disabled_by_default_400(self):
+        with mock.patch("main.create_finder") as mock_latam:
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}",
+                headers={"X-Trace": "1"},
+            )
+        mock_latam.assert_not_called()
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_profiled_search(self):
+        with mock.patch("main.create_finder") as mock_latam, mock.patch(
+            "main.PROFILE_SAMPLE_INTERVAL", 0.005
+        ):
+            mock_latam.return_value.get_all_flights = mock.AsyncMock(
+                return_value=(10, self.flights_response)
+            )
+            mock_latam.return_value.views = {}
+            mock_latam.return_value.airlines = None
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}?profile=1"
+            )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+
+    def test_profile_disabled_by_default_400(self):
+        with mock.patch("main.create_finder") as mock_latam:
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}?profile=1"
+            )
+        mock_latam.assert_not_called()
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_metrics(self):
+        with mock.patch("scrapers.LatamFinder.get_all_flights") as mock_latam:
+            mock_latam.return_value = 10, self.flights_response
+            self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}?days=30"
+            )
+        response = self.client.get("/metrics")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn("# TYPE latam_search_seconds histogram", response.text)
+        self.assertIn("latam_searches_in_progress 0\n", response.text)
+        self.assertIn("latam_cache_hit_ratio ", response.text)
 
     def test_no_best_price_404(self):
-        with mock.patch("main.LatamFinder.get_all_flights") as mock_latam:
+        with mock.patch("scrapers.LatamFinder.get_all_flights") as mock_latam:
             mock_best_price = None
             mock_latam.return_value = mock_best_price, {}
             response = self.client.get(
@@ -451,25 +718,323 @@ class TestFlights(TestCase):
             self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
 
     def test_invalid_date_400(self):
-        with mock.patch("main.LatamFinder") as mock_latam:
+        with mock.patch("main.create_finder") as mock_latam:
             response = self.client.get(f"/2000-01-01/{self.origin}/{self.destination}")
             self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
-            self.assertIn('departure_date', response.json()['detail'][0]['loc'])
+            self.assertIn("departure_date", response.json()["detail"][0]["loc"])
 
     def test_same_airport_400(self):
-        with mock.patch("main.LatamFinder") as mock_latam:
+        with mock.patch("main.create_finder") as mock_latam:
             response = self.client.get(
                 f"/{self.departure_date}/{self.origin}/{self.origin}"
             )
             self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
-            self.assertIn('destination', response.json()['detail'][0]['loc'])
+            self.assertIn("destination", response.json()["detail"][0]["loc"])
 
     def test_airport_not_in_database_400(self):
-        with mock.patch("main.LatamFinder") as mock_latam:
+        with mock.patch("main.create_finder") as mock_latam:
             response = self.client.get(f"/{self.departure_date}/XYZ/ZYX")
             self.assertIn("not found", response.text)
             self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
 
+    def test_served_from_refreshed_route(self):
+        flights = {"2022-10-12": {"2022-10-13": 100}}
+        refreshed = (flights, {"top": []}, None, PriceMatrix.from_dict(flights), 0.0)
+        with mock.patch("main.create_finder") as mock_latam, mock.patch(
+            "main.get_refresher"
+        ) as mock_refresher:
+            mock_refresher.return_value.lookup.return_value = (100, *refreshed)
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}"
+            )
+        mock_latam.assert_not_called()
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(refreshed[0], response.json()["flights"])
+        self.assertEqual("1970-01-01T00:00:00+00:00", response.json()["refreshed_at"])
+
+    def test_search_days_too_long_400(self):
+        with mock.patch("main.create_finder") as mock_latam:
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}?days=500"
+            )
+            self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+            self.assertIn("days", response.json()["detail"][0]["loc"])
+
+    def test_search_weeks(self):
+        with mock.patch("main.create_finder") as mock_latam:
+            mock_latam.return_value.get_all_flights = mock.AsyncMock(
+                return_value=(10, self.flights_response)
+            )
+            mock_latam.return_value.views = {}
+            mock_latam.return_value.airlines = None
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}?weeks=12"
+            )
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(84, mock_latam.call_args.args[0].days)
+
+    def test_stream_flights(self):
+        async def iter_flights():
+            yield {"flights": {"2022-10-12": {"2022-10-12": 20}}, "best_price": 20}
+            yield {"flights": {"2022-10-13": {"2022-10-13": 10}}, "best_price": 10}
+
+        with mock.patch("main.create_finder") as mock_latam:
+            mock_latam.return_value.iter_flights = iter_flights
+            mock_latam.return_value.views = {"top": []}
+            mock_latam.return_value.airlines = None
+            response = self.client.get(
+                f"/{self.departure_date}/{self.origin}/{self.destination}/stream"
+            )
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertNotIn("content-encoding", response.headers)
+            lines = [json.loads(line) for line in response.text.splitlines()]
+            self.assertEqual(3, len(lines))
+            self.assertEqual({"2022-10-13": 10}, lines[1]["flights"]["2022-10-13"])
+            self.assertEqual(
+                {
+                    "done": True,
+                    "best_price": 10,
+                    "views": {"top": []},
+                    "airlines": None,
+                },
+                lines[-1],
+            )
+
+    def test_stream_invalid_date_400(self):
+        response = self.client.get(
+            f"/2000-01-01/{self.origin}/{self.destination}/stream"
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+
+class TestBatchSearch(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.departure_date = (timedelta(days=3) + datetime.now()).strftime("%Y-%m-%d")
+        cls.client = TestClient(app)
+
+    def test_one_origin_to_many_destinations(self):
+        responses = {
+            "VIX": (300, {"2022-10-12": {"2022-10-13": 300, "2022-10-14": 0}}),
+            "GRU": (None, {}),
+            "SDU": (250, {"2022-10-12": {"2022-10-15": 250}}),
+        }
+
+        async def get_all_flights(self):
+            return responses[self._destination]
+
+        with mock.patch("scrapers.LatamFinder.get_all_flights", get_all_flights):
+            response = self.client.post(
+                "/search/batch",
+                json={
+                    "departure_date": self.departure_date,
+                    "origin": "CGH",
+                    "destinations": ["VIX", "GRU", "SDU"],
+                },
+            )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        routes = response.json()["routes"]
+        self.assertEqual(
+            ["VIX", "GRU", "SDU"], [route["destination"] for route in routes]
+        )
+        self.assertEqual(300, routes[0]["best_price"])
+        self.assertEqual(
+            {
+                "origin": "CGH",
+                "destination": "SDU",
+                "departure_date": "2022-10-12",
+                "return_date": "2022-10-15",
+                "price": 250,
+            },
+            response.json()["cheapest"],
+        )
+
+    def test_list_of_searches(self):
+        with mock.patch("scrapers.LatamFinder.get_all_flights") as mock_latam:
+            mock_latam.return_value = (None, {})
+            response = self.client.post(
+                "/search/batch",
+                json={
+                    "searches": [
+                        {
+                            "departure_date": self.departure_date,
+                            "origin": "CGH",
+                            "destination": "VIX",
+                        },
+                        {
+                            "departure_date": self.departure_date,
+                            "origin": "VIX",
+                            "destination": "CGH",
+                            "days": 7,
+                        },
+                    ]
+                },
+            )
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(2, mock_latam.await_count)
+        self.assertEqual(7, response.json()["routes"][1]["days"])
+        self.assertIsNone(response.json()["cheapest"])
+
+    def test_invalid_destination_400(self):
+        response = self.client.post(
+            "/search/batch",
+            json={
+                "departure_date": self.departure_date,
+                "origin": "CGH",
+                "destinations": ["VIX", "XYZ"],
+            },
+        )
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn("not found", response.text)
+
+    def test_empty_batch_400(self):
+        response = self.client.post("/search/batch", json={})
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+
+    def test_batch_takes_a_slot_per_route(self):
+        with mock.patch("main.get_search_limiter") as mock_limiter, mock.patch(
+            "scrapers.LatamFinder.get_all_flights"
+        ) as mock_latam:
+            mock_limiter.return_value.acquire = mock.AsyncMock(return_value=False)
+            response = self.client.post(
+                "/search/batch",
+                json={
+                    "departure_date": self.departure_date,
+                    "origin": "CGH",
+                    "destinations": ["VIX", "GRU", "SDU"],
+                },
+            )
+        mock_limiter.return_value.acquire.assert_awaited_once_with(3)
+        mock_latam.assert_not_called()
+        self.assertEqual(status.HTTP_503_SERVICE_UNAVAILABLE, response.status_code)
+
+
+class TestHistory(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.client = TestClient(app)
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.history = PriceHistory(str(Path(self.tmp_dir.name) / "history.sqlite3"))
+        self.history.record("latam", "CGH", "VIX", {"2022-10-12": {"2022-10-13": 500}})
+        self.history.record("latam", "CGH", "VIX", {"2022-10-12": {"2022-10-13": 450}})
+        patcher = mock.patch("main.get_price_history", return_value=self.history)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def test_cell_history(self):
+        response = self.client.get("/history/cgh/vix/2022-10-12/2022-10-13")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual([500, 450], [row["price"] for row in response.json()])
+
+    def test_route_history(self):
+        response = self.client.get("/history/CGH/VIX", params={"bucket": 86400})
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(450, response.json()[-1]["best_price"])
+
+    def test_route_history_invalid_bucket_422(self):
+        response = self.client.get("/history/CGH/VIX", params={"bucket": 1})
+        self.assertEqual(status.HTTP_422_UNPROCESSABLE_ENTITY, response.status_code)
+
+
+class TestAlerts(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.client = TestClient(app)
+        cls.rule = {
+            "origin": "cgh",
+            "destination": "VIX",
+            "departure_from": (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d"),
+            "departure_to": (datetime.now() + timedelta(days=10)).strftime("%Y-%m-%d"),
+            "threshold": 500,
+        }
+
+    def setUp(self) -> None:
+        patcher = mock.patch(
+            "main.get_alert_engine", return_value=AlertEngine(MemorySink(), ":memory:")
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_get_and_delete(self):
+        response = self.client.post("/alerts", json=self.rule)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        rule_id = response.json()["id"]
+        self.assertEqual("CGH", response.json()["rule"]["origin"])
+
+        response = self.client.get(f"/alerts/{rule_id}")
+        self.assertEqual(500, response.json()["rule"]["threshold"])
+
+        response = self.client.delete(f"/alerts/{rule_id}")
+        self.assertEqual(status.HTTP_204_NO_CONTENT, response.status_code)
+        response = self.client.get(f"/alerts/{rule_id}")
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_invalid_range_400(self):
+        rule = {
+            **self.rule,
+            "departure_to": self.rule["departure_from"],
+            "threshold": 0,
+        }
+        response = self.client.post("/alerts", json=rule)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn("threshold", response.json()["detail"][0]["loc"])
+
+
+class TestMetroSearch(TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        super().setUpClass()
+        cls.departure_date = (timedelta(days=3) + datetime.now()).strftime("%Y-%m-%d")
+        cls.client = TestClient(app)
+
+    def test_cheapest_airport_pair_per_cell(self):
+        responses = {
+            ("CGH", "GIG"): (
+                300,
+                {"2022-10-12": {"2022-10-13": 300, "2022-10-14": 500}},
+            ),
+            ("CGH", "SDU"): (350, {"2022-10-12": {"2022-10-13": 350, "2022-10-14": 0}}),
+            ("GRU", "GIG"): (None, {}),
+            ("GRU", "SDU"): (
+                400,
+                {"2022-10-12": {"2022-10-13": 700, "2022-10-14": 400}},
+            ),
+        }
+
+        async def get_all_flights(self):
+            return responses[(self._origin, self._destination)]
+
+        with mock.patch("scrapers.LatamFinder.get_all_flights", get_all_flights):
+            response = self.client.get(f"/metro/{self.departure_date}/SAO/RIO")
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(300, response.json()["best_price"])
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": 300, "2022-10-14": 400}},
+            response.json()["flights"],
+        )
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": "CGH-GIG", "2022-10-14": "GRU-SDU"}},
+            response.json()["airports"],
+        )
+
+    def test_metro_to_airport(self):
+        with mock.patch("scrapers.LatamFinder.get_all_flights") as mock_latam:
+            mock_latam.return_value = (None, {})
+            response = self.client.get(f"/metro/{self.departure_date}/SAO/CGH")
+        self.assertEqual(1, mock_latam.await_count)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+
+    def test_unknown_metro_400(self):
+        response = self.client.get(f"/metro/{self.departure_date}/XYZ/RIO")
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        self.assertIn("not found", response.text)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,134 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+from cache import SQLiteCache, TTLCache, WriteOnlyCache
+
+
+class TestTTLCache(TestCase):
+    def test_set_and_get(self):
+        cache = TTLCache()
+        cache.set(("latam", "CGH", "VIX"), {"best_price": 10})
+        self.assertEqual({"best_price": 10}, cache.get(("latam", "CGH", "VIX")))
+        self.assertIsNone(cache.get(("latam", "VIX", "CGH")))
+        self.assertEqual(1, cache.stats["hits"])
+        self.assertEqual(1, cache.stats["misses"])
+
+    def test_found_values_are_hits(self):
+        cache = TTLCache()
+        cache.set(("latam", "CGH", "VIX", "a"), {})
+        cache.set(("latam", "CGH", "VIX", "b"), {})
+        self.assertEqual(2, len(cache.find(("latam", "CGH", "VIX"))))
+        self.assertEqual([], cache.find(("latam", "CGH", "GIG")))
+        self.assertEqual(2, cache.stats["hits"])
+        self.assertEqual(0, cache.stats["misses"])
+
+    def test_expired_entry(self):
+        cache = TTLCache(ttl=10)
+        with mock.patch("cache.time.monotonic", return_value=100):
+            cache.set(("key",), {"best_price": 10})
+        with mock.patch("cache.time.monotonic", return_value=111):
+            self.assertIsNone(cache.get(("key",)))
+        self.assertEqual(0, len(cache))
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2)
+        cache.set(("a",), {})
+        cache.set(("b",), {})
+        cache.get(("a",))
+        cache.set(("c",), {})
+        self.assertIsNone(cache.get(("b",)))
+        self.assertEqual({}, cache.get(("a",)))
+        self.assertEqual(2, len(cache))
+
+    def test_find_reads_only_the_route(self):
+        cache = TTLCache(max_entries=3)
+        cache.set(("latam", "CGH", "VIX", "a"), {"a": 1})
+        cache.set(("latam", "CGH", "GIG", "b"), {"b": 2})
+        cache.set(("latam", "CGH", "VIX", "c"), {"c": 3})
+        cache.set(("stub", "CGH", "VIX", "d"), {"d": 4})
+        self.assertEqual([{"c": 3}], cache.find(("latam", "CGH", "VIX")))
+        self.assertEqual([{"c": 3}], cache.find(("latam", "CGH", "VIX", "c")))
+        self.assertEqual([{"b": 2}, {"c": 3}], cache.find(("latam", "CGH")))
+        cache.clear()
+        self.assertEqual([], cache.find(("latam", "CGH", "GIG")))
+
+    def test_write_only(self):
+        cache = TTLCache()
+        cache.set(("latam", "CGH", "VIX", "a"), {"best_price": 10})
+        write_only = WriteOnlyCache(cache)
+        write_only.set(("latam", "CGH", "VIX", "b"), {"best_price": 20})
+        self.assertIsNone(write_only.get(("latam", "CGH", "VIX", "a")))
+        self.assertEqual([], write_only.find(("latam", "CGH", "VIX")))
+        self.assertEqual({"best_price": 20}, cache.get(("latam", "CGH", "VIX", "b")))
+        self.assertEqual(2, len(write_only))
+
+
+class TestSQLiteCache(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.tmp_dir.name) / "cache.sqlite3")
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_shared_between_instances(self):
+        SQLiteCache(self.path).set(("latam", "CGH", "VIX"), {"best_price": 10})
+        other_worker_cache = SQLiteCache(self.path)
+        self.assertEqual(
+            {"best_price": 10}, other_worker_cache.get(("latam", "CGH", "VIX"))
+        )
+
+    def test_max_entries(self):
+        cache = SQLiteCache(self.path, max_entries=2, evict_interval=0)
+        for key in ("a", "b", "c"):
+            cache.set((key,), {})
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(("a",)))
+
+    def test_evicts_every_interval(self):
+        cache = SQLiteCache(self.path, max_entries=2, evict_interval=60)
+        for key in ("a", "b", "c"):
+            cache.set((key,), {})
+        self.assertEqual(3, len(cache))
+        with mock.patch("cache.time.monotonic", return_value=10**10):
+            cache.set(("d",), {})
+        self.assertEqual(2, len(cache))
+        self.assertEqual({}, cache.get(("d",)))
+
+    def test_find_prefix(self):
+        cache = SQLiteCache(self.path)
+        cache.set(("latam", "CGH", "VIX", "2022-10-12", "2022-10-12"), {"a": 1})
+        cache.set(("latam", "CGH", "VIX", "2022-10-19", "2022-10-19"), {"b": 2})
+        cache.set(("latam", "CGH", "VIXX", "2022-10-12", "2022-10-12"), {"c": 3})
+        cache.set(("latam", "CGH", "VI", "2022-10-12", "2022-10-12"), {"d": 4})
+        self.assertEqual([{"a": 1}, {"b": 2}], cache.find(("latam", "CGH", "VIX")))
+
+    def test_stats_entries_of_the_last_eviction(self):
+        cache = SQLiteCache(self.path, evict_interval=60)
+        cache.set(("a",), {})
+        self.assertEqual(0, cache.stats["entries"])
+        with mock.patch("cache.time.monotonic", return_value=10**10):
+            cache.set(("b",), {})
+        with mock.patch.object(cache, "_connection") as connection:
+            self.assertEqual(2, cache.stats["entries"])
+        connection.execute.assert_not_called()
+
+
+class TestSQLiteCacheAsync(IsolatedAsyncioTestCase):
+    async def test_runs_in_its_thread(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = SQLiteCache(str(Path(tmp_dir) / "cache.sqlite3"))
+            await cache.aset(("latam", "CGH", "VIX", "a"), {"best_price": 10})
+            self.assertEqual(
+                {"best_price": 10}, await cache.aget(("latam", "CGH", "VIX", "a"))
+            )
+            self.assertEqual(
+                [{"best_price": 10}], await cache.afind(("latam", "CGH", "VIX"))
+            )
+            self.assertIsNone(await cache.aget(("latam", "CGH", "GIG", "a")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase, TestCase, mock
+
+import httpx
+
+from benchmarks.mock_latam import create_app
+from cache import TTLCache
+from capture import CaptureArchive, CaptureWriter, ReplayTransport
+from history import PriceHistory
+from http_client import HttpSession
+from ratelimit import CircuitBreaker
+from scrapers import LatamFinder
+from validators import FlightData
+
+MOCK_LATAM_URL = "http://latam.test/bestprices/roundtrip"
+
+
+def _response(status_code: int, content: bytes) -> httpx.Response:
+    return httpx.Response(
+        status_code, headers={"content-type": "application/json"}, content=content
+    )
+
+
+class TestCaptureArchive(TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = str(Path(tmp_dir.name) / "capture.bin")
+        self.writer = CaptureWriter(self.path)
+        self.addCleanup(self.writer.close)
+
+    def test_round_trip(self):
+        url = "http://latam.test/a?x=1"
+        self.writer.record(url, _response(200, b'{"a": 1}'), 10.0, 0.5)
+        self.writer.record(url, _response(503, b"{}"), 11.0, 0.25)
+        self.writer.record("http://latam.test/b", _response(200, b"[]"), 12.0, 1)
+        self.assertEqual(3, self.writer.stats["records"])
+
+        archive = CaptureArchive(self.path)
+        self.addCleanup(archive.close)
+        self.assertEqual(3, len(archive))
+        first = archive[0]
+        self.assertEqual(url, first.url)
+        self.assertEqual(
+            (10.0, 0.5, 200), (first.started_at, first.elapsed, first.status_code)
+        )
+        self.assertEqual("application/json", first.content_type)
+        self.assertEqual(b'{"a": 1}', first.content)
+        self.assertEqual({url: [0, 1], "http://latam.test/b": [2]}, archive.urls())
+
+    def test_incomplete_tail_is_skipped(self):
+        self.writer.record("http://latam.test/a", _response(200, b"{}"), 10.0, 0.5)
+        self.writer.record("http://latam.test/b", _response(200, b"{}"), 11.0, 0.5)
+        with open(self.path, "r+b") as file:
+            file.truncate(os.path.getsize(self.path) - 3)
+        archive = CaptureArchive(self.path)
+        self.addCleanup(archive.close)
+        self.assertEqual(
+            ["http://latam.test/a"], [captured.url for captured in archive]
+        )
+
+    def test_empty_archive(self):
+        Path(self.path).touch()
+        archive = CaptureArchive(self.path)
+        self.assertEqual(0, len(archive))
+        self.assertEqual({}, archive.urls())
+
+
+class TestReplay(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = str(Path(tmp_dir.name) / "capture.bin")
+        self.flight = FlightData(
+            departure_date=(datetime.now() + timedelta(days=3)).strftime("%Y-%m-%d"),
+            origin="CGH",
+            destination="VIX",
+        )
+
+    def _finder(self, session: HttpSession, capture: CaptureWriter | None = None):
+        return LatamFinder(
+            self.flight,
+            session=session,
+            cache=TTLCache(),
+            circuit_breaker=CircuitBreaker(),
+            history=PriceHistory(":memory:"),
+            capture=capture,
+        )
+
+    @mock.patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    async def test_replayed_search_matches_captured_one(self):
+        writer = CaptureWriter(self.path)
+        self.addCleanup(writer.close)
+        session = HttpSession(
+            transport=httpx.ASGITransport(app=create_app(latency=0.01, jitter=0))
+        )
+        best_price, flights = await self._finder(session, writer).get_all_flights()
+        self.assertEqual(6, writer.stats["records"])
+
+        archive = CaptureArchive(self.path)
+        self.addCleanup(archive.close)
+        transport = ReplayTransport(archive, speed=0)
+        replayed = await self._finder(
+            HttpSession(transport=transport)
+        ).get_all_flights()
+        self.assertEqual((best_price, flights), replayed)
+        self.assertEqual(0, transport.misses)
+
+    async def test_unknown_url_404_and_timing(self):
+        writer = CaptureWriter(self.path)
+        writer.record("http://latam.test/a", _response(200, b"{}"), 10.0, 0.2)
+        writer.close()
+        archive = CaptureArchive(self.path)
+        self.addCleanup(archive.close)
+        transport = ReplayTransport(archive, speed=2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            with mock.patch("capture.asyncio.sleep") as sleep:
+                response = await client.get("http://latam.test/a")
+            sleep.assert_awaited_once()
+            self.assertAlmostEqual(0.1, sleep.call_args.args[0])
+            self.assertEqual(200, response.status_code)
+            response = await client.get("http://latam.test/missing")
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(1, transport.misses)
+
+
+if __name__ == "__main__":
+    unittest.main()
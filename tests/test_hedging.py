@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from hedging import LatencyTracker, hedged
+
+
+class TestLatencyTracker(TestCase):
+    def test_quantile_needs_min_samples(self):
+        tracker = LatencyTracker(size=100, min_samples=3)
+        tracker.record(1)
+        self.assertIsNone(tracker.quantile(0.95))
+        tracker.record(2)
+        tracker.record(3)
+        self.assertEqual(3, tracker.quantile(0.95))
+        self.assertEqual(2, tracker.quantile(0.5))
+
+    def test_keeps_last_samples(self):
+        tracker = LatencyTracker(size=2, min_samples=1)
+        for seconds in (10, 1, 2):
+            tracker.record(seconds)
+        self.assertEqual(2, tracker.stats["samples"])
+        self.assertEqual(2, tracker.quantile(1))
+
+
+class TestHedged(IsolatedAsyncioTestCase):
+    async def test_fast_call_is_not_hedged(self):
+        calls = []
+
+        async def call():
+            calls.append(1)
+            return "ok"
+
+        self.assertEqual("ok", await hedged(call, delay=1))
+        self.assertEqual(1, len(calls))
+
+    async def test_slow_call_is_hedged_and_cancelled(self):
+        delays = [5, 0]
+        cancelled = []
+
+        async def call():
+            try:
+                await asyncio.sleep(delays.pop(0))
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return "hedge"
+
+        self.assertEqual("hedge", await hedged(call, delay=0.01))
+        await asyncio.sleep(0)
+        self.assertEqual(1, len(cancelled))
+
+    async def test_hedge_skipped(self):
+        async def call():
+            await asyncio.sleep(0.05)
+            return "first"
+
+        result = await hedged(call, delay=0.01, should_hedge=lambda: False)
+        self.assertEqual("first", result)
+
+    async def test_failed_call_waits_for_the_other(self):
+        calls = []
+
+        async def call():
+            calls.append(1)
+            if len(calls) == 1:
+                await asyncio.sleep(0.05)
+                raise ValueError("first failed")
+            await asyncio.sleep(0.1)
+            return "second"
+
+        self.assertEqual("second", await hedged(call, delay=0.01))
+
+    async def test_both_fail(self):
+        async def call():
+            await asyncio.sleep(0.02)
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            await hedged(call, delay=0.01)
+
+    async def test_cancelled_while_waiting_for_the_first_call(self):
+        cancelled = []
+
+        async def call():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        task = asyncio.ensure_future(hedged(call, delay=1))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0)
+        self.assertEqual(1, len(cancelled))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import TestCase
+
+from history import PriceHistory
+
+
+class TestPriceHistory(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.history = PriceHistory(str(Path(self.tmp_dir.name) / "history.sqlite3"))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_record_skips_unknown_cells(self):
+        rows = self.history.record(
+            "latam",
+            "CGH",
+            "VIX",
+            {"2022-10-12": {"2022-10-12": 500, "2022-10-13": 0, "2022-10-14": None}},
+        )
+        self.assertEqual(2, rows)
+        self.assertEqual(2, len(self.history))
+        self.assertEqual(2, self.history.stats["rows_written"])
+
+    def test_record_later(self):
+        future = self.history.record_later(
+            "latam", "CGH", "VIX", {"2022-10-12": {"2022-10-12": 500}}
+        )
+        self.assertEqual(1, future.result())
+        self.assertEqual(1, len(self.history))
+
+    def test_record_later_logs_failures(self):
+        self.history._connection.execute("DROP TABLE prices")
+        with self.assertLogs("app.history", level="ERROR"):
+            self.history.record_later(
+                "latam", "CGH", "VIX", {"2022-10-12": {"2022-10-12": 500}}
+            )
+            self.history.flush()
+        self.assertEqual(1, self.history.stats["failed_writes"])
+
+    def test_run_later_after_the_writes(self):
+        self.history.record_later(
+            "latam", "CGH", "VIX", {"2022-10-12": {"2022-10-12": 500}}
+        )
+        self.assertEqual(1, self.history.run_later(len, self.history).result())
+        with self.assertLogs("app.history", level="ERROR"):
+            self.assertIsNone(self.history.run_later(int, "x").result())
+
+    def test_cell_history(self):
+        for observed_at, price in ((200, 450), (100, 500), (300, 0)):
+            self.history.record(
+                "latam",
+                "CGH",
+                "VIX",
+                {"2022-10-12": {"2022-10-13": price}},
+                observed_at,
+            )
+        self.history.record(
+            "latam", "CGH", "GIG", {"2022-10-12": {"2022-10-13": 1}}, 100
+        )
+        history = self.history.cell_history("CGH", "VIX", "2022-10-12", "2022-10-13")
+        self.assertEqual(
+            [500, 450, 0], [observation["price"] for observation in history]
+        )
+        self.assertEqual("1970-01-01T00:01:40+00:00", history[0]["observed_at"])
+        since = self.history.cell_history(
+            "CGH", "VIX", "2022-10-12", "2022-10-13", since=150
+        )
+        self.assertEqual(2, len(since))
+
+    def test_route_min_over_time(self):
+        self.history.record(
+            "latam",
+            "CGH",
+            "VIX",
+            {"2022-10-12": {"2022-10-13": 500, "2022-10-14": 0}},
+            10,
+        )
+        self.history.record(
+            "latam", "CGH", "VIX", {"2022-10-13": {"2022-10-14": 400}}, 50
+        )
+        self.history.record(
+            "latam", "CGH", "VIX", {"2022-10-12": {"2022-10-13": 0}}, 130
+        )
+        self.history.record(
+            "latam", "CGH", "VIX", {"2022-10-12": {"2022-10-13": 700}}, 190
+        )
+        self.assertEqual(
+            [
+                {"observed_at": "1970-01-01T00:00:00+00:00", "best_price": 400},
+                {"observed_at": "1970-01-01T00:03:00+00:00", "best_price": 700},
+            ],
+            self.history.route_min_over_time("CGH", "VIX", bucket=60),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
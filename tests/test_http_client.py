@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+from unittest import TestCase
+
+import httpx
+
+from http_client import HttpSession
+
+
+class TestHttpSession(TestCase):
+    def setUp(self) -> None:
+        self.session = HttpSession(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200))
+        )
+        self.clients = []
+
+    async def get(self) -> int:
+        response = await self.session.get("http://127.0.0.1:8001/bestprices")
+        self.clients.append(self.session._client)
+        return response.status_code
+
+    def test_client_closed_with_its_loop(self):
+        self.assertEqual(200, asyncio.run(self.get()))
+        self.assertEqual(200, asyncio.run(self.get()))
+        self.assertIsNot(self.clients[0], self.clients[1])
+        self.assertTrue(self.clients[0].is_closed)
+        self.assertEqual(2, self.session.metrics["requests"])
+
+    def test_aclose(self):
+        async def get_and_close():
+            await self.get()
+            await self.session.aclose()
+
+        asyncio.run(get_and_close())
+        self.assertTrue(self.clients[0].is_closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
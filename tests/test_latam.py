@@ -1,19 +1,33 @@
+import asyncio
 import json
+import sqlite3
+import tempfile
+import time
 import unittest
 from datetime import datetime, timedelta
 from pathlib import Path
-from unittest import TestCase, mock
+from unittest import IsolatedAsyncioTestCase, mock
 from unittest.mock import patch
 
-import requests.exceptions
+import httpx
 from validators import FlightData
 
+from alerts import AlertEngine, MemorySink
+from benchmarks.mock_latam import create_app
+
+from cache import TTLCache, get_cache
+from hedging import LatencyTracker
+from history import PriceHistory
+from http_client import HttpSession
+from metrics import MERGE_SECONDS, UPSTREAM_ERRORS, UPSTREAM_RETRIES
+from ratelimit import CircuitBreaker, TokenBucket, get_circuit_breaker
 from scrapers import LatamFinder
 
 BASE_PATH = Path(__file__).resolve().parent
+MOCK_LATAM_URL = "http://latam.test/bestprices/roundtrip"
 
 
-class TestAbsClass(TestCase):
+class TestAbsClass(IsolatedAsyncioTestCase):
     def _mock_response(
         self, status=200, content="CONTENT", json_data=None, raise_for_status=None
     ):
@@ -34,6 +48,10 @@ class TestAbsClass(TestCase):
             mock_resp.json = mock.Mock(return_value=json_data)
         return mock_resp
 
+    def setUp(self) -> None:
+        get_cache().clear()
+        get_circuit_breaker().reset()
+
     @classmethod
     def setUpClass(cls) -> None:
         super().setUpClass()
@@ -440,85 +458,471 @@ class TestAbsClass(TestCase):
             )
             LatamFinder(test_flight)
 
-    def test_generate_travel_dates(self):
+    async def test_generate_travel_dates(self):
         test_latam = LatamFinder(self.flight)
-        covered_days_in_search = (test_latam._number_of_total_searches - 1) * 7
+        await test_latam._generate_travel_dates()
+        covered_days_in_search = test_latam._search_days - 7
         last_search_date = self.flight.departure_date + timedelta(
             days=covered_days_in_search
         )
         self.assertEqual(last_search_date, test_latam._all_travel_dates[-1][-1])
         self.assertEqual(6, len(test_latam._all_travel_dates))
 
-    @patch("scrapers.requests.get", side_effect=requests.exceptions.ConnectionError)
-    def test_get_one_flight_connection_error(self, mock_requests):
+    @patch(
+        "scrapers.httpx.AsyncClient.get",
+        side_effect=httpx.ConnectError("Connection refused"),
+    )
+    async def test_get_one_flight_connection_error(self, mock_requests):
+        test_latam = LatamFinder(self.flight)
+        test_url = test_latam._generate_complete_url("2022-10-10", "2022-11-11")
+        self.assertEqual(None, await test_latam._request_url(test_url))
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_request_url_fails_fast_when_circuit_is_open(self, mock_requests):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        test_latam = LatamFinder(self.flight, circuit_breaker=breaker)
+        test_url = test_latam._generate_complete_url("2022-10-10", "2022-11-11")
+        self.assertEqual(None, await test_latam._request_url(test_url))
+        mock_requests.assert_not_called()
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_request_url_opens_circuit(self, mock_requests):
+        mock_requests.side_effect = httpx.ConnectError("Connection refused")
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        test_latam = LatamFinder(
+            self.flight, rate_limiter=TokenBucket(path=None), circuit_breaker=breaker
+        )
+        test_url = test_latam._generate_complete_url("2022-10-10", "2022-11-11")
+        with patch("scrapers.asyncio.sleep") as mock_sleep:
+            self.assertEqual(None, await test_latam._request_url(test_url))
+        self.assertEqual(2, mock_requests.await_count)
+        self.assertEqual(1, mock_sleep.await_count)
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_request_url_respects_retry_after(self, mock_requests):
+        throttled = self._mock_response(
+            status=429,
+            raise_for_status=httpx.HTTPStatusError(
+                "Too many requests", request=None, response=None
+            ),
+        )
+        throttled.headers = {"Retry-After": "3"}
+        ok = self._mock_response(content=json.dumps(self.flights_response).encode())
+        ok.headers = {"content-type": "application/json"}
+        mock_requests.side_effect = [throttled, ok]
+        limiter = TokenBucket(path=None)
+        breaker = CircuitBreaker()
+        test_latam = LatamFinder(
+            self.flight, rate_limiter=limiter, circuit_breaker=breaker
+        )
+        test_url = test_latam._generate_complete_url("2022-10-10", "2022-11-11")
+        with patch("scrapers.asyncio.sleep") as mock_sleep, patch(
+            "scrapers.TokenBucket.acquire"
+        ):
+            self.assertIsNotNone(await test_latam._request_url(test_url))
+        self.assertEqual(3, mock_sleep.await_args.args[0])
+        self.assertGreater(limiter.stats["blocked_for"], 2)
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_request_url_does_not_retry_client_errors(self, mock_requests):
+        mock_requests.return_value = self._mock_response(
+            status=400,
+            raise_for_status=httpx.HTTPStatusError(
+                "Bad request", request=None, response=None
+            ),
+        )
         test_latam = LatamFinder(self.flight)
         test_url = test_latam._generate_complete_url("2022-10-10", "2022-11-11")
-        self.assertEqual(None, test_latam._request_url(test_url))
+        self.assertEqual(None, await test_latam._request_url(test_url))
+        self.assertEqual(1, mock_requests.await_count)
+
+    def _mock_latam_session(self, **options) -> HttpSession:
+        """
+        Session requesting the local mock LATAM server of the benchmarks
+        """
+        return HttpSession(transport=httpx.ASGITransport(app=create_app(**options)))
+
+    @patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    @patch("scrapers.LatamFinder._hedge_delay", return_value=0.05)
+    async def test_request_url_hedges_stalled_request(self, _):
+        session = self._mock_latam_session(
+            latency=0.01, jitter=0, stall=5, stall_every=2
+        )
+        test_latam = LatamFinder(self.flight, session=session)
+        test_url = test_latam._generate_complete_url("2022-10-10", "2022-10-10")
+        started_at = time.monotonic()
+        response = await test_latam._request_url(test_url)
+        self.assertIsNotNone(response)
+        self.assertLess(time.monotonic() - started_at, 1)
+
+    @patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    @patch("scrapers.LatamFinder._hedge_delay", return_value=10)
+    async def test_get_all_flights_deadline_leaves_unknown_cells(self, _):
+        session = self._mock_latam_session(
+            latency=0.01, jitter=0, stall=5, stall_every=2
+        )
+        test_latam = LatamFinder(self.flight, session=session, deadline=0.5)
+        started_at = time.monotonic()
+        best_price, flights = await test_latam.get_all_flights()
+        self.assertLess(time.monotonic() - started_at, 1.5)
+        self.assertIsNotNone(best_price)
+        known_cells = int(test_latam._all_flights.known.sum())
+        self.assertLess(known_cells, 49 * len(test_latam._all_travel_dates))
+        self.assertGreater(known_cells, 0)
+        self.assertIn(
+            None, [price for returns in flights.values() for price in returns.values()]
+        )
+
+    @patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    @patch("scrapers.LatamFinder._hedge_delay", return_value=10)
+    async def test_iter_flights_deadline_computes_views(self, _):
+        session = self._mock_latam_session(
+            latency=0.01, jitter=0, stall=5, stall_every=2
+        )
+        test_latam = LatamFinder(self.flight, session=session, deadline=0.5)
+        responses = [response async for response in test_latam.iter_flights()]
+        self.assertLess(len(responses), len(test_latam._all_travel_dates))
+        self.assertEqual(
+            min(response["best_price"] for response in responses),
+            test_latam.views["top"][0]["price"],
+        )
+
+    @patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    async def test_get_all_flights_retries_flaky_upstream(self):
+        session = self._mock_latam_session(latency=0.01, jitter=0, fail_every=2)
+        test_latam = LatamFinder(
+            self.flight, session=session, circuit_breaker=CircuitBreaker()
+        )
+        retries = UPSTREAM_RETRIES.value()
+        errors = UPSTREAM_ERRORS.value(code="503")
+        merges = MERGE_SECONDS.count()
+        with patch("scrapers.asyncio.sleep"):
+            best_price, flights = await test_latam.get_all_flights()
+        self.assertIsNotNone(best_price)
+        self.assertEqual(
+            49 * len(test_latam._all_travel_dates),
+            int(test_latam._all_flights.known.sum()),
+        )
+        self.assertGreater(UPSTREAM_RETRIES.value(), retries)
+        self.assertGreater(UPSTREAM_ERRORS.value(code="503"), errors)
+        self.assertEqual(merges + 1, MERGE_SECONDS.count())
+
+    @patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    async def test_get_one_flight_larger_payload(self):
+        session = self._mock_latam_session(
+            latency=0.01, distribution="lognormal", window_days=14, seed=1
+        )
+        test_latam = LatamFinder(self.flight, session=session)
+        flight = await test_latam._get_one_flight(
+            datetime(2022, 10, 10), datetime(2022, 10, 10)
+        )
+        self.assertEqual(14, len(flight["flights"]))
+
+    @patch("scrapers.LATAM_BESTPRICES_URL", MOCK_LATAM_URL)
+    async def test_request_url_gives_up_on_failing_upstream(self):
+        session = self._mock_latam_session(latency=0, error_rate=1)
+        test_latam = LatamFinder(
+            self.flight, session=session, circuit_breaker=CircuitBreaker()
+        )
+        test_url = test_latam._generate_complete_url("2022-10-10", "2022-10-10")
+        with patch("scrapers.asyncio.sleep"):
+            self.assertIsNone(await test_latam._request_url(test_url))
 
-    @patch("scrapers.requests.get", side_effect=requests.exceptions.RequestException)
-    def test_get_one_flight_error_not_catch(self, mock_requests):
+    @patch("scrapers.httpx.AsyncClient.get", side_effect=httpx.UnsupportedProtocol)
+    async def test_get_one_flight_error_not_catch(self, mock_requests):
         test_latam = LatamFinder(self.flight)
         test_url = test_latam._generate_complete_url("2022-10-10", "2022-11-11")
-        self.assertEqual(None, test_latam._request_url(test_url))
+        self.assertEqual(None, await test_latam._request_url(test_url))
 
-    @patch("scrapers.requests.get")
-    def test_get_one_flight_ok(self, mock_requests):
-        mock_requests.return_value.status_code = 200
-        mock_requests.return_value.text = json.dumps(self.flights_response)
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_get_one_flight_ok(self, mock_requests):
+        mock_requests.return_value = self._mock_response()
+        mock_requests.return_value.content = json.dumps(self.flights_response).encode()
         mock_requests.return_value.headers = {"content-type": "application/json"}
         test_latam = LatamFinder(self.flight)
-        response = test_latam._get_one_flight(
+        response = await test_latam._get_one_flight(
             self.flight.departure_date, self.flight.departure_date
         )
         self.assertEqual(2701.84, response["flights"]["2022-10-07"]["2022-11-08"])
         self.assertEqual(1978.48, response["flights"]["2022-10-13"]["2022-11-14"])
 
-    @patch("scrapers.requests.get")
-    def test_get_one_flight_404(self, mock_requests):
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_get_one_flight_recorded_in_history(self, mock_requests):
+        mock_requests.return_value = self._mock_response()
+        mock_requests.return_value.content = json.dumps(self.flights_response).encode()
+        mock_requests.return_value.headers = {"content-type": "application/json"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history = PriceHistory(str(Path(tmp_dir) / "history.sqlite3"))
+            test_latam = LatamFinder(self.flight, history=history)
+            await test_latam._get_one_flight(
+                self.flight.departure_date, self.flight.departure_date
+            )
+            history.flush()
+            self.assertEqual(
+                [2701.84],
+                [
+                    observation["price"]
+                    for observation in history.cell_history(
+                        "CGH", "VIX", "2022-10-07", "2022-11-08"
+                    )
+                ],
+            )
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_history_failure_does_not_fail_the_search(self, mock_requests):
+        mock_requests.return_value = self._mock_response()
+        mock_requests.return_value.content = json.dumps(self.flights_response).encode()
+        mock_requests.return_value.headers = {"content-type": "application/json"}
+        history = PriceHistory(":memory:")
+        test_latam = LatamFinder(self.flight, history=history)
+        with patch.object(history, "record", side_effect=sqlite3.OperationalError):
+            with self.assertLogs("app.history", level="ERROR"):
+                response = await test_latam._get_one_flight(
+                    self.flight.departure_date, self.flight.departure_date
+                )
+                history.flush()
+        self.assertEqual(2701.84, response["flights"]["2022-10-07"]["2022-11-08"])
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_alerts_failure_does_not_fail_the_search(self, mock_requests):
+        mock_requests.return_value = self._mock_response()
+        mock_requests.return_value.content = json.dumps(self.flights_response).encode()
+        mock_requests.return_value.headers = {"content-type": "application/json"}
+        history = PriceHistory(":memory:")
+        alerts = AlertEngine(MemorySink(), ":memory:")
+        test_latam = LatamFinder(self.flight, history=history, alerts=alerts)
+        with patch.object(
+            alerts, "evaluate", side_effect=sqlite3.OperationalError("locked")
+        ) as evaluate:
+            with self.assertLogs("app.history", level="ERROR"):
+                response = await test_latam._get_one_flight(
+                    self.flight.departure_date, self.flight.departure_date
+                )
+                history.flush()
+        evaluate.assert_called_once_with("latam", "CGH", "VIX", response["flights"])
+        self.assertEqual(2701.84, response["flights"]["2022-10-07"]["2022-11-08"])
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_get_one_flight_404(self, mock_requests):
         mock_requests.return_value.status_code = 404
         mock_requests.return_value.raise_for_status = mock.Mock()
-        mock_requests.return_value.raise_for_status.side_effect = (
-            requests.exceptions.HTTPError()
+        mock_requests.return_value.raise_for_status.side_effect = httpx.HTTPStatusError(
+            "Not found", request=None, response=None
         )
-        mock_requests.return_value.text = json.dumps({"error": "some error"})
+        mock_requests.return_value.content = json.dumps(
+            {"error": "some error"}
+        ).encode()
         mock_requests.return_value.headers = {"content-type": "application/json"}
         test_latam = LatamFinder(self.flight)
-        response = test_latam._get_one_flight(
+        response = await test_latam._get_one_flight(
             self.flight.departure_date, self.flight.departure_date
         )
         self.assertEqual({}, response)
 
-    @patch("scrapers.Pool")
-    def test_get_all_flights_with_some_empty_responses(self, latam_mock):
+    @patch("scrapers.LatamFinder._get_one_flight")
+    async def test_get_all_flights_with_some_empty_responses(self, latam_mock):
         get_one_flight_response_test = {
             "flights": {"2022-04-22": {"2022-04-22": 258.0}},
-            "best_price": 40,
+            "best_price": 258.0,
         }
-        mock_pool_instance = latam_mock.return_value.__enter__.return_value
-        mock_pool_instance.starmap.return_value = [
+        latam_mock.side_effect = [
             {},
             get_one_flight_response_test,
             {},
+            {},
+            {},
+            {},
         ]
         test_latam = LatamFinder(self.flight)
-        best_price, flights = test_latam.get_all_flights()
-        mock_pool_instance.starmap.assert_called_once()
+        best_price, flights = await test_latam.get_all_flights()
+        self.assertEqual(len(test_latam._all_travel_dates), latam_mock.await_count)
         self.assertEqual(get_one_flight_response_test["flights"], flights)
         self.assertEqual(get_one_flight_response_test["best_price"], best_price)
 
-    @patch("scrapers.Pool")
-    def test_get_all_flights_with_empty_responses(self, latam_mock):
-        mock_pool_instance = latam_mock.return_value.__enter__.return_value
-        mock_pool_instance.starmap.return_value = [
+    @patch("scrapers.LatamFinder._get_one_flight")
+    async def test_get_all_flights_with_empty_responses(self, latam_mock):
+        latam_mock.return_value = {}
+        test_latam = LatamFinder(self.flight)
+        best_price, flights = await test_latam.get_all_flights()
+        self.assertEqual(len(test_latam._all_travel_dates), latam_mock.await_count)
+        self.assertEqual({}, flights)
+        self.assertEqual(None, best_price)
+
+    async def test_get_one_flight_with_injected_session(self):
+        requested_urls = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requested_urls.append(str(request.url))
+            return httpx.Response(200, json=self.flights_response)
+
+        session = HttpSession(transport=httpx.MockTransport(handler))
+        test_latam = LatamFinder(self.flight, session=session)
+        response = await test_latam._get_one_flight(
+            self.flight.departure_date, self.flight.departure_date
+        )
+        await session.aclose()
+        self.assertEqual(1, len(requested_urls))
+        self.assertIn("origin=CGH", requested_urls[0])
+        self.assertEqual(890.8, response["best_price"])
+        self.assertEqual(1, session.metrics["requests"])
+
+    @patch("scrapers.httpx.AsyncClient.get")
+    async def test_get_one_flight_cached(self, mock_requests):
+        mock_requests.return_value = self._mock_response()
+        mock_requests.return_value.content = json.dumps(self.flights_response).encode()
+        mock_requests.return_value.headers = {"content-type": "application/json"}
+        cache = TTLCache()
+        test_latam = LatamFinder(self.flight, cache=cache)
+        first = await test_latam._get_one_flight(
+            self.flight.departure_date, self.flight.departure_date
+        )
+        second = await test_latam._get_one_flight(
+            self.flight.departure_date, self.flight.departure_date
+        )
+        self.assertEqual(first, second)
+        mock_requests.assert_awaited_once()
+        self.assertEqual(1, cache.stats["hits"])
+        self.assertEqual(1, cache.stats["misses"])
+
+    # Latencies of other tests would hedge these slower requests
+    @patch("scrapers.get_latency_tracker", LatencyTracker)
+    async def test_concurrent_searches_share_upstream_calls(self):
+        requested_urls = []
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            requested_urls.append(str(request.url))
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, json=self.flights_response)
+
+        session = HttpSession(transport=httpx.MockTransport(handler))
+        for concurrency in (1, 10, 100):
+            requested_urls.clear()
+            cache = TTLCache()
+            results = await asyncio.gather(
+                *(
+                    LatamFinder(self.flight, session, cache).get_all_flights()
+                    for _ in range(concurrency)
+                )
+            )
+            self.assertEqual(6, len(requested_urls))
+            self.assertEqual(6, len(set(requested_urls)))
+            self.assertTrue(all(result == results[0] for result in results))
+        await session.aclose()
+
+    @patch("scrapers.LatamFinder._get_one_flight")
+    async def test_cached_windows_are_not_requested(self, latam_mock):
+        latam_mock.return_value = {}
+        first_date = self.flight.departure_date
+        cached_flights = {
+            (first_date + timedelta(days=dep)).strftime("%Y-%m-%d"): {
+                (first_date + timedelta(days=ret)).strftime("%Y-%m-%d"): 100.0 + ret
+                for ret in range(7)
+            }
+            for dep in range(7)
+        }
+        cache = TTLCache()
+        cache.set(
+            ("latam", "CGH", "VIX", first_date.strftime("%Y-%m-%d"), "any"),
+            {"flights": cached_flights, "best_price": 100.0},
+        )
+        test_latam = LatamFinder(self.flight, cache=cache)
+        await test_latam._generate_travel_dates()
+        self.assertEqual(5, len(test_latam._all_travel_dates))
+        self.assertNotIn((first_date, first_date), test_latam._all_travel_dates)
+        best_price, flights = await test_latam.get_all_flights()
+        self.assertEqual(5, latam_mock.await_count)
+        self.assertEqual(100.0, best_price)
+        self.assertEqual(cached_flights, flights)
+
+    @patch("scrapers.LatamFinder._request_one_flight")
+    async def test_cached_windows_count_as_hits(self, latam_mock):
+        latam_mock.return_value = {}
+        first_date = self.flight.departure_date
+        cache = TTLCache()
+        cache.set(
+            ("latam", "CGH", "VIX", first_date.strftime("%Y-%m-%d"), "any"),
+            {
+                "flights": {
+                    first_date.strftime("%Y-%m-%d"): {
+                        first_date.strftime("%Y-%m-%d"): 100.0
+                    }
+                },
+                "best_price": 100.0,
+            },
+        )
+        await LatamFinder(self.flight, cache=cache).get_all_flights()
+        self.assertEqual(6, latam_mock.await_count)
+        self.assertEqual(1, cache.stats["hits"])
+        self.assertEqual(6, cache.stats["misses"])
+
+    @patch("scrapers.LatamFinder._get_one_flight")
+    async def test_iter_flights(self, latam_mock):
+        latam_mock.side_effect = [
+            {"flights": {"2022-04-22": {"2022-04-22": 258.0}}, "best_price": 258.0},
+            {},
+            {"flights": {"2022-04-23": {"2022-04-23": 40.0}}, "best_price": 40.0},
             {},
             {},
             {},
         ]
         test_latam = LatamFinder(self.flight)
-        best_price, flights = test_latam.get_all_flights()
-        mock_pool_instance.starmap.assert_called_once()
-        self.assertEqual({}, flights)
-        self.assertEqual(None, best_price)
+        responses = [response async for response in test_latam.iter_flights()]
+        self.assertEqual(2, len(responses))
+        self.assertEqual(40.0, min(response["best_price"] for response in responses))
+        self.assertEqual(40.0, test_latam._all_flights.best_price())
+        self.assertEqual(
+            {"2022-04-22", "2022-04-23"}, set(test_latam._all_flights.to_dict())
+        )
+
+    async def test_search_days_from_weeks(self):
+        flight = FlightData(
+            departure_date=self.flight.departure_date,
+            origin="CGH",
+            destination="VIX",
+            weeks=12,
+        )
+        test_latam = LatamFinder(flight)
+        await test_latam._generate_travel_dates()
+        self.assertEqual(78, len(test_latam._all_travel_dates))
+
+    def test_convert_response_without_orjson(self):
+        response = self._mock_response(
+            content=json.dumps(self.flights_response).encode()
+        )
+        response.headers = {"content-type": "application/json; charset=utf-8"}
+        with patch("scrapers.orjson", None):
+            self.assertEqual(
+                self.flights_response,
+                LatamFinder._convert_request_response_to_dict(response),
+            )
+
+    def test_reformat_unavailable_flight(self):
+        api_response = {
+            "bestPrices": [
+                {
+                    "departureDate": "2022-10-07",
+                    "returnDates": [
+                        {"date": "2022-10-06", "price": None, "available": False},
+                        {
+                            "date": "2022-10-08",
+                            "price": {"amount": 120.5, "currency": "BRL"},
+                            "available": True,
+                        },
+                    ],
+                }
+            ],
+            "cheapestPrice": 120.5,
+        }
+        self.assertEqual(
+            {
+                "flights": {"2022-10-07": {"2022-10-06": 0, "2022-10-08": 120.5}},
+                "best_price": 120.5,
+            },
+            LatamFinder._reformat_latam_response(api_response),
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,169 @@
+import unittest
+from datetime import date
+from unittest import TestCase
+
+from matrix import CheapestPriceMatrix, PriceMatrix
+
+
+class TestPriceMatrix(TestCase):
+    def setUp(self) -> None:
+        self.matrix = PriceMatrix(date(2022, 10, 12), 3)
+
+    def test_empty(self):
+        self.assertEqual({}, self.matrix.to_dict())
+        self.assertIsNone(self.matrix.best_price())
+
+    def test_merge_keeps_unavailable_apart_from_missing(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-12": 890.8, "2022-10-13": 0}})
+        self.assertTrue(self.matrix.known[0, 1])
+        self.assertFalse(self.matrix.known[0, 2])
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-12": 890.8, "2022-10-13": 0}},
+            self.matrix.to_dict(),
+        )
+        self.assertEqual(890.8, self.matrix.best_price())
+
+    def test_later_response_overrides_cell(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-13": 500}})
+        self.matrix.merge({"2022-10-12": {"2022-10-13": 450.55}})
+        self.assertEqual(450.55, self.matrix.to_dict()["2022-10-12"]["2022-10-13"])
+
+    def test_grows_for_cells_outside_the_grid(self):
+        self.matrix.merge({"2022-10-10": {"2022-10-20": 2701.84}})
+        self.assertEqual(date(2022, 10, 10), self.matrix.first_date)
+        self.assertEqual((11, 11), self.matrix.shape)
+        self.assertEqual({"2022-10-10": {"2022-10-20": 2701.84}}, self.matrix.to_dict())
+
+    def test_dense_output(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-12": 100}})
+        self.matrix.merge({"2022-10-13": {"2022-10-14": 200}})
+        self.assertEqual(
+            {
+                "2022-10-12": {"2022-10-12": 100, "2022-10-14": None},
+                "2022-10-13": {"2022-10-12": None, "2022-10-14": 200},
+            },
+            self.matrix.to_dict(),
+        )
+
+    def test_merge_rows_with_other_return_dates(self):
+        self.matrix.merge(
+            {"2022-10-12": {"2022-10-12": 100, "2022-10-13": 0}},
+            {
+                "2022-10-13": {"2022-10-13": 200, "2022-10-14": 300},
+                "2022-10-14": {"2022-10-14": 400},
+            },
+        )
+        self.assertEqual(5, int(self.matrix.known.sum()))
+        self.assertEqual(
+            {
+                "2022-10-12": {"2022-10-12": 100, "2022-10-13": 0, "2022-10-14": None},
+                "2022-10-13": {
+                    "2022-10-12": None,
+                    "2022-10-13": 200,
+                    "2022-10-14": 300,
+                },
+                "2022-10-14": {
+                    "2022-10-12": None,
+                    "2022-10-13": None,
+                    "2022-10-14": 400,
+                },
+            },
+            self.matrix.to_dict(),
+        )
+
+    def test_unknown_cells_are_not_merged(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-12": 100, "2022-10-13": None}})
+        self.assertFalse(self.matrix.known[0, 1])
+        self.assertEqual({"2022-10-12": {"2022-10-12": 100}}, self.matrix.to_dict())
+
+    def test_views(self):
+        self.matrix.merge(
+            {
+                "2022-10-12": {"2022-10-12": 100, "2022-10-13": 90, "2022-10-14": 0},
+                "2022-10-13": {"2022-10-14": 80},
+            }
+        )
+        views = self.matrix.views(top_k=2)
+        self.assertEqual(
+            {0: 100, 1: 80, 2: None},
+            {
+                days: views["by_trip_length"].get(days, {}).get("price")
+                for days in range(3)
+            },
+        )
+        self.assertEqual("2022-10-13", views["by_trip_length"][1]["departure_date"])
+        self.assertEqual(
+            {"wednesday": 90, "thursday": 80},
+            {day: cell["price"] for day, cell in views["by_weekday"].items()},
+        )
+        self.assertEqual([80, 90], [cell["price"] for cell in views["top"]])
+        self.assertEqual(
+            {"2022-10-12": 90, "2022-10-13": 80}, views["min_by_departure"]
+        )
+        self.assertEqual(80, views["min_by_return"]["2022-10-14"])
+
+    def test_views_empty(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-13": 0}})
+        self.assertEqual([], self.matrix.views()["top"])
+        self.assertEqual({}, self.matrix.views()["by_trip_length"])
+
+    def test_compact(self):
+        self.matrix.merge(
+            {
+                "2022-10-12": {"2022-10-12": 100, "2022-10-13": 0},
+                "2022-10-13": {"2022-10-14": 80},
+            }
+        )
+        self.assertEqual(
+            {
+                "first_date": "2022-10-12",
+                "departures": [0, 1],
+                "returns": [0, 1, 2],
+                "prices": [100, 0, None, None, None, 80],
+            },
+            self.matrix.to_compact(),
+        )
+
+    def test_from_dict(self):
+        flights = {"2022-10-13": {"2022-10-13": 20, "2022-10-20": 0}}
+        matrix = PriceMatrix.from_dict(flights)
+        self.assertEqual(flights, matrix.to_dict())
+        self.assertEqual({}, PriceMatrix.from_dict({}).to_dict())
+
+
+class TestCheapestPriceMatrix(TestCase):
+    def setUp(self) -> None:
+        self.matrix = CheapestPriceMatrix(date(2022, 10, 12), 3)
+
+    def test_keeps_cheapest_source(self):
+        self.matrix.merge(
+            {"2022-10-12": {"2022-10-13": 500, "2022-10-14": 0}}, source=0
+        )
+        self.matrix.merge(
+            {"2022-10-12": {"2022-10-13": 600, "2022-10-14": 450}}, source=1
+        )
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": 500, "2022-10-14": 450}},
+            self.matrix.to_dict(),
+        )
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": "A", "2022-10-14": "B"}},
+            self.matrix.sources_to_dict(["A", "B"]),
+        )
+
+    def test_unavailable_cell_has_no_source(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-13": 0}}, source=0)
+        self.assertEqual(
+            {"2022-10-12": {"2022-10-13": None}}, self.matrix.sources_to_dict(["A"])
+        )
+
+    def test_sources_grow_with_the_grid(self):
+        self.matrix.merge({"2022-10-12": {"2022-10-12": 100}}, source=1)
+        self.matrix.merge({"2022-10-10": {"2022-10-20": 200}}, source=0)
+        self.assertEqual((11, 11), self.matrix.sources.shape)
+        self.assertEqual(1, self.matrix.sources[2, 2])
+        self.assertEqual(0, self.matrix.sources[0, 10])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from unittest import TestCase
+
+from metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(TestCase):
+    def setUp(self) -> None:
+        self.registry = MetricsRegistry()
+
+    def test_counter_with_labels(self):
+        errors = self.registry.counter("errors_total", "Errors", ("code",))
+        errors.inc(code="503")
+        errors.inc(2, code="503")
+        errors.inc(code="timeout")
+        self.assertEqual(3, errors.value(code="503"))
+        text = self.registry.render()
+        self.assertIn("# TYPE errors_total counter", text)
+        self.assertIn('errors_total{code="503"} 3\n', text)
+        self.assertIn('errors_total{code="timeout"} 1\n', text)
+
+    def test_wrong_labels(self):
+        errors = self.registry.counter("errors_total", "Errors", ("code",))
+        with self.assertRaises(ValueError):
+            errors.inc()
+
+    def test_duplicated_name(self):
+        self.registry.counter("errors_total", "Errors")
+        with self.assertRaises(ValueError):
+            self.registry.gauge("errors_total", "Errors")
+
+    def test_gauge(self):
+        in_progress = self.registry.gauge("in_progress", "Running")
+        in_progress.inc()
+        in_progress.inc()
+        in_progress.dec()
+        self.assertIn("in_progress 1\n", self.registry.render())
+
+    def test_function_is_read_on_render(self):
+        values = [1]
+        self.registry.gauge("ratio", "Ratio", function=lambda: values[-1])
+        values.append(0.25)
+        self.assertIn("ratio 0.25\n", self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        latency = self.registry.histogram(
+            "latency_seconds", "Latency", buckets=(0.1, 1)
+        )
+        for seconds in (0.05, 0.1, 0.5, 3):
+            latency.observe(seconds)
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 3\n', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn("latency_seconds_sum 3.65\n", text)
+        self.assertIn("latency_seconds_count 4\n", text)
+        self.assertEqual(4, latency.count())
+
+    def test_label_values_are_escaped(self):
+        errors = self.registry.counter("errors_total", "Errors", ("code",))
+        errors.inc(code='a"b')
+        self.assertIn('errors_total{code="a\\"b"} 1\n', self.registry.render())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from datetime import date, timedelta
+from unittest import TestCase
+
+from planner import WINDOW_DAYS, plan_cost, plan_windows, window_cells
+
+
+def needed_cells(first_date: date, days: int) -> set:
+    return {
+        (first_date + timedelta(days=dep), first_date + timedelta(days=ret))
+        for dep in range(days)
+        for ret in range(dep, days)
+    }
+
+
+class TestPlanner(TestCase):
+    first_date = date(2022, 10, 12)
+
+    def assertCovers(self, windows, days, covered=()):
+        cells = set(covered)
+        for window in windows:
+            cells |= window_cells(*window)
+        self.assertLessEqual(needed_cells(self.first_date, days), cells)
+
+    def test_same_windows_as_fixed_grid(self):
+        windows = plan_windows(self.first_date, 21)
+        self.assertEqual(6, len(windows))
+        self.assertEqual((self.first_date, self.first_date), windows[0])
+        self.assertEqual(
+            (
+                self.first_date + timedelta(days=14),
+                self.first_date + timedelta(days=14),
+            ),
+            windows[-1],
+        )
+        self.assertCovers(windows, 21)
+
+    def test_arbitrary_number_of_days(self):
+        for days in (1, 6, 7, 8, 30, 90):
+            windows = plan_windows(self.first_date, days)
+            self.assertCovers(windows, days)
+            self.assertEqual(0, plan_cost(days, windows)["calls_saved"])
+
+    def test_skips_covered_cells(self):
+        covered = window_cells(self.first_date, self.first_date) | window_cells(
+            self.first_date, self.first_date + timedelta(days=WINDOW_DAYS)
+        )
+        windows = plan_windows(self.first_date, 21, covered)
+        self.assertEqual(4, len(windows))
+        self.assertCovers(windows, 21, covered)
+        self.assertEqual(
+            {"windows": 4, "naive_windows": 6, "calls_saved": 2},
+            plan_cost(21, windows),
+        )
+
+    def test_shifted_cache_never_costs_more_than_grid(self):
+        covered = window_cells(
+            self.first_date + timedelta(days=3), self.first_date + timedelta(days=3)
+        )
+        windows = plan_windows(self.first_date, 21, covered)
+        self.assertLessEqual(len(windows), 6)
+        self.assertCovers(windows, 21, covered)
+
+    def test_fully_covered(self):
+        covered = needed_cells(self.first_date, 21)
+        self.assertEqual([], plan_windows(self.first_date, 21, covered))
+
+
+if __name__ == "__main__":
+    unittest.main()
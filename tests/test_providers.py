@@ -0,0 +1,139 @@
+import unittest
+from datetime import date, timedelta
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+
+from benchmarks.mock_latam import build_bestprices
+from cache import TTLCache
+from http_client import HttpSession
+from providers import MultiProviderFinder, create_finder, parse_providers
+from ratelimit import get_circuit_breaker
+from scrapers import StubFinder
+from validators import FlightData
+
+
+class TestParseProviders(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(("latam", "stub"), parse_providers(" LATAM,stub,latam,"))
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            parse_providers("latam,gol")
+        with self.assertRaises(ValueError):
+            parse_providers("")
+
+
+class TestMultiProviderFinder(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        get_circuit_breaker().reset()
+        self.today = date.today()
+        self.flight = FlightData(
+            departure_date=self.today.strftime("%Y-%m-%d"),
+            origin="CGH",
+            destination="VIX",
+            days=2,
+        )
+        self.first, self.second = (
+            (self.today + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(2)
+        )
+
+    def test_create_finder(self):
+        self.assertIsInstance(create_finder(self.flight, ("stub",)), StubFinder)
+        self.assertIsInstance(
+            create_finder(self.flight, ("latam", "stub")), MultiProviderFinder
+        )
+
+    async def test_cheapest_price_of_each_cell(self):
+        async def latam_flights(finder):
+            return 100, {self.first: {self.first: 100, self.second: 300}}
+
+        async def stub_flights(finder):
+            return 200, {self.first: {self.first: 200, self.second: 250}}
+
+        with mock.patch(
+            "scrapers.LatamFinder.get_all_flights", latam_flights
+        ), mock.patch("scrapers.StubFinder.get_all_flights", stub_flights):
+            finder = create_finder(self.flight, ("latam", "stub"))
+            best_price, all_flights = await finder.get_all_flights()
+
+        self.assertEqual(100, best_price)
+        self.assertEqual({self.first: {self.first: 100, self.second: 250}}, all_flights)
+        self.assertEqual(
+            {self.first: {self.first: "latam", self.second: "stub"}}, finder.airlines
+        )
+        self.assertEqual(100, finder.views["top"][0]["price"])
+
+    async def test_failing_provider_leaves_the_others(self):
+        async def stub_flights(finder):
+            raise httpx.ConnectError("down")
+
+        with mock.patch(
+            "scrapers.LatamFinder.get_all_flights",
+            mock.AsyncMock(return_value=(100, {self.first: {self.first: 100}})),
+        ), mock.patch("scrapers.StubFinder.get_all_flights", stub_flights):
+            finder = create_finder(self.flight, ("latam", "stub"))
+            best_price, all_flights = await finder.get_all_flights()
+
+        self.assertEqual(100, best_price)
+        self.assertEqual({self.first: {self.first: "latam"}}, finder.airlines)
+
+    async def test_iter_flights_of_every_provider(self):
+        async def latam_flights(finder):
+            yield {"flights": {self.first: {self.first: 100}}, "best_price": 100}
+
+        async def stub_flights(finder):
+            yield {"flights": {self.first: {self.first: 90}}, "best_price": 90}
+            yield {"flights": {self.second: {self.second: 120}}, "best_price": 90}
+
+        with mock.patch("scrapers.LatamFinder.iter_flights", latam_flights), mock.patch(
+            "scrapers.StubFinder.iter_flights", stub_flights
+        ):
+            finder = create_finder(self.flight, ("latam", "stub"))
+            responses = [response async for response in finder.iter_flights()]
+
+        self.assertEqual(3, len(responses))
+        self.assertEqual(90, responses[-1]["best_price"])
+        self.assertEqual(
+            {"latam": 1, "stub": 2},
+            {
+                airline: sum(response["airline"] == airline for response in responses)
+                for airline in ("latam", "stub")
+            },
+        )
+        self.assertEqual("stub", finder.airlines[self.first][self.first])
+        self.assertEqual("stub", finder.airlines[self.second][self.second])
+
+    async def test_search_through_each_provider_url(self):
+        def handler(request):
+            price_scale = 0.9 if request.url.port == 8002 else 1.0
+            departure = date.fromisoformat(request.url.params["departure"])
+            return_ = date.fromisoformat(request.url.params["return"])
+            return httpx.Response(
+                200, json=build_bestprices(departure, return_, price_scale=price_scale)
+            )
+
+        session = HttpSession(transport=httpx.MockTransport(handler))
+        with mock.patch("scrapers.get_session", return_value=session), mock.patch(
+            "scrapers.LATAM_BESTPRICES_URL", "http://127.0.0.1:8001/bestprices"
+        ), mock.patch(
+            "scrapers.STUB_BESTPRICES_URL", "http://127.0.0.1:8002/bestprices"
+        ):
+            finder = create_finder(self.flight, ("latam", "stub"), cache=TTLCache())
+            best_price, all_flights = await finder.get_all_flights()
+        await session.aclose()
+
+        self.assertEqual(450, best_price)
+        self.assertEqual(
+            {"stub"},
+            {
+                airline
+                for return_dates in finder.airlines.values()
+                for airline in return_dates.values()
+                if airline is not None
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
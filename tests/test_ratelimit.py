@@ -0,0 +1,134 @@
+import asyncio
+import fcntl
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from pathlib import Path
+from unittest import TestCase, mock
+
+from ratelimit import CircuitBreaker, TokenBucket, backoff_delay, parse_retry_after
+
+
+class TestTokenBucket(TestCase):
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate=2, burst=2, path=None)
+        with mock.patch("ratelimit.time.time", return_value=100):
+            bucket._state[1] = 100
+            self.assertEqual(0, bucket._take())
+            self.assertEqual(0, bucket._take())
+            self.assertEqual(0.5, bucket._take())
+        with mock.patch("ratelimit.time.time", return_value=100.5):
+            self.assertEqual(0, bucket._take())
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=100, burst=10, path=None)
+        bucket.pause(5)
+        self.assertGreater(bucket._take(), 4)
+        self.assertGreater(bucket.stats["blocked_for"], 4)
+
+    def test_shared_by_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(Path(tmp_dir) / "bucket.state")
+            first = TokenBucket(rate=0.001, burst=2, path=path)
+            second = TokenBucket(rate=0.001, burst=2, path=path)
+            self.assertEqual(0, first._take())
+            self.assertEqual(0, second._take())
+            self.assertGreater(first._take(), 0)
+            second.pause(5)
+            self.assertGreater(first.stats["blocked_for"], 4)
+
+    def test_does_not_block_on_the_lock_of_another_worker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(Path(tmp_dir) / "bucket.state")
+            bucket = TokenBucket(rate=100, burst=10, path=path)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.assertFalse(bucket.try_acquire())
+
+            async def acquire():
+                asyncio.get_running_loop().call_later(0.01, os.close, fd)
+                await bucket.acquire()
+
+            asyncio.run(acquire())
+            self.assertGreater(bucket.stats["lock_busy"], 1)
+            self.assertEqual(9, int(bucket.stats["tokens"]))
+
+    def test_pause_while_another_worker_holds_the_lock(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = str(Path(tmp_dir) / "bucket.state")
+            first = TokenBucket(rate=100, burst=10, path=path)
+            second = TokenBucket(rate=100, burst=10, path=path)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            first.pause(5)
+            self.assertGreater(first.stats["blocked_for"], 4)
+            self.assertEqual(0, second.stats["blocked_for"])
+            os.close(fd)
+            # Written by the next update of the worker that paused
+            self.assertGreater(first._take(), 4)
+            self.assertGreater(second._take(), 4)
+
+    def test_acquire_waits_for_token(self):
+        bucket = TokenBucket(rate=50, burst=1, path=None)
+
+        async def acquire_twice():
+            await bucket.acquire()
+            await bucket.acquire()
+
+        asyncio.run(acquire_twice())
+        self.assertEqual(1, bucket.stats["waits"])
+
+
+class TestCircuitBreaker(TestCase):
+    def test_opens_after_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        self.assertFalse(breaker.allow())
+        self.assertEqual(1, breaker.stats["trips"])
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+
+    def test_half_open_lets_one_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        with mock.patch("ratelimit.time.monotonic", return_value=100):
+            breaker.record_failure()
+        with mock.patch("ratelimit.time.monotonic", return_value=131):
+            self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(CircuitBreaker.OPEN, breaker.state)
+        with mock.patch("ratelimit.time.monotonic", return_value=162):
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(CircuitBreaker.CLOSED, breaker.state)
+        self.assertEqual(1, breaker.stats["trips"])
+
+
+class TestRetry(TestCase):
+    def test_backoff_delay(self):
+        with mock.patch("ratelimit.random.uniform", side_effect=lambda a, b: b):
+            self.assertEqual([0.5, 1, 2, 4, 8, 8], [backoff_delay(n) for n in range(6)])
+
+    def test_parse_retry_after(self):
+        self.assertEqual(120, parse_retry_after("120"))
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+        self.assertAlmostEqual(
+            60, parse_retry_after(format_datetime(retry_at)), delta=2
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import asyncio
+import tempfile
+import unittest
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import IsolatedAsyncioTestCase, mock
+
+import httpx
+
+from benchmarks.mock_latam import build_bestprices
+from cache import SQLiteCache, TTLCache
+from http_client import HttpSession
+from ratelimit import get_circuit_breaker
+from refresher import PriceRefresher, parse_watched_routes
+from validators import FlightData
+
+
+def flight(origin="CGH", destination="VIX", offset=0, days=3):
+    return FlightData(
+        departure_date=(date.today() + timedelta(days=offset)).strftime("%Y-%m-%d"),
+        origin=origin,
+        destination=destination,
+        days=days,
+    )
+
+
+class TestParseWatchedRoutes(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(
+            [("CGH", "VIX", 30, 0), ("GRU", "GIG", 21, 0), ("CGH", "SDU", 14, 7)],
+            parse_watched_routes("cgh-vix:30, GRU-GIG,CGH-SDU:14:7,"),
+        )
+
+
+class TestPriceRefresher(IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        get_circuit_breaker().reset()
+        self.today = date.today()
+        self.flights = {
+            (self.today + timedelta(days=dep)).strftime("%Y-%m-%d"): {
+                (self.today + timedelta(days=ret)).strftime("%Y-%m-%d"): 100
+                + 10 * dep
+                + ret
+                for ret in range(5)
+            }
+            for dep in range(5)
+        }
+
+        async def get_all_flights(finder):
+            return 100, self.flights
+
+        self._get_all_flights = get_all_flights
+
+    async def test_refresh_and_lookup(self):
+        refresher = PriceRefresher([("CGH", "VIX", 5, 0)])
+        with mock.patch("scrapers.LatamFinder.get_all_flights", self._get_all_flights):
+            self.assertEqual(1, await refresher.refresh_once())
+        best_price, all_flights, views, airlines, matrix, _ = refresher.lookup(
+            flight(offset=1, days=3)
+        )
+        self.assertEqual(111, best_price)
+        self.assertEqual(3, len(all_flights))
+        self.assertEqual(
+            3, len(all_flights[(self.today + timedelta(days=1)).isoformat()])
+        )
+        self.assertEqual(111, views["top"][0]["price"])
+        self.assertIsNone(airlines)
+        self.assertEqual(all_flights, matrix.to_dict())
+
+    async def test_lookup_outside_range_or_too_old(self):
+        refresher = PriceRefresher([("CGH", "VIX", 5, 0)], max_age=60)
+        self.assertIsNone(refresher.lookup(flight()))
+        with mock.patch("scrapers.LatamFinder.get_all_flights", self._get_all_flights):
+            await refresher.refresh_once()
+        self.assertIsNone(refresher.lookup(flight(offset=3, days=3)))
+        self.assertIsNone(refresher.lookup(flight(destination="GIG")))
+        with mock.patch("refresher.time.time", return_value=10**10):
+            self.assertIsNone(refresher.lookup(flight()))
+
+    async def test_refresh_only_due_routes(self):
+        refresher = PriceRefresher([("CGH", "VIX", 5, 0)], interval=60)
+        with mock.patch("scrapers.LatamFinder.get_all_flights", self._get_all_flights):
+            self.assertEqual(1, await refresher.refresh_once())
+            self.assertEqual(0, await refresher.refresh_once())
+
+    async def test_most_requested_route_first(self):
+        refresher = PriceRefresher(
+            [("CGH", "VIX", 5, 0), ("CGH", "GIG", 5, 0)], max_concurrent=1
+        )
+        refreshed = []
+
+        async def get_all_flights(finder):
+            refreshed.append(finder._destination)
+            return 100, self.flights
+
+        with mock.patch("scrapers.LatamFinder.get_all_flights", get_all_flights):
+            await refresher.refresh_once()
+            await refresher.refresh_once()
+            refresher.record_request(flight(destination="GIG"))
+            with mock.patch("refresher.time.time", return_value=10**10):
+                await refresher.refresh_once()
+        self.assertEqual(["VIX", "GIG", "GIG"], refreshed)
+
+    async def test_skips_while_circuit_is_open(self):
+        refresher = PriceRefresher([("CGH", "VIX", 5, 0)])
+        breaker = get_circuit_breaker()
+        for _ in range(10):
+            breaker.record_failure()
+        with mock.patch("scrapers.LatamFinder.get_all_flights") as mock_latam:
+            self.assertEqual(0, await refresher.refresh_once())
+        mock_latam.assert_not_called()
+
+    async def test_refreshed_windows_written_to_the_cache(self):
+        requested_urls = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            requested_urls.append(str(request.url))
+            departure = date.fromisoformat(request.url.params["departure"])
+            return_ = date.fromisoformat(request.url.params["return"])
+            return httpx.Response(200, json=build_bestprices(departure, return_))
+
+        cache = TTLCache()
+        refresher = PriceRefresher([("CGH", "VIX", 5, 0)], interval=0, cache=cache)
+        session = HttpSession(transport=httpx.MockTransport(handler))
+        with mock.patch("scrapers.get_session", return_value=session):
+            await refresher.refresh_once()
+            self.assertEqual(1, len(cache))
+            # Not served from the cache it writes to
+            await refresher.refresh_once()
+        await session.aclose()
+        self.assertEqual(2, len(requested_urls))
+
+    def test_one_leader_with_a_shared_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lock_path = str(Path(tmp_dir) / "refresher.lock")
+            cache = SQLiteCache(str(Path(tmp_dir) / "cache.sqlite3"))
+            first, second = (
+                PriceRefresher([("CGH", "VIX", 5, 0)], cache=cache, lock_path=lock_path)
+                for _ in range(2)
+            )
+            self.assertTrue(first._lead())
+            self.assertFalse(second._lead())
+            self.assertTrue(first.stats["leader"])
+            self.assertFalse(second.stats["leader"])
+            # Another worker takes over when the leader stops
+            asyncio.run(first.stop())
+            self.assertTrue(second._lead())
+            asyncio.run(second.stop())
+
+    def test_every_worker_leads_with_its_own_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lock_path = str(Path(tmp_dir) / "refresher.lock")
+            first, second = (
+                PriceRefresher(
+                    [("CGH", "VIX", 5, 0)], cache=TTLCache(), lock_path=lock_path
+                )
+                for _ in range(2)
+            )
+            self.assertTrue(first._lead())
+            self.assertTrue(second._lead())
+            self.assertTrue(second.stats["leader"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from scheduler import RequestScheduler, SearchLimiter
+
+
+class TestRequestScheduler(IsolatedAsyncioTestCase):
+    async def test_bounds_concurrent_requests(self):
+        scheduler = RequestScheduler(max_concurrent=2)
+        running = []
+
+        async def request():
+            running.append(scheduler.stats["running"])
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(scheduler.run(request) for _ in range(6)))
+        self.assertEqual(2, max(running))
+        self.assertEqual(6, scheduler.stats["completed"])
+
+
+class TestSearchLimiter(IsolatedAsyncioTestCase):
+    async def test_waits_for_a_free_slot(self):
+        limiter = SearchLimiter(max_concurrent=1, max_waiting=1, queue_timeout=1)
+        self.assertTrue(await limiter.acquire())
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(1, limiter.stats["waiting"])
+        limiter.release()
+        self.assertTrue(await waiting)
+        self.assertEqual(
+            {"max_concurrent": 1, "running": 1, "waiting": 0, "rejected": 0},
+            limiter.stats,
+        )
+
+    async def test_rejects_when_the_queue_is_full(self):
+        limiter = SearchLimiter(max_concurrent=1, max_waiting=1, queue_timeout=1)
+        self.assertTrue(await limiter.acquire())
+        waiting = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertFalse(await limiter.acquire())
+        limiter.release()
+        self.assertTrue(await waiting)
+        self.assertEqual(1, limiter.stats["rejected"])
+
+    async def test_rejects_after_queue_timeout(self):
+        limiter = SearchLimiter(max_concurrent=1, max_waiting=10, queue_timeout=0.01)
+        self.assertTrue(await limiter.acquire())
+        self.assertFalse(await limiter.acquire())
+        limiter.release()
+        self.assertTrue(await limiter.acquire())
+        self.assertEqual(1, limiter.stats["rejected"])
+
+    async def test_free_slot_with_no_queue_timeout(self):
+        limiter = SearchLimiter(max_concurrent=2, max_waiting=0, queue_timeout=0)
+        self.assertTrue(await limiter.acquire())
+        self.assertTrue(await limiter.acquire())
+        self.assertFalse(await limiter.acquire())
+
+    async def test_takes_many_slots(self):
+        limiter = SearchLimiter(max_concurrent=3, max_waiting=2, queue_timeout=1)
+        self.assertTrue(await limiter.acquire(2))
+        batch = asyncio.ensure_future(limiter.acquire(3))
+        await asyncio.sleep(0)
+        # Waits behind the batch, even if a slot is free
+        single = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(2, limiter.stats["waiting"])
+        limiter.release(2)
+        self.assertTrue(await batch)
+        self.assertFalse(single.done())
+        limiter.release(3)
+        self.assertTrue(await single)
+        self.assertEqual(1, limiter.stats["running"])
+
+    async def test_timed_out_slots_are_not_taken(self):
+        limiter = SearchLimiter(max_concurrent=1, max_waiting=1, queue_timeout=0.01)
+        self.assertTrue(await limiter.acquire())
+        self.assertFalse(await limiter.acquire())
+        limiter.release()
+        self.assertEqual(
+            {"max_concurrent": 1, "running": 0, "waiting": 0, "rejected": 1},
+            limiter.stats,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import time
+import unittest
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from tracing import SamplingProfiler, record_event, span, start_trace
+
+
+class TestTrace(IsolatedAsyncioTestCase):
+    async def test_spans_nest_across_tasks(self):
+        async def window(number):
+            with span("window", number=number):
+                with span("request"):
+                    await asyncio.sleep(0.01)
+
+        with start_trace() as trace:
+            with span("search"):
+                await asyncio.gather(*(window(number) for number in range(3)))
+        summary = trace.summary()
+
+        spans = {span_["id"]: span_ for span_ in summary["spans"]}
+        self.assertEqual(7, len(spans))
+        for span_ in spans.values():
+            if span_["name"] == "window":
+                self.assertEqual("search", spans[span_["parent"]]["name"])
+            if span_["name"] == "request":
+                self.assertEqual("window", spans[span_["parent"]]["name"])
+        self.assertEqual(3, summary["stages"]["request"]["count"])
+        self.assertGreaterEqual(summary["stages"]["request"]["max_ms"], 10)
+
+    async def test_attributes(self):
+        with start_trace() as trace:
+            with span("window", departure_date="2022-10-12") as window:
+                window["cached"] = True
+        self.assertEqual(
+            {"departure_date": "2022-10-12", "cached": True},
+            {
+                key: value
+                for key, value in trace.summary()["spans"][0].items()
+                if key in ("departure_date", "cached")
+            },
+        )
+
+    async def test_span_outside_a_trace_does_nothing(self):
+        with span("window") as window:
+            window["cached"] = True
+        record_event("connection.connect_tcp.started")
+
+    async def test_httpcore_events(self):
+        with start_trace() as trace:
+            with span("http_get"):
+                record_event("connection.connect_tcp.started")
+                record_event("connection.connect_tcp.complete")
+                record_event("http11.receive_response_headers.started")
+                record_event("http11.receive_response_headers.failed")
+        spans = trace.summary()["spans"]
+        self.assertEqual(
+            ["http_get", "connection.connect_tcp", "http11.receive_response_headers"],
+            [span_["name"] for span_ in spans],
+        )
+        self.assertEqual([0, 0], [span_["parent"] for span_ in spans[1:]])
+        self.assertTrue(spans[2]["failed"])
+
+    async def test_open_span_has_no_duration(self):
+        with start_trace() as trace:
+            with span("search"):
+                summary = trace.summary()
+        self.assertIsNone(summary["spans"][0]["duration_ms"])
+        self.assertEqual({}, summary["stages"])
+
+
+class TestSamplingProfiler(TestCase):
+    def test_collapsed_stacks(self):
+        def busy_function():
+            until = time.perf_counter() + 0.1
+            while time.perf_counter() < until:
+                pass
+
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.start()
+        try:
+            busy_function()
+        finally:
+            profiler.stop()
+        lines = profiler.collapsed().splitlines()
+        self.assertTrue(lines)
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertIn("busy_function (test_tracing.py:", stack)
+        self.assertIn("test_collapsed_stacks", stack.split(";busy_function")[0])
+        self.assertGreater(int(count), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
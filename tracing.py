@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+
+from settings import PROFILE_SAMPLE_INTERVAL
+
+# Trace of the search running in the current task, None when it is not traced.
+# Tasks copy the context when created, so the windows of a search share its trace
+_TRACE = contextvars.ContextVar("trace", default=None)
+_PARENT = contextvars.ContextVar("trace_parent", default=None)
+
+
+class Trace:
+    """
+    Spans of one traced search: what each stage took and how they nest
+    """
+
+    def __init__(self):
+        self._started_at = time.perf_counter()
+        self._spans = []
+        # (parent id, stage) -> span opened by an httpcore ".started" event
+        self._pending = {}
+
+    def open(self, name: str, parent: int | None, attributes: dict) -> dict:
+        span = {
+            "id": len(self._spans),
+            "parent": parent,
+            "name": name,
+            "start_ms": (time.perf_counter() - self._started_at) * 1e3,
+            "duration_ms": None,
+            **attributes,
+        }
+        self._spans.append(span)
+        return span
+
+    def close(self, span: dict) -> None:
+        span["duration_ms"] = (time.perf_counter() - self._started_at) * 1e3 - span[
+            "start_ms"
+        ]
+
+    def event(self, event_name: str, parent: int | None) -> None:
+        """
+        Opens a span on a "<stage>.started" event and closes it on the matching
+        "<stage>.complete" or "<stage>.failed"
+        """
+        stage, _, phase = event_name.rpartition(".")
+        key = (parent, stage)
+        if phase == "started":
+            self._pending[key] = self.open(stage, parent, {})
+        elif phase in ("complete", "failed"):
+            current = self._pending.pop(key, None)
+            if current is not None:
+                if phase == "failed":
+                    current["failed"] = True
+                self.close(current)
+
+    def summary(self) -> dict:
+        """
+        :return: Dict: {total_ms:float, stages: {name: {count, total_ms, max_ms}},
+        spans: [{id, parent, name, start_ms, duration_ms, ...attributes}]}.
+        Spans still open (e.g. windows cancelled at the deadline) have no duration.
+        """
+        stages = {}
+        for span in self._spans:
+            if span["duration_ms"] is None:
+                continue
+            stage = stages.setdefault(
+                span["name"], {"count": 0, "total_ms": 0, "max_ms": 0}
+            )
+            stage["count"] += 1
+            stage["total_ms"] += span["duration_ms"]
+            stage["max_ms"] = max(stage["max_ms"], span["duration_ms"])
+        return {
+            "total_ms": round((time.perf_counter() - self._started_at) * 1e3, 3),
+            "stages": {
+                name: {
+                    "count": stage["count"],
+                    "total_ms": round(stage["total_ms"], 3),
+                    "max_ms": round(stage["max_ms"], 3),
+                }
+                for name, stage in stages.items()
+            },
+            "spans": [
+                {
+                    **span,
+                    "start_ms": round(span["start_ms"], 3),
+                    "duration_ms": (
+                        round(span["duration_ms"], 3)
+                        if span["duration_ms"] is not None
+                        else None
+                    ),
+                }
+                for span in self._spans
+            ],
+        }
+
+
+@contextmanager
+def start_trace() -> Iterator[Trace]:
+    """
+    Traces the code run inside, including the tasks it creates
+    """
+    trace = Trace()
+    trace_token = _TRACE.set(trace)
+    parent_token = _PARENT.set(None)
+    try:
+        yield trace
+    finally:
+        _PARENT.reset(parent_token)
+        _TRACE.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """
+    Records the time spent inside as a span of the current trace. Outside a trace
+    it does nothing, so it can stay on the hot path.
+    :return: The span, where more attributes can be set
+    """
+    trace = _TRACE.get()
+    if trace is None:
+        yield {}
+        return
+    current = trace.open(name, _PARENT.get(), attributes)
+    token = _PARENT.set(current["id"])
+    try:
+        yield current
+    finally:
+        _PARENT.reset(token)
+        trace.close(current)
+
+
+def record_event(event_name: str) -> None:
+    """
+    Turns the httpcore trace events (e.g. "connection.connect_tcp.started" and
+    ".complete") into spans of the current trace, so connecting, tls, sending
+    and waiting for the response are timed apart
+    """
+    trace = _TRACE.get()
+    if trace is None:
+        return
+    trace.event(event_name, _PARENT.get())
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of a thread (the event loop one by default) every interval
+    seconds and counts the stacks in the collapsed format of flamegraph.pl and
+    speedscope: "root;caller;function count" per line.
+    Everything running on the thread is sampled, not only the profiled search.
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self._interval = interval
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id: int | None = None) -> None:
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._sample, args=(target,), name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def collapsed(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        )
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self._stacks[";".join(reversed(names))] += 1
@@ -1,23 +1,173 @@
 from datetime import date
+from typing import List, Optional
 
-from pydantic import BaseModel, validator, constr, condate
+from pydantic import (
+    BaseModel,
+    root_validator,
+    validator,
+    confloat,
+    constr,
+    condate,
+    conint,
+)
 
-from airports import load_airports
+from airports import get_airport_registry
+from settings import BATCH_MAX_ROUTES, SEARCH_DEFAULT_DAYS, SEARCH_MAX_DAYS
 
 
 class FlightData(BaseModel):
     departure_date: condate(ge=date.today())
     origin: constr(to_upper=True)
     destination: constr(to_upper=True)
+    weeks: Optional[conint(ge=1)] = None
+    days: Optional[int] = None
 
-    @validator('origin', 'destination')
+    @validator("origin", "destination")
     def check_airports_on_db(cls, v, values, field):
-        if load_airports().get(v) is None:
-            raise ValueError(f'{field.name.upper()} not found.')
+        if get_airport_registry().get(v) is None:
+            raise ValueError(f"{field.name.upper()} not found.")
         return v
 
-    @validator('destination')
+    @validator("destination")
     def check_airports_not_equal(cls, v, values, field):
-        if v == values.get('origin'):
-            raise ValueError(f'Origin and destination airports must be diferent')
+        if v == values.get("origin"):
+            raise ValueError(f"Origin and destination airports must be diferent")
+        return v
+
+    @validator("days", always=True)
+    def check_search_days(cls, v, values):
+        if v is None:
+            v = values["weeks"] * 7 if values.get("weeks") else SEARCH_DEFAULT_DAYS
+        if not 1 <= v <= SEARCH_MAX_DAYS:
+            raise ValueError(
+                f"The search must have between 1 and {SEARCH_MAX_DAYS} days"
+            )
+        return v
+
+
+class BatchSearch(BaseModel):
+    """
+    Many routes searched at once: a list of searches and/or one origin to many
+    destinations sharing the same dates.
+    """
+
+    searches: List[FlightData] = []
+    departure_date: Optional[str] = None
+    origin: Optional[str] = None
+    destinations: List[str] = []
+    weeks: Optional[int] = None
+    days: Optional[int] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_number_of_routes(cls, values):
+        routes = len(values["searches"]) + len(values["destinations"])
+        if not 1 <= routes <= BATCH_MAX_ROUTES:
+            raise ValueError(
+                f"The batch must have between 1 and {BATCH_MAX_ROUTES} routes"
+            )
+        if values["destinations"] and not (
+            values["origin"] and values["departure_date"]
+        ):
+            raise ValueError("Origin and departure date are required with destinations")
+        return values
+
+    def flights(self) -> List[FlightData]:
+        """
+        :return: All the searches of the batch. Raises ValidationError for an invalid destination.
+        """
+        return self.searches + [
+            FlightData(
+                departure_date=self.departure_date,
+                origin=self.origin,
+                destination=destination,
+                weeks=self.weeks,
+                days=self.days,
+            )
+            for destination in self.destinations
+        ]
+
+
+class MetroFlightData(BaseModel):
+    """
+    Search between metro areas (e.g. SAO: CGH and GRU) or airports. Every
+    origin x destination airport pair is searched.
+    """
+
+    departure_date: str
+    origin: constr(to_upper=True)
+    destination: constr(to_upper=True)
+    weeks: Optional[int] = None
+    days: Optional[int] = None
+
+    @validator("origin", "destination")
+    def check_codes_on_db(cls, v, values, field):
+        if not get_airport_registry().expand(v):
+            raise ValueError(f"{field.name.upper()} not found.")
+        return v
+
+    @validator("destination")
+    def check_codes_not_equal(cls, v, values, field):
+        if v == values.get("origin"):
+            raise ValueError(f"Origin and destination airports must be diferent")
+        return v
+
+    def flights(self) -> List[FlightData]:
+        """
+        :return: One search for each airport pair. Raises ValidationError for invalid dates.
+        """
+        registry = get_airport_registry()
+        pairs = [
+            (origin, destination)
+            for origin in registry.expand(self.origin)
+            for destination in registry.expand(self.destination)
+            if origin != destination
+        ]
+        return [
+            FlightData(
+                departure_date=self.departure_date,
+                origin=origin,
+                destination=destination,
+                weeks=self.weeks,
+                days=self.days,
+            )
+            for origin, destination in pairs
+        ]
+
+
+class AlertRule(BaseModel):
+    """
+    Price drop alert: notifies when a flight of the route with departure (and
+    return, when given) in the date ranges costs less than threshold.
+    """
+
+    origin: constr(to_upper=True)
+    destination: constr(to_upper=True)
+    departure_from: condate(ge=date.today())
+    departure_to: date
+    return_from: Optional[date] = None
+    return_to: Optional[date] = None
+    threshold: confloat(gt=0)
+
+    @validator("origin", "destination")
+    def check_airports_on_db(cls, v, values, field):
+        if get_airport_registry().get(v) is None:
+            raise ValueError(f"{field.name.upper()} not found.")
+        return v
+
+    @validator("destination")
+    def check_airports_not_equal(cls, v, values, field):
+        if v == values.get("origin"):
+            raise ValueError(f"Origin and destination airports must be diferent")
+        return v
+
+    @validator("departure_to")
+    def check_departure_range(cls, v, values):
+        if values.get("departure_from") and v < values["departure_from"]:
+            raise ValueError("departure_to must not be before departure_from")
+        return v
+
+    @validator("return_to")
+    def check_return_range(cls, v, values):
+        if v is not None and values.get("return_from") and v < values["return_from"]:
+            raise ValueError("return_to must not be before return_from")
         return v